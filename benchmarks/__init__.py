@@ -0,0 +1,3 @@
+"""
+offline benchmarks of the scrape -> extract -> store pipeline, run with `python -m benchmarks.run`.
+"""
@@ -0,0 +1,203 @@
+"""
+contains the fixtures of the benchmarks, derived from the files in `documentation/resources`.
+
+Listing pages are synthesized from `page.html` with unique publication numbers per page. The scanned PDFs have no
+recorded OCR results in the repo, their results are synthesized from the text layer of the digital PDF and served by
+the LocalDocumentAnalysisClient, which stands in for the Document Intelligence endpoint.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+from datetime import date
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+import lxml.html
+import pymupdf
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.core.exceptions import HttpResponseError
+
+from src.extract_text import extract_text_digital
+from src.ocr import OCR_MODEL_ID
+
+RESOURCES_DIR = Path(__file__).parents[1] / "documentation" / "resources"
+LISTING_PAGE = RESOURCES_DIR / "page.html"
+PDFS = [RESOURCES_DIR / name for name in ("18097854.pdf", "19071901.pdf", "19335491.pdf")]
+
+LISTING_XPATH = "/html/body/div/div[4]/div/main/div[2]/div/div[*]"
+PUB_DATE_AND_NUMBER = re.compile(r"\d{4}-\d{2}-\d{2} / \d+")
+PDF_URL = re.compile(r"/tsv_pdf/\d{4}/\d{2}/\d{2}/\d+\.pdf")
+
+__all__ = [
+    "PDFS",
+    "LocalDocumentAnalysisClient",
+    "listing_page",
+    "digital_pdfs",
+    "scanned_pdfs",
+    "synthesize_ocr_result",
+    "record_ocr_results",
+]
+
+
+class _LocalPoller:
+    def __init__(self, result: AnalyzeResult):
+        self._result = result
+
+    async def result(self) -> AnalyzeResult:
+        return self._result
+
+
+class LocalDocumentAnalysisClient:
+    """stands in for the Document Intelligence endpoint by serving recorded OCR results.
+
+    A recorded result is the `AnalyzeResult.to_dict()` of a PDF saved as `{sha256 of the pdf}.json` in
+    `results_dir`. Latency and throttling of the endpoint can be simulated. Like the azure sdk, the client calls
+    `raw_response_hook` with every response (e.g. `OcrClient.on_response`).
+    """
+
+    def __init__(
+        self,
+        results_dir: str | Path,
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int = 0,
+        raw_response_hook: Optional[Callable] = None,
+    ):
+        """
+        :param results_dir: folder containing the recorded results
+        :param latency: seconds an OCR job takes
+        :param throttle_rate: fraction of the requests that is answered with HTTP 429
+        :param seed: seed of the throttling
+        :param raw_response_hook: called with every response
+        """
+        self.results_dir = Path(results_dir)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.raw_response_hook = raw_response_hook
+        self.num_requests = 0
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def record(results_dir: str | Path, pdf_bytes: bytes, result: AnalyzeResult) -> Path:
+        """saves an OCR result such that it can be served by the LocalDocumentAnalysisClient"""
+        path = Path(results_dir) / f"{hashlib.sha256(pdf_bytes).hexdigest()}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(result.to_dict()))
+        return path
+
+    def _respond(self, status_code: int) -> None:
+        if self.raw_response_hook is not None:
+            self.raw_response_hook(SimpleNamespace(http_response=SimpleNamespace(status_code=status_code)))
+
+    async def begin_analyze_document(self, model_id: str, document: bytes, **kwargs) -> _LocalPoller:
+        self.num_requests += 1
+        if self._random.random() < self.throttle_rate:
+            self._respond(429)
+            error = HttpResponseError(message="Too Many Requests")
+            error.status_code = 429
+            raise error
+
+        path = self.results_dir / f"{hashlib.sha256(document).hexdigest()}.json"
+        if not path.exists():
+            self._respond(404)
+            raise HttpResponseError(message=f"No recorded OCR result for the document ({path.name}).")
+        await asyncio.sleep(self.latency)
+        self._respond(200)
+        return _LocalPoller(AnalyzeResult.from_dict(json.loads(path.read_text())))
+
+    async def close(self) -> None:
+        pass
+
+
+def listing_page(page: int, num_elements: int = 100, publication_date: Optional[date] = None) -> bytes:
+    """synthesizes a listing page with unique publication numbers
+
+    :param page: page number, publication numbers are unique over the pages
+    :param num_elements: number of publication elements on the page (at most 100)
+    :param publication_date: date of all publications, defaults to today (i.e. never before the threshold)
+    :return: html of the listing page
+    """
+    publication_date = publication_date or date.today()
+    tree = lxml.html.fromstring(LISTING_PAGE.read_text(encoding="utf-8"))
+    elements = tree.xpath(LISTING_XPATH)
+    if num_elements > len(elements):
+        raise ValueError(f"The listing page fixture has only {len(elements)} publication elements.")
+
+    for i, element in enumerate(elements):
+        if i >= num_elements:
+            element.getparent().remove(element)
+            continue
+        number = page * 100 + i
+        html = lxml.html.tostring(element, encoding="unicode")
+        html = PUB_DATE_AND_NUMBER.sub(f"{publication_date:%Y-%m-%d} / {number:07d}", html)
+        html = PDF_URL.sub(f"/tsv_pdf/{publication_date:%Y/%m/%d}/{publication_date:%y}{number:06d}.pdf", html)
+        element.getparent().replace(element, lxml.html.fragment_fromstring(html))
+    return lxml.html.tostring(tree, encoding="unicode").encode("utf-8")
+
+
+def digital_pdfs() -> list[Path]:
+    return [path for path in PDFS if _is_digital(path)]
+
+
+def scanned_pdfs() -> list[Path]:
+    return [path for path in PDFS if not _is_digital(path)]
+
+
+def _is_digital(path: Path) -> bool:
+    with pymupdf.open(path) as pdf:
+        return bool(extract_text_digital(pdf))
+
+
+def synthesize_ocr_result(scan: pymupdf.Document, digital: pymupdf.Document) -> AnalyzeResult:
+    """creates an OCR result for the pages of a scan from the text lines of a digital PDF
+
+    Page i of the scan gets the lines of page i (modulo the number of pages) of the digital PDF, scaled to the size
+    of the scanned page. Coordinates are in inch, like the results of Document Intelligence for PDFs.
+    """
+    pages = []
+    for scan_page in scan:
+        digital_page = digital[scan_page.number % len(digital)]
+        sf_x = scan_page.rect.width / digital_page.rect.width / 72
+        sf_y = scan_page.rect.height / digital_page.rect.height / 72
+        lines = []
+        for block in digital_page.get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                content = "".join(span["text"] for span in line["spans"]).strip()
+                if not content:
+                    continue
+                x0, y0, x1, y1 = line["bbox"]
+                x0, x1, y0, y1 = x0 * sf_x, x1 * sf_x, y0 * sf_y, y1 * sf_y
+                polygon = [{"x": x0, "y": y0}, {"x": x1, "y": y0}, {"x": x1, "y": y1}, {"x": x0, "y": y1}]
+                lines.append({"content": content, "polygon": polygon, "spans": []})
+        pages.append(
+            {
+                "page_number": scan_page.number + 1,
+                "width": scan_page.rect.width / 72,
+                "height": scan_page.rect.height / 72,
+                "unit": "inch",
+                "angle": 0,
+                "lines": lines,
+                "words": [],
+                "spans": [],
+            }
+        )
+    return AnalyzeResult.from_dict({"model_id": OCR_MODEL_ID, "content": "", "pages": pages})
+
+
+def record_ocr_results(results_dir: str | Path) -> dict[Path, AnalyzeResult]:
+    """records a synthesized OCR result per scanned PDF fixture, served by the LocalDocumentAnalysisClient
+
+    :param results_dir: folder of the recorded results
+    :return: OCR result per scanned PDF
+    """
+    results = {}
+    with pymupdf.open(digital_pdfs()[0]) as digital:
+        for path in scanned_pdfs():
+            with pymupdf.open(path) as scan:
+                results[path] = synthesize_ocr_result(scan, digital)
+            LocalDocumentAnalysisClient.record(results_dir, path.read_bytes(), results[path])
+    return results
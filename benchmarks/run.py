@@ -0,0 +1,294 @@
+"""
+runs the offline benchmarks and writes the results to a JSON file.
+
+    python -m benchmarks.run [--output results.json] [--baseline previous.json]
+
+Stages:
+- listing: `BaseLegalEntitySpider.parse` (incl. `parse_publications`) of synthesized listing pages
+- digital: `extract_text_digital` of the digital PDF fixtures
+- scan_layout: layout of the (recorded) OCR results of the scanned PDF fixtures
+- pipeline: parse -> extract text (OCR by a local stand-in) -> upload (to memory) of the publications of a listing
+
+Per stage the throughput, p50/p99 latency and the peak RSS of the process after the stage are reported. With
+`--baseline` the exit code is 1 when the throughput of a stage dropped more than `--tolerance` below the baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "src.settings")
+
+import pymupdf  # noqa: E402
+import scrapy  # noqa: E402
+from scrapy.exceptions import DropItem  # noqa: E402
+from scrapy.http import HtmlResponse, Request  # noqa: E402
+from scrapy.utils.project import get_project_settings  # noqa: E402
+
+from benchmarks.fixtures import (  # noqa: E402
+    LocalDocumentAnalysisClient,
+    digital_pdfs,
+    listing_page,
+    record_ocr_results,
+    scanned_pdfs,
+)
+from src.extract_text import extract_text_digital, join_lines, layout_page  # noqa: E402
+from src.index import PublicationIndex  # noqa: E402
+from src.items import LegalEntityItem  # noqa: E402
+from src.ocr import AdaptiveLimiter, OcrClient  # noqa: E402
+from src.metrics import Metrics  # noqa: E402
+from src.pipelines import LegalEntityPipeline  # noqa: E402
+from src.spiders.legal_entities import LegalEntityDateSpider  # noqa: E402
+from src.stats import RunStatistics  # noqa: E402
+from src.storage import MemoryBlobStore, ThreadedBlobStore  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+STAGES = ("listing", "digital", "scan_layout", "pipeline")
+
+
+class OfflineDateSpider(LegalEntityDateSpider):
+    """date spider of which the Azure resources are replaced by local stand-ins"""
+
+    def __init__(self, settings: dict, publication_date: date):
+        scrapy.Spider.__init__(self)
+        self.settings = get_project_settings().copy()
+        self.settings.setdict(settings, priority="cmdline")
+        self.start_date = self.end_date = publication_date
+        self.azure_credential = None
+        self.document_intelligence_url = None
+        self.azure_container_name = "benchmark"
+        self.blob_store = MemoryBlobStore()
+        self.publication_index = PublicationIndex()
+        self.run_statistics = RunStatistics(self.publication_index)
+
+
+class OfflinePipeline(LegalEntityPipeline):
+    def __init__(self, ocr_results_dir: Path, ocr_latency: float):
+        super().__init__()
+        self.ocr_results_dir = ocr_results_dir
+        self.ocr_latency = ocr_latency
+
+    def create_ocr_client(self, spider):
+        limiter = AdaptiveLimiter(
+            spider.settings.getint("OCR_CONCURRENCY"), 1, spider.settings.getint("OCR_MAX_CONCURRENCY")
+        )
+        ocr_client = OcrClient(None, limiter, metrics=spider.metrics)
+        ocr_client.client = LocalDocumentAnalysisClient(
+            self.ocr_results_dir, latency=self.ocr_latency, raw_response_hook=ocr_client.on_response
+        )
+        return ocr_client
+
+    def create_blob_store(self, spider):
+        return ThreadedBlobStore(spider.blob_store)
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024**2 if sys.platform == "darwin" else peak / 1024, 1)  # bytes on macOS, KiB on Linux
+
+
+def summarize(latencies: list[float], total: float, num_units: int, unit: str) -> dict:
+    """:return: throughput (units per second), latency percentiles (ms per operation) and peak RSS"""
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "operations": len(latencies),
+        "unit": unit,
+        "throughput": round(num_units / total, 2),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+        "total_s": round(total, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure(operations: list[Callable[[], int]], unit: str, warmup: int = 1) -> dict:
+    """times every operation, an operation returns the number of processed units"""
+    for operation in operations[:warmup]:
+        operation()
+    latencies, num_units = [], 0
+    start = time.perf_counter()
+    for operation in operations:
+        t0 = time.perf_counter()
+        num_units += operation()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start, num_units, unit)
+
+
+def listing_response(spider: OfflineDateSpider, body: bytes, page: int) -> HtmlResponse:
+    meta = {"start_date": spider.start_date, "end_date": spider.end_date, "page": page}
+    url = spider.format_url(meta)
+    return HtmlResponse(url=url, body=body, encoding="utf-8", request=Request(url, meta=meta))
+
+
+def parse_items(spider: OfflineDateSpider, response: HtmlResponse) -> list[LegalEntityItem]:
+    return [result for result in spider.parse(response) if isinstance(result, LegalEntityItem)]
+
+
+def bench_listing(args: argparse.Namespace) -> dict:
+    publication_date = date.today()
+    spider = OfflineDateSpider({"STREAM_PUBLICATIONS": True}, publication_date)
+    bodies = [listing_page(page, args.elements, publication_date) for page in range(1, args.pages + 1)]
+    responses = [listing_response(spider, body, page) for page, body in enumerate(bodies, start=1)]
+    return measure([lambda response=response: len(parse_items(spider, response)) for response in responses], "items")
+
+
+def bench_digital(args: argparse.Namespace) -> dict:
+    pdfs = [pymupdf.open(path) for path in digital_pdfs()]
+
+    def extract(pdf: pymupdf.Document) -> int:
+        extract_text_digital(pdf, fast=args.fast)
+        return pdf.page_count
+
+    return measure([lambda pdf=pdf: extract(pdf) for _ in range(args.repeat) for pdf in pdfs], "pages")
+
+
+def bench_scan_layout(args: argparse.Namespace, ocr_results_dir: Path) -> dict:
+    results = record_ocr_results(ocr_results_dir)
+    scans = [(pymupdf.open(path), result) for path, result in results.items()]
+
+    def layout(pdf: pymupdf.Document, result) -> int:
+        join_lines(layout_page(ocr_page, scan_page) for ocr_page, scan_page in zip(result.pages, pdf))
+        return pdf.page_count
+
+    return measure([lambda scan=scan: layout(*scan) for _ in range(args.repeat) for scan in scans], "pages")
+
+
+async def bench_pipeline(args: argparse.Namespace, ocr_results_dir: Path) -> dict:
+    record_ocr_results(ocr_results_dir)
+    publication_date = date.today()
+    settings = {
+        "OCR": True,
+        "OCR_CACHE_DIR": None,  # every scan is OCR'ed by the stand-in
+        "EXTRACT_TEXT_EXECUTOR": args.executor,
+        "EXTRACT_TEXT_WORKERS": args.workers,
+        "EXTRACT_TEXT_FAST": args.fast,
+        "PUBLICATION_ENCODING": args.encoding,
+    }
+    spider = OfflineDateSpider(settings, publication_date)
+    if args.metrics:
+        spider.metrics = Metrics()
+    pipeline = OfflinePipeline(ocr_results_dir, args.ocr_latency)
+    pipeline.open_spider(spider)
+    pdfs = [path.read_bytes() for path in digital_pdfs() + scanned_pdfs()]
+
+    # the downloads are simulated by attaching the PDF fixtures to the items
+    items = []
+    for page in range(1, args.pipeline_pages + 1):
+        for item in parse_items(spider, listing_response(spider, listing_page(page, args.elements), page)):
+            item["file_body"] = pdfs[len(items) % len(pdfs)]
+            items.append(item)
+
+    # scrapy processes up to CONCURRENT_ITEMS items of a response in parallel
+    semaphore = asyncio.Semaphore(spider.settings.getint("CONCURRENT_ITEMS", 100))
+    latencies, dropped = [], []
+
+    async def process(item: LegalEntityItem) -> None:
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                await pipeline.process_item(item, spider)
+            except DropItem as e:  # like scrapy, dropped items do not stop the run
+                dropped.append(e)
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(process(item) for item in items))
+    await pipeline._close_spider(spider)
+    total = time.perf_counter() - start
+
+    summary = summarize(latencies, total, pipeline.uploader.num_uploaded, "publications")
+    summary["items_dropped"] = len(dropped)
+    summary["uploads_failed"] = pipeline.uploader.num_failed
+    summary["bytes_uploaded"] = sum(len(data) for data in spider.blob_store.blobs.values())
+    if args.metrics:
+        summary["metrics"] = spider.metrics.to_dict()
+    return summary
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """:return: the stages of which the throughput regressed compared to the baseline"""
+    regressions = []
+    for stage, result in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if previous and result["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{stage}: {result['throughput']} {result['unit']}/s < {previous['throughput']}")
+    return regressions
+
+
+def run(args: argparse.Namespace) -> dict:
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pymupdf": pymupdf.VersionBind,
+        "arguments": vars(args) | {"output": str(args.output), "baseline": str(args.baseline or "")},
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as ocr_results_dir:
+        stages: dict[str, Callable[[], dict | Awaitable[dict]]] = {
+            "listing": lambda: bench_listing(args),
+            "digital": lambda: bench_digital(args),
+            "scan_layout": lambda: bench_scan_layout(args, Path(ocr_results_dir)),
+            "pipeline": lambda: asyncio.run(bench_pipeline(args, Path(ocr_results_dir))),
+        }
+        for stage in args.stages:
+            results["stages"][stage] = stages[stage]()
+            logging.getLogger(__name__).warning(f"{stage}: {results['stages'][stage]}")
+    return results
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "benchmark.json",
+        help="JSON file of the results (default: benchmark.json in the temporary folder)",
+    )
+    parser.add_argument("--baseline", type=Path, help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative drop in throughput")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--pages", type=int, default=20, help="number of synthesized listing pages")
+    parser.add_argument("--elements", type=int, default=100, help="publication elements per listing page")
+    parser.add_argument("--pipeline-pages", type=int, default=1, help="listing pages processed by the pipeline")
+    parser.add_argument("--repeat", type=int, default=10, help="number of times each PDF fixture is processed")
+    parser.add_argument("--executor", choices=("process", "thread"), help="EXTRACT_TEXT_EXECUTOR of the pipeline")
+    parser.add_argument("--workers", type=int, default=2, help="EXTRACT_TEXT_WORKERS of the pipeline")
+    parser.add_argument("--fast", action="store_true", help="EXTRACT_TEXT_FAST of the digital and pipeline stages")
+    parser.add_argument("--encoding", choices=("gzip", "zstd"), help="PUBLICATION_ENCODING of the pipeline")
+    parser.add_argument("--metrics", action="store_true", help="records the metrics of the pipeline stages")
+    parser.add_argument("--ocr-latency", type=float, default=0.0, help="seconds an OCR job of the stand-in takes")
+    args = parser.parse_args(argv)
+
+    # the spiders and pipelines log per publication, which would dominate the timings
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    results = run(args)
+    args.output.write_text(json.dumps(results, indent=2))
+    logging.getLogger(__name__).warning(f"Wrote the results to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        for regression in regressions:
+            logging.getLogger(__name__).error(f"Regression in {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
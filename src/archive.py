@@ -0,0 +1,112 @@
+"""
+contains the HTTP archive used to record the responses of a crawl and replay them offline.
+
+The archive is a folder with an append-only data file holding the (zlib compressed) bodies and an append-only index
+with one JSON line per response: request fingerprint, url, status, headers and the location of the body in the data
+file. A response that is recorded again is appended, the last record of a fingerprint wins.
+"""
+
+import json
+import logging
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from scrapy.http import Headers, Response
+from scrapy.responsetypes import responsetypes
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "HttpArchive",
+]
+
+
+class HttpArchive:
+    DATA_FILE = "responses.dat"
+    INDEX_FILE = "responses.idx"
+
+    def __init__(self, directory: str | Path, writable: bool = False):
+        """
+        :param directory: folder of the archive, created when writable
+        :param writable: opens the archive for recording, otherwise it is read only
+        """
+        self.directory = Path(directory)
+        self.writable = writable
+        if writable:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        elif not (self.directory / self.INDEX_FILE).exists():
+            raise FileNotFoundError(f"No HTTP archive found in {self.directory}, record one first.")
+
+        self._index: dict[str, dict] = {}
+        index_path = self.directory / self.INDEX_FILE
+        if index_path.exists():
+            with index_path.open("r", encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._index[record["fingerprint"]] = record
+
+        # the data file is written before the index, a crash leaves at most an unreferenced body behind
+        self._data = (self.directory / self.DATA_FILE).open("a+b" if writable else "rb")
+        self._index_file = index_path.open("a", encoding="utf-8") if writable else None
+        logger.info(f"Opened HTTP archive {self.directory} with {len(self._index)} responses.")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return fingerprint in self._index
+
+    def write(self, fingerprint: str, response: Response) -> None:
+        """appends the response to the archive
+
+        :param fingerprint: fingerprint of the request of the response
+        :param response: scrapy Response
+        """
+        if not self.writable:
+            raise PermissionError(f"HTTP archive {self.directory} was opened read only.")
+        body = response.body
+        compressed = zlib.compress(body)
+        # PDFs and gzipped pages hardly compress, those are stored as is
+        is_compressed = len(compressed) < 0.9 * len(body)
+        data = compressed if is_compressed else body
+
+        self._data.seek(0, 2)
+        offset = self._data.tell()
+        self._data.write(data)
+        self._data.flush()
+
+        record = {
+            "fingerprint": fingerprint,
+            "url": response.url,
+            "status": response.status,
+            "headers": {
+                key.decode("latin-1"): [value.decode("latin-1") for value in values]
+                for key, values in response.headers.items()
+            },
+            "offset": offset,
+            "length": len(data),
+            "compressed": is_compressed,
+        }
+        self._index_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._index_file.flush()
+        self._index[fingerprint] = record
+
+    def read(self, fingerprint: str) -> Optional[Response]:
+        """:return: the recorded response of the request or None when the request was not recorded"""
+        record = self._index.get(fingerprint)
+        if record is None:
+            return None
+
+        self._data.seek(record["offset"])
+        body = self._data.read(record["length"])
+        body = zlib.decompress(body) if record["compressed"] else body
+        headers = Headers(record["headers"])
+        response_cls = responsetypes.from_args(headers=headers, url=record["url"], body=body)
+        return response_cls(url=record["url"], status=record["status"], headers=headers, body=body, flags=["archived"])
+
+    def close(self) -> None:
+        self._data.close()
+        if self._index_file is not None:
+            self._index_file.close()
@@ -0,0 +1,201 @@
+"""
+contains the checkpoint of a long-range crawl, such that a crawl that died can resume where it stopped.
+
+The progress is tracked per search (a date window or a VAT number): the listing pages that were parsed, the last page
+of the search and the publications that were queued but not yet uploaded. A search is completed when all its pages
+up to the last page were parsed and all its publications were uploaded (or dropped). A search that was split (see
+DateWindowPlanner) is completed when all its parts are completed.
+
+The checkpoint is a small JSON blob, it is written in a background thread at most once every `interval` seconds.
+Without a store the progress is only tracked in memory (see WorkCoordinator).
+"""
+
+import json
+import logging
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from src.storage import BlobStore
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+
+__all__ = [
+    "CrawlCheckpoint",
+]
+
+
+class CrawlCheckpoint:
+    def __init__(self, store: Optional[BlobStore], name: Optional[str], interval: float = 5.0):
+        """
+        :param store: BlobStore in which the checkpoint is saved, None to only track the progress in memory
+        :param name: name of the checkpoint blob
+        :param interval: minimum number of seconds between two writes of the checkpoint
+        """
+        self.store = store
+        self.name = name
+        self.interval = interval
+        self.completed: set[str] = set()
+        self.children: dict[str, list[str]] = {}  # parts of the searches that were split
+        self.pages: dict[str, set[int]] = {}  # parsed pages of the searches that are not completed
+        self.last_page: dict[str, int] = {}
+        self.pending: dict[str, tuple[str, int]] = {}  # publication -> (search, page)
+        self._pending_pages: Counter[tuple[str, int]] = Counter()
+        self._saved_at = 0.0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._write: Optional[Future] = None
+
+    @staticmethod
+    def publication_key(vat: Optional[str], publication_number: Optional[str]) -> str:
+        return f"{vat}/{publication_number}"
+
+    @classmethod
+    def load(cls, store: BlobStore, name: str, interval: float = 5.0) -> "CrawlCheckpoint":
+        """loads the checkpoint from the blob store, a new checkpoint is started when there is none"""
+        checkpoint = cls(store, name, interval)
+        data = store.read(name)
+        if data is None:
+            return checkpoint
+
+        state = json.loads(data)
+        if state.get("version") != CHECKPOINT_VERSION:
+            logger.warning(f"Ignoring checkpoint {name} with unsupported version {state.get('version')}.")
+            return checkpoint
+        checkpoint.completed = set(state["completed"])
+        checkpoint.children = state["children"]
+        for search, progress in state["searches"].items():
+            checkpoint.pages[search] = set(progress["pages"])
+            if progress.get("last_page"):
+                checkpoint.last_page[search] = progress["last_page"]
+        # the pages with pending publications are parsed again, which queues their publications again
+        for search, page in state["pending"].values():
+            checkpoint.pages.get(search, set()).discard(page)
+        logger.info(
+            f"Resuming from checkpoint {name}: {len(checkpoint.completed)} searches completed, "
+            f"{len(state['pending'])} publications were pending."
+        )
+        return checkpoint
+
+    def to_dict(self) -> dict:
+        searches = {
+            search: {"pages": sorted(pages), "last_page": self.last_page.get(search)}
+            for search, pages in self.pages.items()
+        }
+        return {
+            "version": CHECKPOINT_VERSION,
+            "completed": sorted(self.completed),
+            "children": self.children,
+            "searches": searches,
+            "pending": {key: list(value) for key, value in self.pending.items()},
+        }
+
+    def is_completed(self, search: str) -> bool:
+        if search in self.completed:
+            return True
+        children = self.children.get(search)
+        return bool(children) and all(self.is_completed(child) for child in children)
+
+    def remaining(self, search: str) -> list[str]:
+        """:return: the searches (the search itself or its unfinished parts) that still need to be crawled"""
+        if self.is_completed(search):
+            return []
+        if search in self.children:
+            return [remaining for child in self.children[search] for remaining in self.remaining(child)]
+        return [search]
+
+    def is_page_done(self, search: str, page: int) -> bool:
+        """:return: whether the page was parsed and all its publications were uploaded"""
+        return self.is_completed(search) or (
+            page in self.pages.get(search, ()) and not self._pending_pages[(search, page)]
+        )
+
+    def has_pending(self, search: str) -> bool:
+        """:return: whether publications of the search (or of its parts) are still queued for upload"""
+        searches = {search}
+        queue = [search]
+        while queue:
+            children = self.children.get(queue.pop(), [])
+            searches.update(children)
+            queue.extend(children)
+        return any(pending_search in searches for pending_search, _ in self._pending_pages)
+
+    def split(self, search: str, parts: list[str]) -> None:
+        self.children[search] = parts
+        self._changed()
+
+    def add_pending(self, search: str, page: int, vat: Optional[str], publication_number: Optional[str]) -> None:
+        """registers a publication that is queued for download and upload, call before the item is yielded"""
+        key = self.publication_key(vat, publication_number)
+        if key in self.pending:
+            self._pending_pages[self.pending[key]] -= 1
+        self.pending[key] = (search, page)
+        self._pending_pages[(search, page)] += 1
+
+    def page_parsed(self, search: str, page: int, is_last: bool) -> None:
+        """registers a parsed listing page, call after its publications were registered with add_pending
+
+        :param is_last: no further pages of the search are needed
+        """
+        self.pages.setdefault(search, set()).add(page)
+        if is_last:
+            self.last_page[search] = min(page, self.last_page.get(search, page))
+        self._update(search)
+
+    def publication_done(self, vat: Optional[str], publication_number: Optional[str]) -> None:
+        """registers a publication that was uploaded (or dropped)"""
+        location = self.pending.pop(self.publication_key(vat, publication_number), None)
+        if location is None:
+            return
+        self._pending_pages[location] -= 1
+        if not self._pending_pages[location]:
+            del self._pending_pages[location]
+        self._update(location[0])
+
+    def _update(self, search: str) -> None:
+        last_page = self.last_page.get(search)
+        pages = self.pages.get(search, set())
+        if last_page and all(
+            page in pages and not self._pending_pages[(search, page)] for page in range(1, last_page + 1)
+        ):
+            self.completed.add(search)
+            self.pages.pop(search, None)
+            self.last_page.pop(search, None)
+        self._changed()
+
+    def _changed(self) -> None:
+        if self.store is None:
+            return
+        if time.monotonic() - self._saved_at >= self.interval and (self._write is None or self._write.done()):
+            self._submit()
+
+    def _submit(self) -> None:
+        data = json.dumps(self.to_dict(), separators=(",", ":")).encode("utf-8")
+        self._saved_at = time.monotonic()
+        self._write = self._writer.submit(self.store.write, self.name, data)
+        self._write.add_done_callback(self._on_written)
+
+    def _on_written(self, write: Future) -> None:
+        if write.exception() is not None:
+            logger.warning(f"Could not save checkpoint {self.name}: {write.exception()}")
+
+    def save(self) -> None:
+        """writes the checkpoint and waits until it is written"""
+        if self.store is None:
+            return
+        if self._write is not None:
+            self._write.exception()  # waits for the write in flight
+        self._submit()
+        self._write.exception()
+
+    def delete(self) -> None:
+        if self.store is None:
+            return
+        if self._write is not None:
+            self._write.exception()
+        self.store.delete(self.name)
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
@@ -0,0 +1,109 @@
+"""
+contains the codec of the publication payloads (the JSON blob per publication).
+
+Publications are serialized with orjson when it is installed (otherwise with json) and optionally compressed with
+gzip or zstd (zstd requires zstandard). The blobs get the matching Content-Encoding. `decode_payload` recognizes the
+compression from the first bytes of a payload, such that readers do not need to know the codec of a blob (local
+stores do not keep the Content-Encoding) and the uncompressed blobs of earlier runs can still be read.
+"""
+
+import gzip
+import json
+import zlib
+from typing import Any, Literal, Optional
+
+from src.storage import BlobStore
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+__all__ = [
+    "PayloadCodec",
+    "decode_payload",
+    "decompress",
+    "dumps",
+    "loads",
+    "read_payload",
+]
+
+
+def dumps(obj: Any) -> bytes:
+    """serializes to UTF-8 encoded JSON (with orjson when available, about 5x faster than json)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError("zstd compressed payloads require zstandard: pip install zstandard") from error
+    return zstandard
+
+
+class PayloadCodec:
+    """serializes and compresses payloads, `encoding` is also the Content-Encoding of the blobs"""
+
+    def __init__(self, encoding: Optional[Literal["gzip", "zstd"]] = None, level: Optional[int] = None):
+        """
+        :param encoding: "gzip", "zstd" or None (uncompressed)
+        :param level: compression level, defaults to 6 (gzip) or 3 (zstd)
+        """
+        if encoding not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unknown payload encoding {encoding!r}, expected 'gzip', 'zstd' or None.")
+        self.encoding = encoding
+        self.level = level if level is not None else DEFAULT_LEVELS.get(encoding)
+        self._zstd_compressor = _zstandard().ZstdCompressor(level=self.level) if encoding == "zstd" else None
+
+    @property
+    def content_encoding(self) -> Optional[str]:
+        return self.encoding
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "gzip":
+            return gzip.compress(data, compresslevel=self.level, mtime=0)
+        if self.encoding == "zstd":
+            return self._zstd_compressor.compress(data)
+        return data
+
+    def encode(self, obj: Any) -> bytes:
+        """:return: the compressed JSON of the object"""
+        return self.compress(dumps(obj))
+
+
+def decompress(data: bytes) -> bytes:
+    """decompresses a gzip or zstd compressed payload, other payloads are returned as is"""
+    if data.startswith(GZIP_MAGIC):
+        return zlib.decompress(data, wbits=16 + zlib.MAX_WBITS)
+    if data.startswith(ZSTD_MAGIC):
+        return _zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def decode_payload(data: bytes) -> Any:
+    """:return: the object of a (compressed) JSON payload"""
+    return loads(decompress(data))
+
+
+def read_payload(store: BlobStore, name: str) -> Optional[Any]:
+    """reads a publication (or any other JSON blob) regardless of its encoding
+
+    :param store: BlobStore, e.g. `AzureBlobStore(container_client)`
+    :param name: name of the blob, e.g. `{vat}/{yyyy}/{mm}/{dd}/{number}.json`
+    :return: the decoded object or None when the blob does not exist
+    """
+    data = store.read(name)
+    return decode_payload(data) if data is not None else None
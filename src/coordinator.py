@@ -0,0 +1,452 @@
+"""
+contains the coordinator that splits a crawl over several workers (containers).
+
+The work of a crawl is split in shards (date windows for the date spider, VAT numbers for the VAT spider). Every
+worker leases a few shards at a time and renews the leases with heartbeats while it crawls them. An idle worker takes
+the next free shard, so fast workers take over the work of slow ones, and the shards of a worker that died are
+reclaimed once its leases expired. A shard that failed `max_attempts` times is given up.
+
+The leases are kept in a pluggable backend: Azure blob leases in production and SQLite for local runs and tests.
+The calls of the backends block (e.g. listing the blobs of the shards), the spider makes them in a thread. The shards
+are registered in batches from another thread, the shards of the first batches are leased in the meantime.
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timezone
+from itertools import islice, takewhile
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from urllib.parse import quote, unquote
+
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobLeaseClient, BlobProperties, ContainerClient
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "CoordinatorBackend",
+    "SqliteCoordinatorBackend",
+    "BlobCoordinatorBackend",
+    "WorkCoordinator",
+]
+
+
+class CoordinatorBackend(ABC):
+    """keeps the status (pending, done or failed) and the lease of every shard of a crawl"""
+
+    @abstractmethod
+    def add_shards(self, shards: Iterable[str]) -> None:
+        """registers the shards of the crawl in batches, shards that already exist are left as is. The shards are
+        consumed lazily, the shards of the first batches can be leased while the next ones are registered.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def acquire(self, owner: str, lease_seconds: float) -> Optional[str]:
+        """leases a pending shard that is not leased (or of which the lease expired)
+
+        :return: the shard or None when no shard is available
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew(self, shard: str, owner: str, lease_seconds: float) -> bool:
+        """:return: False when the lease was lost (expired and reclaimed by another worker)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete(self, shard: str, owner: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, shard: str, owner: str, failed: bool = False) -> None:
+        """gives the shard back, a failed attempt counts towards `max_attempts`"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def progress(self) -> dict[str, int]:
+        """:return: number of shards per status (pending, done, failed) and the number of leased shards"""
+        raise NotImplementedError
+
+    def has_pending(self) -> bool:
+        """:return: whether shards are pending (or still being registered by another worker)"""
+        return self.progress()["pending"] > 0
+
+
+class SqliteCoordinatorBackend(CoordinatorBackend):
+    """keeps the shards in a SQLite database, for workers on the same machine (e.g. local runs and tests)"""
+
+    def __init__(self, path: str | Path, namespace: str, max_attempts: int = 3, batch_size: int = 1000):
+        """
+        :param path: SQLite database shared by the workers
+        :param namespace: identifies the crawl, e.g. `legal-entity-date-spider/2024-01-01_2024-12-31`
+        :param max_attempts: a shard is given up after this number of failed attempts
+        :param batch_size: number of shards registered per transaction
+        """
+        self.path = path
+        self.namespace = namespace
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        # used from the threads of the spider, the WorkCoordinator makes one call at a time
+        self.db = sqlite3.connect(path, isolation_level=None, timeout=30, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS shards (namespace TEXT, shard TEXT, status TEXT DEFAULT 'pending', "
+            "owner TEXT, lease_expires REAL DEFAULT 0, attempts INTEGER DEFAULT 0, PRIMARY KEY (namespace, shard))"
+        )
+
+    def add_shards(self, shards: Iterable[str]) -> None:
+        # registers from another thread than the one that leases the shards, with a connection of its own
+        shards = iter(shards)
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            while batch := list(islice(shards, self.batch_size)):
+                with db:
+                    db.executemany(
+                        "INSERT OR IGNORE INTO shards (namespace, shard) VALUES (?, ?)",
+                        ((self.namespace, shard) for shard in batch),
+                    )
+
+    def acquire(self, owner: str, lease_seconds: float) -> Optional[str]:
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")  # one worker at a time
+        try:
+            row = self.db.execute(
+                "SELECT shard, owner FROM shards WHERE namespace = ? AND status = 'pending' AND lease_expires < ? "
+                "ORDER BY shard LIMIT 1",
+                (self.namespace, now),
+            ).fetchone()
+            if row is None:
+                return None
+            shard, previous_owner = row
+            if previous_owner and previous_owner != owner:
+                logger.info(f"Reclaiming shard {shard}, the lease of {previous_owner} expired.")
+            self.db.execute(
+                "UPDATE shards SET owner = ?, lease_expires = ? WHERE namespace = ? AND shard = ?",
+                (owner, now + lease_seconds, self.namespace, shard),
+            )
+            return shard
+        finally:
+            self.db.execute("COMMIT")
+
+    def renew(self, shard: str, owner: str, lease_seconds: float) -> bool:
+        cursor = self.db.execute(
+            "UPDATE shards SET lease_expires = ? WHERE namespace = ? AND shard = ? AND owner = ? AND status = 'pending'",
+            (time.time() + lease_seconds, self.namespace, shard, owner),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, shard: str, owner: str) -> None:
+        self.db.execute(
+            "UPDATE shards SET status = 'done', lease_expires = 0 WHERE namespace = ? AND shard = ? AND owner = ?",
+            (self.namespace, shard, owner),
+        )
+
+    def release(self, shard: str, owner: str, failed: bool = False) -> None:
+        self.db.execute(
+            "UPDATE shards SET lease_expires = 0, attempts = attempts + ?, "
+            "status = CASE WHEN attempts + ? >= ? THEN 'failed' ELSE status END "
+            "WHERE namespace = ? AND shard = ? AND owner = ? AND status = 'pending'",
+            (int(failed), int(failed), self.max_attempts, self.namespace, shard, owner),
+        )
+
+    def progress(self) -> dict[str, int]:
+        progress = {"pending": 0, "done": 0, "failed": 0}
+        rows = self.db.execute(
+            "SELECT status, COUNT(*) FROM shards WHERE namespace = ? GROUP BY status", (self.namespace,)
+        )
+        progress.update(dict(rows.fetchall()))
+        progress["leased"] = self.db.execute(
+            "SELECT COUNT(*) FROM shards WHERE namespace = ? AND status = 'pending' AND lease_expires >= ?",
+            (self.namespace, time.time()),
+        ).fetchone()[0]
+        return progress
+
+
+class BlobCoordinatorBackend(CoordinatorBackend):
+    """keeps one empty blob per shard below `{prefix}{status}/` (status is pending, done or failed), the number of
+    failed attempts in its metadata and its lease as a blob lease. A shard moves to `done/` or `failed/` when its
+    status changes, so only the pending shards are listed to lease one. The listing continues where the previous
+    acquire stopped, it starts over once all pending shards were listed.
+
+    The number of registered shards is kept in the metadata of the `registration` blob. One worker registers the
+    shards, a registration that stopped (no batch registered for `REGISTRATION_TIMEOUT` seconds) is taken over by
+    the next worker that registers them. A shard of the batch that was being registered can then be crawled twice.
+
+    Blob leases last 15 to 60 seconds, they expire by themselves when a worker dies.
+    """
+
+    STATUSES = ("pending", "done", "failed")
+    REGISTRATION_TIMEOUT = 120.0
+
+    def __init__(
+        self,
+        container_client: ContainerClient,
+        prefix: str,
+        max_attempts: int = 3,
+        batch_size: int = 1000,
+        max_concurrency: int = 16,
+    ):
+        """
+        :param container_client: ContainerClient of the container of the shards
+        :param prefix: prefix of the blobs of the crawl, e.g. `_shards/legal-entity-vat-spider/`
+        :param max_attempts: a shard is given up after this number of failed attempts
+        :param batch_size: number of shards registered before the registration blob is updated
+        :param max_concurrency: number of shard blobs uploaded at the same time
+        """
+        self.container_client = container_client
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self._pending: Optional[Iterator[BlobProperties]] = None  # the listing in progress of the pending shards
+
+    def _name(self, shard: str, status: str = "pending") -> str:
+        # shards contain slashes (e.g. date windows), one blob name segment per shard
+        return f"{self.prefix}{status}/{quote(shard, safe='')}"
+
+    @staticmethod
+    def _shard(name: str) -> str:
+        return unquote(name.rpartition("/")[2])
+
+    @staticmethod
+    def _lease_id(shard: str, owner: str) -> str:
+        # the same worker always proposes the same lease id for a shard, such that it can renew without state
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{owner}/{shard}"))
+
+    @staticmethod
+    def _duration(lease_seconds: float) -> int:
+        return int(min(60, max(15, lease_seconds)))
+
+    def _lease(self, shard: str, owner: str) -> BlobLeaseClient:
+        blob_client = self.container_client.get_blob_client(self._name(shard))
+        return BlobLeaseClient(blob_client, lease_id=self._lease_id(shard, owner))
+
+    def _registration(self):
+        return self.container_client.get_blob_client(f"{self.prefix}registration")
+
+    def _is_registering(self, properties: BlobProperties) -> bool:
+        age = (datetime.now(timezone.utc) - properties.last_modified).total_seconds()
+        return properties.metadata.get("complete") != "true" and age < self.REGISTRATION_TIMEOUT
+
+    def _start_registration(self) -> Optional[int]:
+        """:return: the number of shards registered so far or None when another worker registers (or registered)
+        the shards
+        """
+        registration = self._registration()
+        try:
+            registration.upload_blob(b"", metadata={"registered": "0", "complete": "false"}, overwrite=False)
+            return 0
+        except ResourceExistsError:
+            pass
+        properties = registration.get_blob_properties()
+        if properties.metadata.get("complete") == "true" or self._is_registering(properties):
+            return None
+        try:
+            # takes over the registration that stopped, only one of the workers that try succeeds
+            registration.set_blob_metadata(
+                properties.metadata, etag=properties.etag, match_condition=MatchConditions.IfNotModified
+            )
+        except HttpResponseError:
+            return None
+        registered = int(properties.metadata.get("registered", 0))
+        logger.info(f"Resuming the registration of the shards below {self.prefix} after {registered} shards.")
+        return registered
+
+    def _add_shard(self, shard: str) -> None:
+        try:
+            self.container_client.upload_blob(self._name(shard), b"", metadata={"attempts": "0"}, overwrite=False)
+        except ResourceExistsError:
+            pass
+
+    def add_shards(self, shards: Iterable[str]) -> None:
+        registered = self._start_registration()
+        if registered is None:
+            return
+        registration = self._registration()
+        shards = islice(shards, registered, None)
+        with ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="coordinator") as executor:
+            while batch := list(islice(shards, self.batch_size)):
+                list(executor.map(self._add_shard, batch))
+                registered += len(batch)
+                registration.set_blob_metadata({"registered": str(registered), "complete": "false"})
+        registration.set_blob_metadata({"registered": str(registered), "complete": "true"})
+        logger.info(f"Registered {registered} shards below {self.prefix}.")
+
+    def acquire(self, owner: str, lease_seconds: float) -> Optional[str]:
+        if self._pending is None:
+            self._pending = iter(self.container_client.list_blobs(name_starts_with=self._name("")))
+        for blob in self._pending:
+            if blob.lease.state == "leased":
+                continue
+            shard = self._shard(blob.name)
+            try:
+                self._lease(shard, owner).acquire(lease_duration=self._duration(lease_seconds))
+            except HttpResponseError:
+                continue  # leased, completed or given up by another worker in the meantime
+            if blob.lease.state == "expired":
+                logger.info(f"Reclaiming shard {shard}, its lease expired.")
+            return shard
+        self._pending = None  # the next acquire lists the pending shards again, from the start
+        return None
+
+    def renew(self, shard: str, owner: str, lease_seconds: float) -> bool:
+        try:
+            self._lease(shard, owner).renew()
+            return True
+        except HttpResponseError:
+            return False
+
+    def _move(self, shard: str, lease: BlobLeaseClient, status: str, attempts: int) -> None:
+        """moves the pending shard to `status`, the shard is crawled again when the worker dies in between"""
+        metadata = {"attempts": str(attempts)}
+        self.container_client.upload_blob(self._name(shard, status), b"", metadata=metadata, overwrite=True)
+        self.container_client.get_blob_client(self._name(shard)).delete_blob(lease=lease)
+
+    def complete(self, shard: str, owner: str) -> None:
+        try:
+            self._move(shard, self._lease(shard, owner), "done", attempts=0)
+        except HttpResponseError:
+            logger.warning(f"Lost the lease of shard {shard} before it could be completed.")
+
+    def release(self, shard: str, owner: str, failed: bool = False) -> None:
+        lease = self._lease(shard, owner)
+        blob_client = self.container_client.get_blob_client(self._name(shard))
+        try:
+            attempts = int(blob_client.get_blob_properties().metadata.get("attempts", 0)) + int(failed)
+            if attempts >= self.max_attempts:
+                self._move(shard, lease, "failed", attempts)
+                return
+            if failed:
+                blob_client.set_blob_metadata({"attempts": str(attempts)}, lease=lease)
+            lease.release()
+        except HttpResponseError:
+            logger.warning(f"Lost the lease of shard {shard} before it could be released.")
+
+    def progress(self) -> dict[str, int]:
+        progress = {status: 0 for status in self.STATUSES}
+        progress["leased"] = 0
+        for status in self.STATUSES:
+            for blob in self.container_client.list_blobs(name_starts_with=self._name("", status)):
+                progress[status] += 1
+                progress["leased"] += status == "pending" and blob.lease.state == "leased"
+        return progress
+
+    def has_pending(self) -> bool:
+        try:
+            if self._is_registering(self._registration().get_blob_properties()):
+                return True
+        except ResourceNotFoundError:
+            pass
+        pending = self.container_client.list_blobs(name_starts_with=self._name(""), results_per_page=1)
+        return next(iter(pending), None) is not None
+
+
+class WorkCoordinator:
+    """leases shards for one worker and keeps its leases alive"""
+
+    def __init__(
+        self,
+        backend: CoordinatorBackend,
+        owner: Optional[str] = None,
+        lease_seconds: float = 60.0,
+        max_shards: int = 2,
+        poll_interval: float = 30.0,
+    ):
+        """
+        :param backend: CoordinatorBackend shared by the workers
+        :param owner: identifies the worker, defaults to `{hostname}-{pid}`
+        :param lease_seconds: a shard is reclaimed when its lease is not renewed for this long
+        :param max_shards: number of shards a worker crawls at the same time
+        :param poll_interval: seconds before the shards are listed again after no shard was available or shards were
+            still pending
+        """
+        self.backend = backend
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.max_shards = max_shards
+        self.poll_interval = poll_interval
+        self.held: set[str] = set()
+        self.closed = False
+        self.registering = False
+        self._lock = threading.Lock()  # the spider calls the coordinator from a thread
+        self._next_acquire = 0.0
+        self._next_progress = 0.0
+        self._unfinished: Optional[bool] = None
+
+    def register(self, shards: Iterable[str]) -> None:
+        """registers the shards, blocks until all are registered or the coordinator is closed. Meant to run in its
+        own thread, the shards that are registered can be leased in the meantime.
+        """
+        self.registering = True
+        try:
+            self.backend.add_shards(takewhile(lambda _: not self.closed, shards))
+        finally:
+            self.registering = False
+
+    def acquire(self) -> Optional[str]:
+        """:return: a newly leased shard or None when the worker is at capacity or no shard is available"""
+        with self._lock:
+            if self.closed or len(self.held) >= self.max_shards or time.monotonic() < self._next_acquire:
+                return None
+            shard = self.backend.acquire(self.owner, self.lease_seconds)
+            if shard is None:
+                self._next_acquire = time.monotonic() + self.poll_interval
+                return None
+            self.held.add(shard)
+        logger.info(f"Worker {self.owner} leased shard {shard}.")
+        return shard
+
+    def heartbeat(self) -> None:
+        """renews the leases of the held shards, shards of which the lease was lost are dropped"""
+        with self._lock:
+            for shard in list(self.held):
+                if not self.backend.renew(shard, self.owner, self.lease_seconds):
+                    logger.warning(f"Worker {self.owner} lost the lease of shard {shard}.")
+                    self.held.discard(shard)
+
+    def complete(self, shard: str) -> None:
+        with self._lock:
+            if shard not in self.held:
+                return  # the lease was lost
+            self.backend.complete(shard, self.owner)
+            self.held.discard(shard)
+        logger.info(f"Worker {self.owner} completed shard {shard}.")
+
+    def fail(self, shard: str) -> None:
+        with self._lock:
+            if shard not in self.held:
+                return
+            self.backend.release(shard, self.owner, failed=True)
+            self.held.discard(shard)
+        logger.warning(f"Worker {self.owner} could not complete shard {shard}, it is released for a retry.")
+
+    def has_unfinished(self) -> bool:
+        """:return: whether shards are pending, also the ones leased by other workers (they can still be reclaimed),
+        or still being registered. The backend is checked at most every `poll_interval` seconds, once no shards are
+        pending after the registration none will be.
+        """
+        if self.registering:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self._unfinished is None or (self._unfinished and now >= self._next_progress):
+                self._unfinished = self.backend.has_pending()
+                self._next_progress = now + self.poll_interval
+            return self._unfinished
+
+    def close(self) -> None:
+        """gives back the held shards without counting a failed attempt (e.g. when the crawl is stopped)"""
+        with self._lock:
+            self.closed = True
+            for shard in list(self.held):
+                self.backend.release(shard, self.owner)
+            self.held.clear()
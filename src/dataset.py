@@ -0,0 +1,259 @@
+"""
+contains the exporter that collects the scraped publications in a columnar dataset next to the JSON blobs.
+
+Every publication is also saved as a small JSON blob (`{vat}/{yyyy}/{mm}/{dd}/{number}.json`), reading all of them
+(e.g. to build the Hugging Face dataset) takes millions of requests. The exporter buffers the publications per month
+of publication and writes them in compressed shards of at most `max_rows` rows (or about `max_bytes` of text):
+`{prefix}year={yyyy}/month={mm}/part-{run_id}-{sequence}.parquet` (or `.jsonl.zst`, `.jsonl.gz`, `.jsonl`).
+
+Every run adds its own shards and writes a manifest with them to `{prefix}manifests/{run_id}.json`, such that runs
+(and workers sharing a crawl) never overwrite each other. `read_manifest` combines the manifests of all runs. A shard
+that is missing from the manifests (e.g. of a run that crashed) is ignored by readers of the manifest.
+
+Parquet requires pyarrow and zstd compressed JSONL requires zstandard, which is checked when the writer is created.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import count
+from typing import Literal, Optional
+
+from src.codec import PayloadCodec, dumps
+from src.storage import AsyncBlobStore, BlobStore
+from src.uploader import BlobUploader
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "vat",
+    "pubid",
+    "act_description",
+    "company_name",
+    "company_juridical_form",
+    "address",
+    "street",
+    "zipcode",
+    "city",
+    "publication_date",
+    "publication_number",
+    "publication_link",
+    "text",
+    "is_digital",
+)
+EXTENSIONS = {
+    ("parquet", None): ".parquet",
+    ("parquet", "zstd"): ".parquet",
+    ("parquet", "gzip"): ".parquet",
+    ("jsonl", None): ".jsonl",
+    ("jsonl", "zstd"): ".jsonl.zst",
+    ("jsonl", "gzip"): ".jsonl.gz",
+}
+
+__all__ = [
+    "DatasetWriter",
+    "encode_shard",
+    "read_manifest",
+]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError("Exporting the dataset as Parquet requires pyarrow: pip install pyarrow") from error
+    return pyarrow
+
+
+def _encode_parquet(rows: list[dict], compression: Optional[str]) -> bytes:
+    pa = _pyarrow()
+    pq = pa.parquet
+
+    schema = pa.schema([(column, pa.bool_() if column == "is_digital" else pa.string()) for column in COLUMNS])
+    table = pa.Table.from_pylist(rows, schema=schema)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=compression or "none")
+    return buffer.getvalue()
+
+
+def _encode_jsonl(rows: list[dict], compression: Optional[str]) -> bytes:
+    return PayloadCodec(compression).compress(b"".join(dumps(row) + b"\n" for row in rows))
+
+
+def encode_shard(rows: list[dict], file_format: str = "parquet", compression: Optional[str] = "zstd") -> bytes:
+    """encodes the rows of a shard, the columns of every row are COLUMNS
+
+    :param rows: publications
+    :param file_format: "parquet" or "jsonl"
+    :param compression: "zstd", "gzip" or None
+    :return: content of the shard
+    """
+    if (file_format, compression) not in EXTENSIONS:
+        raise ValueError(f"Unsupported dataset format {file_format!r} with compression {compression!r}.")
+    rows = [{column: row.get(column) for column in COLUMNS} for row in rows]
+    if file_format == "parquet":
+        return _encode_parquet(rows, compression)
+    return _encode_jsonl(rows, compression)
+
+
+def read_manifest(store: BlobStore, prefix: str = "_dataset/") -> list[dict]:
+    """combines the manifests of all runs
+
+    :param store: BlobStore with the dataset
+    :param prefix: prefix of the dataset
+    :return: a dict per shard (name, partition, rows, bytes, min/max_publication_date, run_id), sorted by name
+    """
+    shards = []
+    for name in store.list_names(f"{prefix}manifests/"):
+        data = store.read(name)
+        if data is not None:
+            shards.extend(json.loads(data)["shards"])
+    return sorted(shards, key=lambda shard: shard["name"])
+
+
+class DatasetWriter:
+    """buffers publications per month of publication and writes them in size-bounded shards in the background"""
+
+    def __init__(
+        self,
+        store: AsyncBlobStore,
+        prefix: str = "_dataset/",
+        file_format: Literal["parquet", "jsonl"] = "parquet",
+        compression: Optional[Literal["zstd", "gzip"]] = "zstd",
+        max_rows: int = 50_000,
+        max_bytes: int = 64 * 1024**2,
+        max_buffered_bytes: int = 256 * 1024**2,
+        run_id: Optional[str] = None,
+        max_retries: int = 3,
+    ):
+        """
+        :param store: AsyncBlobStore the shards are written to (e.g. `ThreadedBlobStore(LocalBlobStore(...))`)
+        :param prefix: prefix of the dataset in the store
+        :param file_format: "parquet" or "jsonl"
+        :param compression: "zstd", "gzip" or None
+        :param max_rows: maximum number of rows of a shard
+        :param max_bytes: a shard is written once the text of its rows reaches this size (before compression)
+        :param max_buffered_bytes: the largest buffered shard is written when all buffers together reach this size
+        :param run_id: identifies the shards and manifest of the run, defaults to the start time and a random suffix
+        :param max_retries: number of retries of a failed write
+        """
+        if (file_format, compression) not in EXTENSIONS:
+            raise ValueError(f"Unsupported dataset format {file_format!r} with compression {compression!r}.")
+        # fail at startup instead of losing the first shard when a dependency is missing
+        if file_format == "parquet":
+            _pyarrow()
+        else:
+            PayloadCodec(compression)
+        self.store = store
+        self.prefix = prefix
+        self.file_format = file_format
+        self.compression = compression
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_buffered_bytes = max_buffered_bytes
+        self.run_id = run_id or f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.shards: list[dict] = []  # written shards, saved in the manifest
+        self.num_rows = 0
+        self._uploader = BlobUploader(store, max_concurrency=2, max_retries=max_retries)
+        self._buffers: dict[str, list[dict]] = defaultdict(list)
+        self._buffer_bytes: dict[str, int] = defaultdict(int)
+        self._flushing: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._sequence = count()
+
+    @staticmethod
+    def partition(publication: dict) -> str:
+        """:return: the partition of a publication, e.g. `year=2024/month=05`"""
+        publication_date = str(publication.get("publication_date") or "")
+        if len(publication_date) < 7:
+            return "year=unknown/month=unknown"
+        return f"year={publication_date[:4]}/month={publication_date[5:7]}"
+
+    @staticmethod
+    def _size(publication: dict) -> int:
+        return sum(len(value) for value in publication.values() if isinstance(value, str))
+
+    @property
+    def buffered_bytes(self) -> int:
+        return sum(self._buffer_bytes.values())
+
+    async def add(self, publication: dict) -> None:
+        """buffers a publication, writes its shard when it is full
+
+        :param publication: metadata and text of the publication (see COLUMNS)
+        """
+        partition = self.partition(publication)
+        self._buffers[partition].append(publication)
+        self._buffer_bytes[partition] += self._size(publication)
+        if len(self._buffers[partition]) >= self.max_rows or self._buffer_bytes[partition] >= self.max_bytes:
+            await self.flush_partition(partition)
+        elif self.buffered_bytes >= self.max_buffered_bytes:
+            await self.flush_partition(max(self._buffer_bytes, key=self._buffer_bytes.get))
+
+    async def flush_partition(self, partition: str) -> None:
+        """encodes the buffered publications of a partition and writes them as a shard in the background
+
+        The publications stay buffered until they are encoded, such that a failing encoding loses none of them.
+        """
+        async with self._flushing[partition]:
+            rows = list(self._buffers.get(partition, ()))
+            if not rows:
+                return
+
+            # pyarrow and the compressors release the GIL, the event loop keeps running while the shard is encoded
+            data = await asyncio.to_thread(encode_shard, rows, self.file_format, self.compression)
+            # publications added while the shard was encoded stay buffered
+            buffer = self._buffers[partition]
+            del buffer[: len(rows)]
+            if buffer:
+                self._buffer_bytes[partition] -= sum(self._size(row) for row in rows)
+            else:
+                self._buffers.pop(partition)
+                self._buffer_bytes.pop(partition, None)
+
+        extension = EXTENSIONS[(self.file_format, self.compression)]
+        name = f"{self.prefix}{partition}/part-{self.run_id}-{next(self._sequence):05d}{extension}"
+        dates = [str(row["publication_date"]) for row in rows if row.get("publication_date")]
+        shard = {
+            "name": name,
+            "partition": partition,
+            "rows": len(rows),
+            "bytes": len(data),
+            "min_publication_date": min(dates, default=None),
+            "max_publication_date": max(dates, default=None),
+            "run_id": self.run_id,
+        }
+        self.num_rows += len(rows)
+        logger.info(f"Writing dataset shard {name} with {len(rows)} publications ({len(data) / 1024**2:.1f} MiB).")
+        await self._uploader.submit(name, data, on_success=lambda: self.shards.append(shard))
+
+    async def flush(self) -> None:
+        """writes the buffered publications of all partitions"""
+        for partition in list(self._buffers):
+            await self.flush_partition(partition)
+        await self._uploader.flush()
+
+    def manifest(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "format": self.file_format,
+            "compression": self.compression,
+            "columns": list(COLUMNS),
+            "shards": sorted(self.shards, key=lambda shard: shard["name"]),
+        }
+
+    async def close(self) -> None:
+        """writes the remaining shards and the manifest of the run"""
+        await self.flush()
+        if self.shards:
+            manifest = json.dumps(self.manifest(), indent=1).encode("utf-8")
+            await self._uploader.submit(f"{self.prefix}manifests/{self.run_id}.json", manifest)
+        await self._uploader.close()
+        if self._uploader.num_failed:
+            logger.error(
+                f"{self._uploader.num_failed} blobs of the dataset could not be written, see the errors above."
+            )
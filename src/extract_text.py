@@ -2,146 +2,466 @@
 contains helper functions to extract text from digital/searchable pdf and scanned pdf.
 """
 
+import asyncio
 import io
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from statistics import mode
-from typing import Optional
+from typing import Iterable, Literal, Optional
 
+import numpy as np
 import pymupdf
-from azure.ai.formrecognizer import AnalyzeResult
+from azure.ai.formrecognizer import AnalyzeResult, DocumentLine, DocumentPage
 from azure.ai.formrecognizer.aio import DocumentAnalysisClient
 from azure.identity import DefaultAzureCredential
 
+from src.metrics import NULL_METRICS, Metrics
+from src.ocr import OCR_MODEL_ID, OcrCache, OcrClient
+
 PAGE_0_REL_COORDS = (0.15966, 0.20485, 0.95000, 0.91950)
 PAGE_N_REL_COORDS = (0.15966, 0.04899, 0.95000, 0.91950)
 
 __all__ = [
+    "OcrCrop",
+    "create_executor",
+    "open_pdf",
     "extract_text_digital",
     "extract_text_scan",
     "extract_text",
+    "is_scan",
+    "layout_page",
+    "join_lines",
+    "join_pages",
 ]
 
 
-def is_same_line(py0: Optional[float], py1: Optional[float], y0: float, y1: float, line_height: float) -> bool:
-    """Checks if two lines previous line with py0 and py1 and current line y0 and y1 are on the same
-    height and are not too big in height difference comparing to a standard line_height
+def _mode(values: np.ndarray) -> float:
+    """most common value, ties are resolved by the first occurrence (like statistics.mode)"""
+    _, first, counts = np.unique(values, return_index=True, return_counts=True)
+    return float(values[first[counts == counts.max()].min()])
+
+
+def _polygon_coords(lines: list[DocumentLine]) -> tuple[np.ndarray, np.ndarray]:
+    """packs the polygons of all lines of a page into arrays of x and y coordinates of shape (lines, points)"""
+    num_points = max(len(line.polygon) for line in lines)
+    coords = np.empty((len(lines), num_points, 2), dtype=np.float64)
+    for i, line in enumerate(lines):
+        polygon = [(point.x, point.y) for point in line.polygon]
+        # polygons with less points are padded with their first point, which does not change their bounding box
+        coords[i] = polygon + polygon[:1] * (num_points - len(polygon))
+    return coords[:, :, 0], coords[:, :, 1]
+
+
+def layout_page(
+    ocr_page: DocumentPage, scan_page: pymupdf.Page, region: Optional[tuple[float, float, float, float]] = None
+) -> tuple[list[str], list[bool]]:
+    """selects the OCR'ed lines within the dotted lines of the page in reading order (top left to bottom right)
 
-    :return: bool
+    A line is on the same line as the previous selected line when the top and bottom differ less than 5% and
+    both lines together are not higher than 1.25 times the most common line height.
+
+    :param ocr_page: OCR result of the page
+    :param scan_page: pymupdf.Page
+    :param region: rectangle of the scanned page that was OCR'ed (see OcrCrop), defaults to the whole page
+    :return: the content of the selected lines and per line whether it is on the same line as the previous line
     """
-    same_line = bool(
-        py0
-        and py1
-        and abs(py0 - y0) / y0 <= 0.05
-        and abs(py1 - y1) / y1 <= 0.05
-        and (max(y1, py1) - min(y0, py0)) <= line_height * 1.25
-    )
-    return same_line
+    if not ocr_page.lines:
+        return [], []
 
+    _, _, width, height = scan_page.rect
+    rx0, ry0, rx1, ry1 = region or (0.0, 0.0, width, height)
+    sf_x, sf_y = (rx1 - rx0) / ocr_page.width, (ry1 - ry0) / ocr_page.height  # scaling factor
+    xs, ys = _polygon_coords(ocr_page.lines)
+    min_x, min_y, max_x, max_y = xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)
+    line_height = _mode(max_y - min_y) * sf_y
+    rel_coords = PAGE_0_REL_COORDS if scan_page.number == 0 else PAGE_N_REL_COORDS
+    crop = (rel_coords[0] * width, rel_coords[1] * height, rel_coords[2] * width, rel_coords[3] * height)
 
-def add_text_line(text: str, line_text: str, same_line: bool) -> str:
-    """adds the line_text to the general text. If it's the same line it uses \t otherwise \n"""
-    if same_line:
-        text += "\t" + line_text
-    else:
-        line_text = line_text if not text or text.endswith("\n") or line_text.startswith("\n") else "\n" + line_text
-        text += line_text
-    return text
+    # sort lines from top left to bottom right (lexsort is stable and sorts on the last key first)
+    order = np.lexsort((min_x, min_y))
+    # coordinates on the scanned page
+    x0, y0 = rx0 + min_x[order] * sf_x, ry0 + min_y[order] * sf_y
+    x1, y1 = rx0 + max_x[order] * sf_x, ry0 + max_y[order] * sf_y
+    within_crop = (crop[0] <= x0) & (x1 <= crop[2]) & (crop[1] <= y0) & (y1 <= crop[3])
+    order, y0, y1 = order[within_crop], y0[within_crop], y1[within_crop]
+
+    # compare every selected line with the previous selected line
+    py0, py1, y0, y1 = y0[:-1], y1[:-1], y0[1:], y1[1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        same_line = (
+            (py0 != 0)
+            & (py1 != 0)
+            & (np.abs(py0 - y0) / y0 <= 0.05)
+            & (np.abs(py1 - y1) / y1 <= 0.05)
+            & ((np.maximum(y1, py1) - np.minimum(y0, py0)) <= line_height * 1.25)
+        )
+
+    contents = [ocr_page.lines[i].content for i in order.tolist()]
+    return contents, [False] + same_line.tolist()
+
+
+def join_lines(pages: Iterable[tuple[list[str], list[bool]]]) -> str:
+    """joins the lines of all pages, lines on the same line are separated by \t otherwise by \n"""
+    pieces = []
+    last_piece = ""  # last non-empty piece
+    for contents, same_lines in pages:
+        for line_text, same_line in zip(contents, same_lines):
+            if same_line:
+                piece = "\t" + line_text
+            elif not last_piece or last_piece.endswith("\n") or line_text.startswith("\n"):
+                piece = line_text
+            else:
+                piece = "\n" + line_text
+            pieces.append(piece)
+            last_piece = piece or last_piece
+    return "".join(pieces)
+
+
+@dataclass(frozen=True, slots=True)
+class OcrCrop:
+    """preprocessing of a scan before OCR: only the region within the dotted lines of every page is submitted.
+
+    The region is widened by `margin` (relative to the page size) such that lines crossing the dotted lines are still
+    recognized as a whole and dropped by `layout_page` like before. Without `dpi` the pages get a crop box and keep
+    their scanned images whole, so the payload is barely smaller (<1% on the sample scans): the crop only keeps the
+    lines outside the region from being recognized. With `dpi` the region is rasterized at that resolution (in
+    grayscale), which only makes the payload smaller for large color or high-resolution scans.
+    """
+
+    dpi: Optional[int] = None
+    grayscale: bool = True
+    margin: float = 0.02
 
+    @property
+    def variant(self) -> str:
+        """identifies the preprocessing in the key of the OCR cache"""
+        rendering = f"-{self.dpi}dpi-{'gray' if self.grayscale else 'rgb'}" if self.dpi else ""
+        return f"crop{self.margin}{rendering}"
 
-async def ocr_pdf(pdf: pymupdf.Document, endpoint: str, credential: DefaultAzureCredential) -> AnalyzeResult:
+    def region(self, page: pymupdf.Page) -> tuple[float, float, float, float]:
+        """:return: the rectangle of the page that is submitted to OCR"""
+        x0, y0, x1, y1 = _page_clip(page)
+        _, _, width, height = page.rect
+        dx, dy = self.margin * width, self.margin * height
+        return max(0.0, x0 - dx), max(0.0, y0 - dy), min(width, x1 + dx), min(height, y1 + dy)
+
+    def apply(self, pdf_bytes: bytes) -> bytes:
+        """:return: the content of the cropped pdf, one page per page of the scan"""
+        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as pdf:
+            if not self.dpi:
+                for page in pdf:
+                    # crop boxes are in unrotated coordinates relative to the media box
+                    x, y = page.cropbox.x0, page.cropbox.y0
+                    page.set_cropbox(pymupdf.Rect(self.region(page)) * page.derotation_matrix + (x, y, x, y))
+                return pdf.tobytes(garbage=3, deflate=True, no_new_id=True)
+
+            colorspace = pymupdf.csGRAY if self.grayscale else pymupdf.csRGB
+            with pymupdf.open() as cropped:
+                for page in pdf:
+                    region = pymupdf.Rect(self.region(page))
+                    pixmap = page.get_pixmap(dpi=self.dpi, clip=region, colorspace=colorspace)
+                    cropped_page = cropped.new_page(width=region.width, height=region.height)
+                    cropped_page.insert_image(cropped_page.rect, pixmap=pixmap)
+                return cropped.tobytes(garbage=3, deflate=True, no_new_id=True)
+
+
+async def ocr_pdf(
+    pdf: pymupdf.Document,
+    endpoint: Optional[str] = None,
+    credential: Optional[DefaultAzureCredential] = None,
+    ocr_client: Optional[OcrClient] = None,
+    ocr_cache: Optional[OcrCache] = None,
+    pdf_bytes: Optional[bytes] = None,
+    crop: Optional[OcrCrop] = None,
+) -> AnalyzeResult:
     """OCRs the PDF using Azure Document Intelligence OCR.
 
     :param pdf: pymupdf.Document
+    :param ocr_client: long-lived OcrClient, when missing a client is created for this PDF only
+    :param ocr_cache: OcrCache that is consulted before submitting the PDF
+    :param pdf_bytes: content of the pdf file, when missing the pymupdf.Document is serialized
+    :param crop: OcrCrop, when given the cropped pdf is submitted (the coordinates are relative to the regions)
     """
-    pdf_bytes_io = io.BytesIO()
-    pdf.save(pdf_bytes_io)
-    pdf_bytes = pdf_bytes_io.getvalue()
-    di_client = DocumentAnalysisClient(endpoint=endpoint, credential=credential)
-    async with di_client:
-        poller = await di_client.begin_analyze_document(model_id="prebuilt-read", document=pdf_bytes)
-        result = await poller.result()
+    if pdf_bytes is None:
+        pdf_bytes_io = io.BytesIO()
+        pdf.save(pdf_bytes_io, no_new_id=True)  # keeps the bytes of the same pdf identical
+        pdf_bytes = pdf_bytes_io.getvalue()
+
+    # the key is based on the original pdf, the results do not depend on how pymupdf serializes the cropped pdf
+    model_id = ocr_client.model_id if ocr_client else OCR_MODEL_ID
+    cache_key = OcrCache.key(pdf_bytes, f"{model_id}-{crop.variant}" if crop is not None else model_id)
+    if ocr_cache is not None:
+        result = await ocr_cache.get(cache_key)
+        if result is not None:
+            return result
+
+    # cropping re-serializes the whole pdf, too slow for the event loop
+    document = await asyncio.to_thread(crop.apply, pdf_bytes) if crop is not None else pdf_bytes
+    if ocr_client is not None:
+        result = await ocr_client.analyze(document)
+    else:
+        di_client = DocumentAnalysisClient(endpoint=endpoint, credential=credential)
+        async with di_client:
+            poller = await di_client.begin_analyze_document(model_id=OCR_MODEL_ID, document=document)
+            result = await poller.result()
+
+    if ocr_cache is not None:
+        await ocr_cache.put(cache_key, result)
     return result
 
 
-def extract_text_digital(pdf: pymupdf.Document) -> str:
+def _page_clip(page: pymupdf.Page) -> tuple[float, float, float, float]:
+    """:return: the rectangle within the dotted lines of the page"""
+    rel_coords = PAGE_0_REL_COORDS if page.number == 0 else PAGE_N_REL_COORDS
+    _, _, width, height = page.rect
+    return tuple(left * right for left, right in zip((width, height, width, height), rel_coords))
+
+
+def _textbox(page: pymupdf.Page, clip: tuple[float, float, float, float]) -> str:
+    """returns the same text as `page.get_textbox(clip)` in a single pass over the raw characters of the page
+
+    get_textbox walks the characters in Python through the mupdf bindings, the raw characters of the page are
+    extracted at once in C instead. Like get_textbox, the characters of which the box overlaps the clip are kept and
+    the lines with kept characters are separated by a new line.
+    """
+    x0, y0, x1, y1 = clip
+    pieces = []
+    need_new_line = False
+    for block in page.get_text("rawdict", flags=0)["blocks"]:
+        if block["type"] != 0:  # image block
+            continue
+        for line in block["lines"]:
+            line_had_text = False
+            for span in line["spans"]:
+                for char in span["chars"]:
+                    bx0, by0, bx1, by1 = char["bbox"]
+                    if x0 >= bx1 or y0 >= by1 or x1 <= bx0 or y1 <= by0:
+                        continue
+                    if need_new_line:
+                        pieces.append("\n")
+                        need_new_line = False
+                    c = char["c"]
+                    pieces.append("\ufffd" if "\ud800" <= c <= "\udfff" else c)  # orphaned surrogate
+                    line_had_text = True
+            need_new_line = need_new_line or line_had_text
+    return "".join(pieces)
+
+
+def join_pages(page_texts: Iterable[str]) -> str:
+    """joins the text of the pages, a page starts on a new line"""
+    pieces = []  # non-empty pieces
+    for page_text in page_texts:
+        piece = page_text if not pieces or pieces[-1].endswith("\n") or page_text.startswith("\n") else "\n" + page_text
+        if piece:
+            pieces.append(piece)
+    return "".join(pieces)
+
+
+def extract_text_digital(pdf: pymupdf.Document, fast: bool = False, pages: Optional[range] = None) -> str:
     """extracts the text from within the dotted line from a digital/searchable pdf.
 
     :param pdf: pymupdf.Document
+    :param fast: extracts the text of a page in a single pass over its raw characters (same text)
+    :param pages: only extracts these pages, all pages by default
     :return: str
     """
-    text = ""
-    for page in pdf:
-        if page.number == 0:
-            rel_coords = PAGE_0_REL_COORDS
-        else:
-            rel_coords = PAGE_N_REL_COORDS
+    return join_pages(extract_page_texts(pdf, fast, pages))
 
-        _, _, width, height = page.rect
-        clip = (width, height, width, height)
-        clip = tuple(left * right for left, right in zip(clip, rel_coords))
 
-        page_text = page.get_textbox(clip)
-        page_text = page_text if not text or text.endswith("\n") or page_text.startswith("\n") else "\n" + page_text
-        text += page_text
-    return text
+def extract_page_texts(pdf: pymupdf.Document, fast: bool = False, pages: Optional[range] = None) -> list[str]:
+    """:return: the text within the dotted line per page (see extract_text_digital)"""
+    pages = pages if pages is not None else range(pdf.page_count)
+    textbox = _textbox if fast else pymupdf.Page.get_textbox
+    return [textbox(page, _page_clip(page)) for page in (pdf[number] for number in pages)]
+
+
+def is_scan(pdf: pymupdf.Document) -> bool:
+    """detects a scan from its first page: an image and no text within the dotted lines (the stamped header in the
+    margin of a scan is text)
+
+    A PDF that is not detected as a scan can still turn out to be one when no text is extracted from it.
+    """
+    if not pdf.page_count:
+        return False
+    first_page = pdf[0]
+    return bool(first_page.get_images()) and not _textbox(first_page, _page_clip(first_page))
+
 
+def open_pdf(pdf: pymupdf.Document | str | Path | bytes) -> pymupdf.Document:
+    """opens a pdf from a path or from its content, a pymupdf.Document is returned as is"""
+    if isinstance(pdf, pymupdf.Document):
+        return pdf
+    if isinstance(pdf, bytes):
+        return pymupdf.open(stream=pdf, filetype="pdf")
+    return pymupdf.open(pdf)
 
-async def extract_text_scan(pdf: pymupdf.Document, endpoint: str, credential: DefaultAzureCredential) -> str:
+
+def extract_text_digital_from_file(pdf: str | Path | bytes, fast: bool = False) -> str:
+    """opens the pdf and extracts the text of the digital/searchable pdf. Used to run the extraction in an executor
+    as a pymupdf.Document cannot be sent to another process.
+
+    :param pdf: path to or content of the pdf
+    :param fast: see extract_text_digital
+    :return: str
+    """
+    with open_pdf(pdf) as document:
+        return extract_text_digital(document, fast)
+
+
+def extract_page_texts_from_file(pdf: str | Path | bytes, pages: range, fast: bool = False) -> list[str]:
+    """opens the pdf and extracts the text of a range of pages, used to extract a long pdf in several processes
+
+    :param pdf: path to or content of the pdf
+    :param pages: page numbers
+    :param fast: see extract_text_digital
+    :return: the text per page
+    """
+    with open_pdf(pdf) as document:
+        return extract_page_texts(document, fast, pages)
+
+
+def extract_first_pages_from_file(
+    pdf: str | Path | bytes, max_pages: Optional[int] = None
+) -> tuple[bool, int, list[str]]:
+    """opens the pdf, detects a scan (see is_scan) and extracts the text of the first pages of a digital pdf in a
+    single pass per page. Runs the fast extraction in an executor, such that the pdf is only opened in the worker.
+
+    :param pdf: path to or content of the pdf
+    :param max_pages: number of pages to extract, all pages by default
+    :return: is_scan, the number of pages and the text per extracted page
+    """
+    with open_pdf(pdf) as document:
+        if is_scan(document):
+            return True, document.page_count, []
+        pages = range(min(max_pages or document.page_count, document.page_count))
+        return False, document.page_count, extract_page_texts(document, True, pages)
+
+
+def create_executor(kind: Optional[Literal["process", "thread"]], max_workers: int = 2) -> Optional[Executor]:
+    """creates the pool in which the CPU-bound text extraction runs, such that the event loop is not blocked.
+
+    pymupdf is not thread safe, the thread pool always has a single worker. Prefer a process pool to extract several
+    PDFs at once.
+
+    :param kind: "process", "thread" or None to extract the text inside the event loop
+    :param max_workers: size of the process pool
+    :return: Executor or None
+    """
+    if kind == "process":
+        # spawn instead of fork, the crawler process runs threads (twisted, azure) that do not survive a fork
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="extract_text")
+    if kind:
+        raise ValueError(f"Unknown executor kind '{kind}', expected 'process', 'thread' or None.")
+    return None
+
+
+async def extract_text_scan(
+    pdf: pymupdf.Document,
+    endpoint: Optional[str] = None,
+    credential: Optional[DefaultAzureCredential] = None,
+    ocr_client: Optional[OcrClient] = None,
+    ocr_cache: Optional[OcrCache] = None,
+    pdf_bytes: Optional[bytes] = None,
+    crop: Optional[OcrCrop] = None,
+) -> str:
     """1st submits the pdf to the Azure Document Intelligence OCR engine afterwhich
     the text within the dotted lines is extracted.
 
     :param pdf: pymupdf.Document
+    :param ocr_client: long-lived OcrClient, when missing a client is created for this PDF only
+    :param ocr_cache: OcrCache with the results of previously OCR'ed PDFs
+    :param pdf_bytes: content of the pdf file, submitted as is instead of serializing the pymupdf.Document
+    :param crop: OcrCrop, when given only the region within the dotted lines of the pages is submitted
     :return: str
     """
-    ocred = await ocr_pdf(pdf, endpoint, credential)
-    text = ""
-    for ocr_page, scan_page in zip(ocred.pages, pdf):
-        _, _, width, height = scan_page.rect
-        sf_x, sf_y = width / ocr_page.width, height / ocr_page.height  # scaling factor
-        line_coords = [[point.y for point in line.polygon] for line in ocr_page.lines]
-        line_height = mode([max(coords) - min(coords) for coords in line_coords]) * sf_y
-        rel_coords = PAGE_0_REL_COORDS if scan_page.number == 0 else PAGE_N_REL_COORDS
-        crop = (rel_coords[0] * width, rel_coords[1] * height, rel_coords[2] * width, rel_coords[3] * height)
-
-        # sort lines from top left to bottom right.
-        lines = sorted(ocr_page.lines, key=lambda l: (min(p.y for p in l.polygon), min(p.x for p in l.polygon)))  # noqa
-        py0 = py1 = None
-        for line in lines:
-            x_coords = [point.x for point in line.polygon]
-            y_coords = [point.y for point in line.polygon]
-            x0, y0, x1, y1 = min(x_coords) * sf_x, min(y_coords) * sf_y, max(x_coords) * sf_x, max(y_coords) * sf_y
-            same_line = is_same_line(py0, py1, y0, y1, line_height)
-            within_crop = crop[0] <= x0 and x1 <= crop[2] and crop[1] <= y0 and y1 <= crop[3]
-            if not within_crop:
-                continue
-            text = add_text_line(text, line.content, same_line)
-            py0, py1 = y0, y1
-    return text
+    ocred = await ocr_pdf(pdf, endpoint, credential, ocr_client, ocr_cache, pdf_bytes, crop)
+    return join_lines(
+        layout_page(ocr_page, scan_page, crop.region(scan_page) if crop is not None else None)
+        for ocr_page, scan_page in zip(ocred.pages, pdf)
+    )
 
 
 async def extract_text(
-    pdf: pymupdf.Document | str | Path,
+    pdf: pymupdf.Document | str | Path | bytes,
     do_ocr: bool = True,
     endpoint: Optional[str] = None,
     credential: Optional[DefaultAzureCredential] = None,
+    executor: Optional[Executor] = None,
+    ocr_client: Optional[OcrClient] = None,
+    ocr_cache: Optional[OcrCache] = None,
+    fast: bool = False,
+    split_pages: Optional[int] = None,
+    ocr_crop: Optional[OcrCrop] = None,
+    metrics: Metrics = NULL_METRICS,
 ) -> tuple[Optional[str], bool]:
     """extracts text from a pdf. If the pdf is digital, the text will be extracted straight from the
     pdf. If  the pdf is a scan, the pdf will be submitted to Azure Document Intelligence OCR
     after which the text is extracted.
 
-    :param pdf: pymupdf.Document | str | Path
+    :param pdf: pymupdf.Document | str | Path | bytes (content of the pdf file)
     :param do_ocr: boolean if set to False no OCR will be performed when the provided pdf is a scan.
+    :param executor: when given, the text of a pdf path/content is extracted in this pool instead of in the event loop.
+    :param ocr_client: long-lived OcrClient, when missing a client is created per scan.
+    :param ocr_cache: OcrCache with the results of previously OCR'ed PDFs.
+    :param fast: detects scans from their first page (see is_scan) and extracts the text of digital pdfs in a single
+        pass per page (see extract_text_digital)
+    :param split_pages: with `fast` and a process pool, the pages of longer pdfs are extracted in parts of this many
+        pages at once
+    :param ocr_crop: OcrCrop, when given only the region within the dotted lines of the scanned pages is OCR'ed
+    :param metrics: records the latency of the extraction of digital pdfs (extract_digital, incl. detecting scans) and
+        of OCR (ocr) and the number of OCR'ed pages (ocr_pages)
     :return: tuple(text, is_digital)
     """
-    if isinstance(pdf, (str, Path)):
-        assert Path(pdf).exists(), pdf
-        pdf = pymupdf.open(pdf)
+    source = pdf
+    if isinstance(source, (str, Path)):
+        assert Path(source).exists(), source
+
+    document = None
+    start = time.perf_counter()
+    if fast and executor is not None and not isinstance(source, pymupdf.Document):
+        loop = asyncio.get_running_loop()
+        # the scan is detected in the worker, which extracts the first part. Only a process pool extracts the other
+        # parts of a long pdf at once, pymupdf is not thread safe.
+        split_pages = split_pages if isinstance(executor, ProcessPoolExecutor) else None
+        scan, page_count, page_texts = await loop.run_in_executor(
+            executor, extract_first_pages_from_file, source, split_pages
+        )
+        parts = []
+        if not scan and len(page_texts) < page_count:
+            parts = [
+                range(page_start, min(page_start + split_pages, page_count))
+                for page_start in range(len(page_texts), page_count, split_pages)
+            ]
+        for part_texts in await asyncio.gather(
+            *(loop.run_in_executor(executor, extract_page_texts_from_file, source, part, True) for part in parts)
+        ):
+            page_texts.extend(part_texts)
+        text = "" if scan else join_pages(page_texts)
+    elif fast:
+        document = open_pdf(source)  # pages are only loaded when used
+        text = "" if is_scan(document) else extract_text_digital(document, fast=True)
+    elif executor is not None and not isinstance(source, pymupdf.Document):
+        # the worker opens the pdf itself, a pymupdf.Document cannot be sent to another process
+        text = await asyncio.get_running_loop().run_in_executor(executor, extract_text_digital_from_file, source)
+    else:
+        document = open_pdf(source)
+        text = extract_text_digital(document)
+    metrics.observe("extract_digital", time.perf_counter() - start)
 
-    text = extract_text_digital(pdf)
     if text:
         is_digital = True
     elif not text and do_ocr:
-        text = await extract_text_scan(pdf, endpoint, credential)
+        # the original file is submitted, only a pymupdf.Document without file needs to be serialized again
+        pdf_bytes = Path(source).read_bytes() if isinstance(source, (str, Path)) else source
+        pdf_bytes = pdf_bytes if isinstance(pdf_bytes, bytes) else None
+        document = document or open_pdf(pdf_bytes)
+        with metrics.timer("ocr"):
+            text = await extract_text_scan(document, endpoint, credential, ocr_client, ocr_cache, pdf_bytes, ocr_crop)
+        metrics.inc("ocr_pages", document.page_count)
         is_digital = False
     else:
         text, is_digital = None, False
@@ -0,0 +1,181 @@
+"""
+contains the HTTP cache policy and storage of the Belgian Journal.
+
+Publications never change once published: PDFs below `/tsv_pdf/YYYY/MM/DD/` are cached forever and listing pages
+of dates that are settled (further in the past than HTTPCACHE_SETTLED_DAYS) are kept for HTTPCACHE_SETTLED_TTL
+seconds. Listings of recent dates and VAT searches (which grow with every new publication) are revalidated after
+HTTPCACHE_RECENT_TTL seconds. Responses are stored compressed in a single SQLite file of which the least recently
+used responses are evicted above HTTPCACHE_MAX_BYTES.
+"""
+
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Literal, Optional
+from urllib.parse import parse_qs, urlparse
+
+from scrapy.http import Headers, Request, Response
+from scrapy.responsetypes import responsetypes
+from scrapy.settings import Settings
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+
+logger = logging.getLogger(__name__)
+
+# header added to the cached responses with the unix time at which the response was stored
+STORED_AT_HEADER = b"X-Cache-Stored-At"
+
+__all__ = [
+    "BelgianJournalCachePolicy",
+    "CompressedSqliteCacheStorage",
+    "classify_url",
+]
+
+
+def classify_url(url: str, settled_before: date) -> Literal["pdf", "settled", "recent", "other"]:
+    """classifies a url of the Belgian Journal for caching
+
+    :param url: requested url
+    :param settled_before: listings of which the end date is before this date do not change anymore
+    :return: "pdf", "settled" (listing of past dates), "recent" (listing of recent dates or VAT search) or "other"
+    """
+    parsed = urlparse(url)
+    if parsed.path.startswith("/tsv_pdf/") and parsed.path.endswith(".pdf"):
+        return "pdf"
+    if not parsed.path.endswith(("/rech_res.pl", "/list.pl")):
+        return "other"
+
+    end_date = parse_qs(parsed.query).get("pdf")
+    try:
+        end_date = date.fromisoformat(end_date[0]) if end_date else None
+    except ValueError:
+        end_date = None
+    # a VAT search without end date includes the publications of today
+    return "settled" if end_date and end_date < settled_before else "recent"
+
+
+class BelgianJournalCachePolicy:
+    """caches successful GET requests, freshness depends on the kind of url (see classify_url)"""
+
+    def __init__(self, settings: Settings):
+        self.ignore_http_codes = {int(code) for code in settings.getlist("HTTPCACHE_IGNORE_HTTP_CODES")}
+        self.settled_days = settings.getint("HTTPCACHE_SETTLED_DAYS", 7)
+        self.settled_ttl = settings.getint("HTTPCACHE_SETTLED_TTL", 0)
+        self.recent_ttl = settings.getint("HTTPCACHE_RECENT_TTL", 0)
+
+    def should_cache_request(self, request: Request) -> bool:
+        return request.method == "GET" and urlparse_cached(request).scheme not in ("file", "data")
+
+    def should_cache_response(self, response: Response, request: Request) -> bool:
+        return response.status == 200 and response.status not in self.ignore_http_codes
+
+    def is_cached_response_fresh(self, cachedresponse: Response, request: Request) -> bool:
+        kind = classify_url(request.url, date.today() - timedelta(days=self.settled_days))
+        if kind == "pdf":
+            return True
+
+        ttl = self.settled_ttl if kind == "settled" else self.recent_ttl
+        age = time.time() - float(cachedresponse.headers.get(STORED_AT_HEADER, 0))
+        if (kind == "settled" and not ttl) or age < ttl:  # a TTL of 0 keeps settled listings forever
+            return True
+
+        # revalidate with a conditional request when the server gave a validator
+        if b"ETag" in cachedresponse.headers:
+            request.headers[b"If-None-Match"] = cachedresponse.headers[b"ETag"]
+        if b"Last-Modified" in cachedresponse.headers:
+            request.headers[b"If-Modified-Since"] = cachedresponse.headers[b"Last-Modified"]
+        return False
+
+    def is_cached_response_valid(self, cachedresponse: Response, response: Response, request: Request) -> bool:
+        return response.status == 304
+
+
+class CompressedSqliteCacheStorage:
+    """stores the cached responses zlib compressed in one SQLite database per spider in HTTPCACHE_DIR"""
+
+    def __init__(self, settings: Settings):
+        self.cache_dir = Path(data_path(settings["HTTPCACHE_DIR"]))
+        self.max_bytes = settings.getint("HTTPCACHE_MAX_BYTES", 0)
+        self.compression_level = settings.getint("HTTPCACHE_COMPRESSION_LEVEL", 6)
+        self.db: Optional[sqlite3.Connection] = None
+        self._size = 0
+        self._fingerprinter = None
+
+    def open_spider(self, spider) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{spider.name}.sqlite"
+        self.db = sqlite3.connect(path, isolation_level=None)  # autocommit, every response is a single statement
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "fingerprint TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, body BLOB, compressed INTEGER, "
+            "size INTEGER, stored_at REAL, accessed_at REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        logger.debug(f"Using HTTP cache {path} ({self._size} bytes)")
+
+    def close_spider(self, spider) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _key(self, request: Request) -> str:
+        return self._fingerprinter.fingerprint(request).hex()
+
+    def retrieve_response(self, spider, request: Request) -> Optional[Response]:
+        key = self._key(request)
+        row = self.db.execute(
+            "SELECT url, status, headers, body, compressed, stored_at FROM responses WHERE fingerprint = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        url, status, headers, body, compressed, stored_at = row
+        self.db.execute("UPDATE responses SET accessed_at = ? WHERE fingerprint = ?", (time.time(), key))
+        body = zlib.decompress(body) if compressed else body
+        headers = Headers(json.loads(headers))
+        headers[STORED_AT_HEADER] = str(stored_at)
+        response_cls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return response_cls(url=url, status=status, headers=headers, body=body)
+
+    def store_response(self, spider, request: Request, response: Response) -> None:
+        body = response.body
+        compressed = zlib.compress(body, self.compression_level)
+        # PDFs hardly compress, those are stored as is
+        is_compressed = len(compressed) < 0.9 * len(body)
+        data = compressed if is_compressed else body
+        headers = {
+            key.decode("latin-1"): [value.decode("latin-1") for value in values]
+            for key, values in response.headers.items()
+            if key != STORED_AT_HEADER
+        }
+
+        key = self._key(request)
+        previous = self.db.execute("SELECT size FROM responses WHERE fingerprint = ?", (key,)).fetchone()
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, response.url, response.status, json.dumps(headers), data, is_compressed, len(data), now, now),
+        )
+        self._size += len(data) - (previous[0] if previous else 0)
+        if self.max_bytes and self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """removes the least recently used responses until the cache is 10% below its maximum size"""
+        target = self.max_bytes * 0.9
+        rows = self.db.execute("SELECT fingerprint, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for fingerprint, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((fingerprint,))
+            self._size -= size
+        self.db.executemany("DELETE FROM responses WHERE fingerprint = ?", evicted)
+        logger.debug(f"Evicted {len(evicted)} responses from the HTTP cache, size is now {self._size} bytes")
@@ -0,0 +1,197 @@
+"""
+contains the index of already scraped publications.
+
+Checking whether a publication was already scraped used to require listing the blob container per publication.
+The index keeps a compact sorted array of 64 bit hashes of `{vat}/{publication_number}` in memory instead, it is
+loaded once per run from the blob store and written back at the end of the run. Per company (vat) the date of the
+latest scraped publication is kept as well.
+"""
+
+import logging
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import date
+from hashlib import blake2b
+from pathlib import PurePosixPath
+from typing import Iterable, Optional
+
+from src.storage import BlobStore
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b"BJIX"
+INDEX_VERSION = 2
+
+__all__ = [
+    "PublicationIndex",
+    "parse_blob_name",
+]
+
+
+def parse_blob_name(name: str) -> Optional[tuple[str, str, Optional[date]]]:
+    """extracts vat, publication number and publication date from a publication blob name
+
+    :param name: blob name, e.g. `0471938850/2024/07/11/0104762.json`
+    :return: (vat, publication_number, publication_date) or None when the blob is not a publication
+    """
+    path = PurePosixPath(name)
+    if path.suffix != ".json" or len(path.parts) != 5 or name.startswith("_"):
+        return None
+    vat, year, month, day, _ = path.parts
+    try:
+        publication_date = date(int(year), int(month), int(day))
+    except ValueError:
+        publication_date = None
+    return vat, path.stem, publication_date
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _find(keys: array, key: int) -> Optional[int]:
+    """binary search of key in the sorted array keys, returns the position of the key or None"""
+    i = bisect_left(keys, key)
+    return i if i < len(keys) and keys[i] == key else None
+
+
+class PublicationIndex:
+    """set-like index of scraped (vat, publication_number) pairs
+
+    Membership checks do a binary search in the sorted array of hashes loaded at the start of the run and a set
+    lookup in the hashes added during the run. With 64 bit hashes the odds of a false positive stay below one in a
+    million for tens of millions of publications.
+    """
+
+    def __init__(self, keys: Optional[Iterable[int]] = None, vats: Optional[dict[int, int]] = None):
+        self._keys = array("Q", sorted(set(keys or ())))
+        self._added: set[int] = set()
+        vats = vats or {}
+        self._vat_keys = array("Q", sorted(vats))
+        self._vat_dates = array("I", (vats[key] for key in self._vat_keys))  # date.toordinal(), 0 when unknown
+        self._added_vats: dict[int, int] = {}
+
+    @staticmethod
+    def key(vat: str, publication_number: str) -> int:
+        return _hash(f"{vat}/{publication_number}")
+
+    @staticmethod
+    def vat_key(vat: str) -> int:
+        return _hash(vat)
+
+    def __contains__(self, publication: tuple[str, str]) -> bool:
+        return self._contains_key(self.key(*publication))
+
+    def _contains_key(self, key: int) -> bool:
+        return key in self._added or _find(self._keys, key) is not None
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._added)
+
+    @property
+    def num_vats(self) -> int:
+        return len(self._vat_keys) + sum(1 for key in self._added_vats if _find(self._vat_keys, key) is None)
+
+    def has_vat(self, vat: str) -> bool:
+        key = self.vat_key(vat)
+        return key in self._added_vats or _find(self._vat_keys, key) is not None
+
+    def last_publication_date(self, vat: str) -> Optional[date]:
+        """:return: date of the latest scraped publication of the company or None when unknown"""
+        ordinal = self._vat_ordinal(self.vat_key(vat))
+        return date.fromordinal(ordinal) if ordinal else None
+
+    def _vat_ordinal(self, key: int) -> int:
+        i = _find(self._vat_keys, key)
+        return max(self._added_vats.get(key, 0), self._vat_dates[i] if i is not None else 0)
+
+    def add(self, vat: str, publication_number: str, publication_date: Optional[date] = None) -> None:
+        key = self.key(vat, publication_number)
+        if not self._contains_key(key):
+            self._added.add(key)
+
+        vat_key = self.vat_key(vat)
+        ordinal = publication_date.toordinal() if publication_date else 0
+        self._added_vats[vat_key] = max(ordinal, self._vat_ordinal(vat_key))
+
+    @classmethod
+    def from_blob_names(cls, names: Iterable[str]) -> "PublicationIndex":
+        keys, vats = set(), {}
+        for publication in map(parse_blob_name, names):
+            if not publication:
+                continue
+            vat, publication_number, publication_date = publication
+            keys.add(cls.key(vat, publication_number))
+            vat_key = cls.vat_key(vat)
+            vats[vat_key] = max(vats.get(vat_key, 0), publication_date.toordinal() if publication_date else 0)
+        return cls(keys, vats)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PublicationIndex":
+        if data[:4] != INDEX_MAGIC or data[4:5] != bytes([INDEX_VERSION]):
+            raise ValueError(f"Unsupported publication index format: {data[:5]!r}")
+        index = cls()
+        num_keys, num_vats = struct.unpack_from("<II", data, 5)
+        offset = 13
+        for values, size in ((index._keys, num_keys * 8), (index._vat_keys, num_vats * 8)):
+            values.frombytes(data[offset : offset + size])
+            offset += size
+        index._vat_dates.frombytes(data[offset : offset + num_vats * 4])
+        if sys.byteorder == "big":
+            for values in (index._keys, index._vat_keys, index._vat_dates):
+                values.byteswap()
+        return index
+
+    def to_bytes(self) -> bytes:
+        self.compact()
+        arrays = [array(values.typecode, values) for values in (self._keys, self._vat_keys, self._vat_dates)]
+        if sys.byteorder == "big":
+            for values in arrays:
+                values.byteswap()
+        header = INDEX_MAGIC + bytes([INDEX_VERSION]) + struct.pack("<II", len(self._keys), len(self._vat_keys))
+        return header + b"".join(values.tobytes() for values in arrays)
+
+    def compact(self) -> None:
+        """merges the keys added during the run into the sorted arrays"""
+        if self._added:
+            self._keys = array("Q", sorted(set(self._keys) | self._added))
+            self._added = set()
+        if self._added_vats:
+            vats = dict(zip(self._vat_keys, self._vat_dates))
+            for key, ordinal in self._added_vats.items():
+                vats[key] = max(vats.get(key, 0), ordinal)
+            self._vat_keys = array("Q", sorted(vats))
+            self._vat_dates = array("I", (vats[key] for key in self._vat_keys))
+            self._added_vats = {}
+
+    def merge(self, other: "PublicationIndex") -> None:
+        other.compact()
+        self._added.update(key for key in other._keys if not self._contains_key(key))
+        for key, ordinal in zip(other._vat_keys, other._vat_dates):
+            self._added_vats[key] = max(ordinal, self._vat_ordinal(key))
+
+    @classmethod
+    def load(cls, store: BlobStore, name: str) -> "PublicationIndex":
+        """loads the index from the blob store, the first time it is built from a full listing of the store
+
+        :param store: BlobStore in which the publications are saved
+        :param name: name of the index blob
+        """
+        data = store.read(name)
+        if data is not None:
+            index = cls.from_bytes(data)
+            logger.info(f"Loaded publication index {name} with {len(index)} publications.")
+            return index
+
+        logger.info(f"Publication index {name} not found, building it from the blob store (one time).")
+        return cls.from_blob_names(store.list_names())
+
+    def save(self, store: BlobStore, name: str) -> None:
+        """writes the index to the blob store. Publications indexed in the meantime by other runs are kept."""
+        data = store.read(name)
+        if data is not None:
+            self.merge(PublicationIndex.from_bytes(data))
+        store.write(name, self.to_bytes())
+        logger.info(f"Saved publication index {name} with {len(self)} publications.")
@@ -3,6 +3,10 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
 import scrapy
 
 
@@ -15,3 +19,23 @@ class LegalEntityItem(scrapy.Item):
     file_urls = scrapy.Field()  # single URL
     files = scrapy.Field()  # Metadata bout the downloaded file
     file_path = scrapy.Field()  # location of the donwloaded pdf
+    file_body = scrapy.Field()  # content of the downloaded pdf (kept in memory until the text is extracted)
+
+
+@dataclass(slots=True)
+class PublicationRecord:
+    """metadata of a publication parsed from a listing page, replaces the heavy Selector of the publication"""
+
+    pdf_relative_url: Optional[str]
+    pdf_absolute_url: Optional[str]
+    pubid: Optional[str]  # last two digits of publication date year + publication number
+    company_name: Optional[str]
+    company_juridical_form: str
+    address: Optional[str]
+    vat: Optional[str]
+    act_description: Optional[str]
+    street: Optional[str]
+    zipcode: Optional[str]
+    city: Optional[str]
+    publication_date: Optional[date]
+    publication_number: Optional[str]
@@ -0,0 +1,182 @@
+"""
+contains the parser of the listing pages of the Belgian Journal.
+
+Instead of running several relative XPath queries per publication element (`main/div[2]/div/div[*]`), every field is
+extracted for all elements of the page at once with a compiled XPath query. The query also returns the publication
+elements themselves, which separate the values of one element from the next, so no lxml element proxies are created
+for the nodes in between. The patterns are compiled once. The fields are the same as the XPath queries of the spider:
+- urls: `./div//a/@href` (only the PDF urls)
+- company name: `./div/p/font/text()`
+- juridical form: `./div/p/text()[2]`
+- metadata: `./div/a[1]/text()`
+"""
+
+import logging
+import re
+from datetime import date
+from typing import Optional, Tuple
+
+from lxml import etree
+
+from src.items import PublicationRecord
+
+logger = logging.getLogger(__name__)
+
+PUBLICATION_ELEMENTS_PATH = "/html/body/div/div[4]/div/main/div[2]/div/div[*]"
+# relative paths of the fields of a publication element
+FIELD_PATHS = (
+    "div//a/@href[substring(., string-length(.) - 3) = '.pdf']",
+    "div/p/font/text()",
+    "div/p/text()[2]",
+    "div/a[1]/text()",
+)
+LISTING_QUERIES = tuple(
+    etree.XPath(f"{PUBLICATION_ELEMENTS_PATH} | {PUBLICATION_ELEMENTS_PATH}/{path}", smart_strings=False)
+    for path in FIELD_PATHS
+)
+ADDRESS_PATTERN = re.compile(r"^(?P<street>.*)\s(?P<zipcode>\d{4})\s(?P<city>.*)$")
+DATE_AND_NUMBER_PATTERN = re.compile(r"^(?P<date>\d{4}-\d{2}-\d{2})\s/\s(?P<number>\d*-?\d+)$")
+YEAR_AND_NUMBER_PATTERN = re.compile(r"^(?P<date>\d{4})\s/\s(?P<number>\d*-?\d+)$")
+NUM_RESULTS_PATTERN = re.compile(r"Lijst\s*\((\d+)\)")
+PAGE_PARAMETER_PATTERN = re.compile(r"[?&]page=(\d+)")
+
+__all__ = [
+    "extract_address",
+    "extract_publication_date_and_number",
+    "parse_listing",
+    "parse_metadata",
+    "parse_num_results",
+    "parse_page_number",
+    "parse_publication_url",
+]
+
+
+def parse_publication_url(urls: list[str], base_url: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """finds the publication url from all the urls in the publication div
+
+    :param urls: list of urls
+    :param base_url: prefix of the absolute url
+    :return: pdf_relative_url, pdf_absolute_url, pubid
+    """
+    urls = [url for url in urls if url.endswith(".pdf")]  # already filtered by the listing queries
+    if len(urls) == 1:
+        pdf_relative_url = urls[0]
+        name = pdf_relative_url.rpartition("/")[2]
+        pubid = name[: -len(".pdf")] or name  # stem of the file name
+        return pdf_relative_url, base_url + pdf_relative_url, pubid
+
+    if len(urls) > 1:
+        logger.error(f"Multiple urls found in the publication div, could not extract pdfurl from {urls}")
+
+    return None, None, None
+
+
+def parse_metadata(pub_metadata: list[str]) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+    """parses the metadata section in the publication element
+
+    :param pub_metadata: metadata section in publication element
+    :return: address, vat, act_description and pub_date_and_number
+    """
+    if len(pub_metadata) == 4:
+        return tuple(pub_metadata)
+    if len(pub_metadata) == 6:
+        return tuple(pub_metadata[:4])
+    logger.warning(f"Unimplemented metadata format with length {len(pub_metadata)}: {pub_metadata}")
+    return None, None, None, None
+
+
+def extract_address(address: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """extracts the city, zipcode and street from the address metadata section
+
+    :param address: address metadata, e.g. `RUE JACQUES JORDAENS 32A, BTE6 1000 BRUXELLES`
+    :return: city, zipcode and street
+    """
+    if not address:
+        return None, None, None
+
+    address_matched = ADDRESS_PATTERN.match(address)
+    if address_matched is None:
+        logger.warning(f"Could not extract street, zipcode and city from address: '{address}'. ")
+        return None, None, None
+    return address_matched.group("city"), address_matched.group("zipcode"), address_matched.group("street")
+
+
+def extract_publication_date_and_number(pub_date_and_number: Optional[str]) -> Tuple[Optional[date], Optional[str]]:
+    """extracts the publication date and number
+
+    :param pub_date_and_number: combined date and number, e.g. `2024-06-05 / 0402585` or `1998 / 0402585`
+    :return: publication_date, publication_number
+    """
+    if not pub_date_and_number:
+        return None, None
+
+    match = DATE_AND_NUMBER_PATTERN.match(pub_date_and_number)
+    if match is not None:
+        return date.fromisoformat(match.group("date")), match.group("number")
+
+    # older publications have often only the year specified.
+    match = YEAR_AND_NUMBER_PATTERN.match(pub_date_and_number)
+    if match is not None:
+        return date(int(match.group("date")), 1, 1), match.group("number")
+
+    logger.warning(f"Could not extract publication date and number from: '{pub_date_and_number}'")
+    return None, None
+
+
+def _record(
+    urls: list[str], company_names: list[str], juridical_forms: list[str], pub_metadata: list[str], base_url: str
+) -> PublicationRecord:
+    pdf_relative_url, pdf_absolute_url, pubid = parse_publication_url(urls, base_url)
+    address, vat, act_description, pub_date_and_number = parse_metadata([text.strip() for text in pub_metadata])
+    vat = vat.replace(".", "").strip() if vat else None
+    city, zipcode, street = extract_address(address)
+    publication_date, publication_number = extract_publication_date_and_number(pub_date_and_number)
+    return PublicationRecord(
+        pdf_relative_url=pdf_relative_url,
+        pdf_absolute_url=pdf_absolute_url,
+        pubid=pubid,
+        company_name=company_names[0] if company_names else None,
+        company_juridical_form=juridical_forms[0].strip() if juridical_forms else "",
+        address=address,
+        vat=vat,
+        act_description=act_description,
+        street=street,
+        zipcode=zipcode,
+        city=city,
+        publication_date=publication_date,
+        publication_number=publication_number,
+    )
+
+
+def _grouped(query: etree.XPath, root: etree._Element) -> list[list[str]]:
+    """:return: the values of the query per publication element (the elements separate the values)"""
+    groups = []
+    for node in query(root):
+        if isinstance(node, str):
+            groups[-1].append(node)
+        else:
+            groups.append([])
+    return groups
+
+
+def parse_listing(root: etree._Element, base_url: str) -> list[PublicationRecord]:
+    """parses the publication elements of a listing page
+
+    :param root: lxml root of the listing page, e.g. `response.selector.root`
+    :param base_url: prefix of the absolute pdf urls
+    :return: a PublicationRecord per publication element
+    """
+    fields = [_grouped(query, root) for query in LISTING_QUERIES]
+    return [_record(*element_fields, base_url) for element_fields in zip(*fields)]
+
+
+def parse_num_results(text: str) -> Optional[int]:
+    """:return: the number of results of a search from its first listing page (e.g. `Lijst (109)`) or None"""
+    match = NUM_RESULTS_PATTERN.search(text)
+    return int(match.group(1)) if match else None
+
+
+def parse_page_number(url: Optional[str]) -> Optional[int]:
+    """:return: the page of a listing url (its `page` parameter) or None"""
+    match = PAGE_PARAMETER_PATTERN.search(url) if url else None
+    return int(match.group(1)) if match else None
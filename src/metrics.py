@@ -0,0 +1,290 @@
+"""
+contains the metrics of a run: latency histograms per stage, counters and gauges.
+
+The spiders, the pipelines, the OCR client and the uploader record into `spider.metrics`. When METRICS is disabled
+that is `NULL_METRICS`, of which every method does nothing, such that the instrumentation costs a method call.
+
+Stages (latency histograms in seconds): listing_download, listing_parse, pdf_download, extract_text,
+extract_digital, ocr, ocr_wait (waiting for a free OCR slot), ocr_job (submit and poll), upload.
+Counters: listing_pages, listing_bytes, pdfs_downloaded, pdf_bytes, pdfs_digital, pdfs_scan, ocr_pages,
+publication_bytes, upload_bytes. Gauges (current and maximum): scheduler_requests, downloads_active, items_active,
+uploads_pending, ocr_jobs_in_flight.
+
+The MetricsExtension copies the metrics to the Scrapy stats (`metrics/...`) and optionally serves them in the
+Prometheus text format on `http://{METRICS_HOST}:{METRICS_PORT}/metrics` and writes them to METRICS_FILE at close.
+"""
+
+import json
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the histogram buckets, the last bucket is unbounded
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+NAMESPACE = "belgian_journal"
+
+__all__ = [
+    "Histogram",
+    "Metrics",
+    "NullMetrics",
+    "NULL_METRICS",
+    "MetricsExtension",
+]
+
+
+class Histogram:
+    """counts observations per bucket (like a Prometheus histogram) and keeps their sum and maximum"""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """:return: estimate of the quantile, interpolated linearly within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - cumulative) / count)
+            cumulative += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_s": round(self.sum, 6),
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self) -> "_Timer":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.metrics.observe(self.stage, perf_counter() - self.start)
+
+
+class Metrics:
+    """registry of the metrics of a run, safe to read from the thread of the HTTP endpoint"""
+
+    enabled = True
+
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        self.gauge_max: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: Optional[float]) -> None:
+        """records the latency of a stage, None (e.g. an unknown download latency) is ignored"""
+        if seconds is None:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, stage: str) -> _Timer:
+        """measures the latency of the stage within a `with` block (also around awaits)"""
+        return _Timer(self, stage)
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+            self.gauge_max[name] = max(self.gauge_max.get(name, value), value)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "stages": {stage: histogram.to_dict() for stage, histogram in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": {name: {"value": value, "max": self.gauge_max[name]} for name, value in self.gauges.items()},
+            }
+
+    def to_stats(self, stats, prefix: str = "metrics/") -> None:
+        """copies the metrics to the Scrapy stats, e.g. `metrics/ocr/p99_ms` and `metrics/pdf_bytes`"""
+        metrics = self.to_dict()
+        for stage, values in metrics["stages"].items():
+            for key, value in values.items():
+                stats.set_value(f"{prefix}{stage}/{key}", value)
+        for name, value in metrics["counters"].items():
+            stats.set_value(f"{prefix}{name}", value)
+        for name, values in metrics["gauges"].items():
+            stats.set_value(f"{prefix}{name}/max", values["max"])
+
+    def render_prometheus(self, namespace: str = NAMESPACE) -> str:
+        """:return: the metrics in the Prometheus text exposition format"""
+        lines = [f"# TYPE {namespace}_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for upper, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{namespace}_stage_seconds_bucket{{stage="{stage}",le="{upper}"}} {cumulative}')
+                lines.append(f'{namespace}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{namespace}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {namespace}_{name}_total counter", f"{namespace}_{name}_total {value}"]
+            for name, value in sorted(self.gauges.items()):
+                lines += [f"# TYPE {namespace}_{name} gauge", f"{namespace}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class NullMetrics(Metrics):
+    """stands in for the metrics when they are disabled, records nothing"""
+
+    enabled = False
+    _timer = nullcontext()
+
+    def observe(self, stage: str, seconds: Optional[float]) -> None:
+        pass
+
+    def timer(self, stage: str) -> nullcontext:
+        return self._timer
+
+    def inc(self, name: str, value: float = 1) -> None:
+        pass
+
+    def set_gauge(self, name: str, value: float) -> None:
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class _MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, metrics: Metrics):
+        self.metrics = metrics
+        super().__init__((host, port), _MetricsHandler)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # scrapes are not logged
+
+
+class MetricsExtension:
+    """publishes `spider.metrics`: samples the queue depths of the engine every METRICS_INTERVAL seconds, copies the
+    metrics to the Scrapy stats, serves them on METRICS_HOST:METRICS_PORT and writes them to METRICS_FILE when the spider closes.
+    Only enabled when METRICS is set.
+    """
+
+    def __init__(
+        self,
+        crawler,
+        interval: float = 10.0,
+        port: Optional[int] = None,
+        path: Optional[str] = None,
+        host: str = "127.0.0.1",
+    ):
+        self.crawler = crawler
+        self.interval = interval
+        self.host = host
+        self.port = port
+        self.path = path
+        self.metrics: Metrics = NULL_METRICS
+        self.server: Optional[_MetricsServer] = None
+        self.sampler = task.LoopingCall(self.sample)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("METRICS"):
+            raise NotConfigured("METRICS is not set.")
+        extension = cls(
+            crawler,
+            interval=crawler.settings.getfloat("METRICS_INTERVAL", 10.0),
+            port=crawler.settings.getint("METRICS_PORT") or None,
+            path=crawler.settings["METRICS_FILE"],
+            host=crawler.settings.get("METRICS_HOST", "127.0.0.1"),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider) -> None:
+        self.metrics = getattr(spider, "metrics", NULL_METRICS)
+        if not self.metrics.enabled:
+            return
+        if self.port:
+            self.server = _MetricsServer(self.host, self.port, self.metrics)
+            threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+            logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        self.sampler.start(self.interval, now=False)
+
+    def sample(self) -> None:
+        """records the queue depths of the engine and copies the metrics to the stats"""
+        engine = self.crawler.engine
+        if engine is not None and engine.slot is not None:
+            self.metrics.set_gauge("scheduler_requests", len(engine.slot.scheduler))
+            self.metrics.set_gauge("downloads_active", len(engine.downloader.active))
+            if engine.scraper.slot is not None:
+                self.metrics.set_gauge("items_active", len(engine.scraper.slot.active))
+        self.metrics.to_stats(self.crawler.stats)
+
+    def spider_closed(self, spider) -> None:
+        if not self.metrics.enabled:
+            return
+        if self.sampler.running:
+            self.sampler.stop()
+        self.metrics.to_stats(self.crawler.stats)
+        if self.path:
+            Path(self.path).write_text(json.dumps(self.metrics.to_dict(), indent=2))
+            logger.info(f"Wrote metrics to {self.path}")
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
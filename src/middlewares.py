@@ -3,8 +3,15 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import asyncio
+from typing import Literal, Optional
+
 # useful for handling different item types with a single interface
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request
+
+from src.archive import HttpArchive
 
 
 class BelgianJournalSpiderMiddleware:
@@ -15,47 +22,66 @@ class BelgianJournalSpiderMiddleware:
 
 
 class BelgianJournalDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """records the responses of a crawl in an HttpArchive or replays them from it
+
+    HTTP_ARCHIVE_MODE = "record": every downloaded response (listing pages, PDFs, robots.txt) is written to the
+    archive in HTTP_ARCHIVE_DIR. HTTP_ARCHIVE_MODE = "replay": responses are served from the archive instead of the
+    website, optionally after HTTP_ARCHIVE_LATENCY seconds, requests that were not recorded are ignored.
+    Without HTTP_ARCHIVE_MODE the middleware does nothing.
+
+    The middleware sits right before the downloader, such that raw responses (compressed, redirects, errors) are
+    recorded and replayed through the other middlewares exactly like in the recorded run.
+    """
+
+    def __init__(self, crawler, mode: Optional[Literal["record", "replay"]], directory: str, latency: float = 0.0):
+        if mode not in (None, "record", "replay"):
+            raise ValueError(f"Unknown HTTP_ARCHIVE_MODE '{mode}', expected 'record', 'replay' or None.")
+        self.crawler = crawler
+        self.mode = mode
+        self.latency = latency
+        self.archive = HttpArchive(directory, writable=mode == "record") if mode else None
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        s = cls(
+            crawler,
+            settings.get("HTTP_ARCHIVE_MODE"),
+            settings.get("HTTP_ARCHIVE_DIR"),
+            settings.getfloat("HTTP_ARCHIVE_LATENCY", 0.0),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
-    def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
+    def fingerprint(self, request: Request) -> str:
+        return self.crawler.request_fingerprinter.fingerprint(request).hex()
 
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
+    async def process_request(self, request, spider):
+        if self.mode != "replay":
+            return None
 
-    def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
+        response = self.archive.read(self.fingerprint(request))
+        if response is None:
+            self.crawler.stats.inc_value("http_archive/miss", spider=spider)
+            raise IgnoreRequest(f"{request.url} is not in the HTTP archive.")
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
-        return response
-
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        self.crawler.stats.inc_value("http_archive/replayed", spider=spider)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return response.replace(request=request)
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+    def process_response(self, request, response, spider):
+        if self.mode == "record" and "archived" not in response.flags:
+            self.archive.write(self.fingerprint(request), response)
+            self.crawler.stats.inc_value("http_archive/recorded", spider=spider)
+        return response
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+        if self.mode:
+            spider.logger.info(f"HTTP archive in {self.mode} mode ({len(self.archive)} responses).")
+
+    def spider_closed(self, spider):
+        if self.archive is not None:
+            self.archive.close()
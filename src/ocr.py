@@ -0,0 +1,261 @@
+"""
+contains the OCR client shared by all scanned PDFs of a run.
+
+A single Azure Document Intelligence client is kept open for the whole run (no TLS setup and token acquisition per
+PDF) and the number of concurrent OCR jobs is governed by an adaptive limiter: it shrinks whenever the endpoint
+throttles (HTTP 429) and slowly grows again while the jobs succeed. OCR results can be cached by PDF content, such
+that reprocessing publications does not OCR them again.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import zlib
+from pathlib import Path
+from typing import Any, Optional
+
+from azure.ai.formrecognizer import AnalyzeResult
+from azure.ai.formrecognizer.aio import DocumentAnalysisClient
+from azure.core.exceptions import HttpResponseError
+
+from src.metrics import NULL_METRICS, Metrics
+from src.storage import BlobStore
+
+logger = logging.getLogger(__name__)
+
+OCR_MODEL_ID = "prebuilt-read"
+
+__all__ = [
+    "AdaptiveLimiter",
+    "OcrClient",
+    "OcrCache",
+    "dump_analyze_result",
+    "load_analyze_result",
+]
+
+
+class AdaptiveLimiter:
+    """limits the number of concurrent jobs with additive increase / multiplicative decrease (AIMD)
+
+    Every successful job raises the limit by `1 / limit` (i.e. roughly +1 per round of jobs), every throttled job
+    halves it.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32):
+        self.minimum = minimum
+        self.maximum = maximum
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+    def on_throttled(self) -> None:
+        limit = max(self.minimum, self._limit / 2)
+        if int(limit) < self.limit:
+            logger.info(f"OCR endpoint is throttling, lowering OCR concurrency to {int(limit)}")
+        self._limit = limit
+
+
+class OcrClient:
+    """long-lived Document Intelligence client of which the concurrency is governed by an AdaptiveLimiter"""
+
+    def __init__(
+        self,
+        client: Any,
+        limiter: Optional[AdaptiveLimiter] = None,
+        polling_interval: float = 5.0,
+        model_id: str = OCR_MODEL_ID,
+        max_retries: int = 5,
+        metrics: Metrics = NULL_METRICS,
+    ):
+        """
+        :param client: DocumentAnalysisClient (or a stand-in) that calls `on_response` with every response
+        :param limiter: AdaptiveLimiter governing the number of concurrent OCR jobs
+        :param polling_interval: seconds between polls of the status of an OCR job
+        :param model_id: Document Intelligence model
+        :param max_retries: number of retries of a throttled OCR job (on top of the retries of the azure sdk)
+        :param metrics: records the waiting for a free slot (ocr_wait) and the OCR jobs (ocr_job)
+        """
+        self.client = client
+        self.limiter = limiter or AdaptiveLimiter()
+        self.polling_interval = polling_interval
+        self.model_id = model_id
+        self.max_retries = max_retries
+        self.metrics = metrics
+
+    @classmethod
+    def from_endpoint(cls, endpoint: str, credential: Any, **kwargs) -> "OcrClient":
+        limiter = kwargs.pop("limiter", None) or AdaptiveLimiter()
+        instance = cls(None, limiter, **kwargs)
+        instance.client = DocumentAnalysisClient(
+            endpoint=endpoint, credential=credential, raw_response_hook=instance.on_response
+        )
+        return instance
+
+    def on_response(self, response) -> None:
+        """raw_response_hook of the client, the only place where throttling is signalled to the limiter: the hook
+        sees every response, including the 429s that the azure sdk retries by itself
+        """
+        if response.http_response.status_code == 429:
+            self.limiter.on_throttled()
+
+    async def analyze(self, pdf_bytes: bytes) -> AnalyzeResult:
+        """OCRs the PDF, waits for a free slot of the limiter first
+
+        :param pdf_bytes: content of the PDF
+        :return: AnalyzeResult
+        """
+        for attempt in range(self.max_retries + 1):
+            with self.metrics.timer("ocr_wait"):
+                await self.limiter.acquire()
+            self.metrics.set_gauge("ocr_jobs_in_flight", self.limiter.in_flight)
+            try:
+                with self.metrics.timer("ocr_job"):
+                    poller = await self.client.begin_analyze_document(
+                        model_id=self.model_id, document=pdf_bytes, polling_interval=self.polling_interval
+                    )
+                    result = await poller.result()
+            except HttpResponseError as e:
+                if e.status_code != 429 or attempt == self.max_retries:
+                    raise
+                delay = self.polling_interval * 2**attempt * random.uniform(0.5, 1.5)
+                logger.warning(f"OCR request was throttled, retrying in {delay:.1f}s...")
+            else:
+                self.limiter.on_success()
+                return result
+            finally:
+                await self.limiter.release()
+                self.metrics.set_gauge("ocr_jobs_in_flight", self.limiter.in_flight)
+            await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def dump_analyze_result(result: AnalyzeResult) -> bytes:
+    """serializes the page, line and polygon data of an OCR result (all that is needed for the text extraction)
+    into compressed JSON. Floats are written with repr, so they are restored exactly.
+    """
+    pages = [
+        {
+            "page_number": page.page_number,
+            "width": page.width,
+            "height": page.height,
+            "unit": page.unit,
+            "angle": page.angle,
+            "lines": [[line.content, [c for point in line.polygon for c in (point.x, point.y)]] for line in page.lines],
+        }
+        for page in result.pages
+    ]
+    data = {"version": 1, "model_id": result.model_id, "pages": pages}
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def load_analyze_result(data: bytes) -> AnalyzeResult:
+    """restores an OCR result serialized with dump_analyze_result"""
+    data = json.loads(zlib.decompress(data))
+    pages = []
+    for page in data["pages"]:
+        lines = [
+            {"content": content, "polygon": [{"x": x, "y": y} for x, y in zip(coords[::2], coords[1::2])]}
+            for content, coords in page.pop("lines")
+        ]
+        pages.append({**page, "lines": lines})
+    return AnalyzeResult.from_dict({"model_id": data["model_id"], "pages": pages})
+
+
+class OcrCache:
+    """content-addressed cache of OCR results
+
+    Results are keyed by the hash of the OCR'ed PDF and the OCR model. They are kept on local disk with least
+    recently used eviction once `max_bytes` is exceeded and, optionally, in a blob store (shared between runs and
+    containers) below `blob_prefix`.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_bytes: int = 2 * 1024**3,
+        blob_store: Optional[BlobStore] = None,
+        blob_prefix: str = "_ocr_cache/",
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.blob_store = blob_store
+        self.blob_prefix = blob_prefix
+        self.hits = self.misses = 0
+        self._size = sum(path.stat().st_size for path in self.directory.glob("*/*.ocr"))
+
+    @staticmethod
+    def key(pdf_bytes: bytes, model_id: str = OCR_MODEL_ID) -> str:
+        return f"{hashlib.sha256(pdf_bytes).hexdigest()}-{model_id}"
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.ocr"
+
+    async def get(self, key: str) -> Optional[AnalyzeResult]:
+        path = self._path(key)
+        if path.exists():
+            os.utime(path)  # most recently used
+            self.hits += 1
+            return load_analyze_result(path.read_bytes())
+
+        if self.blob_store is not None:
+            data = await asyncio.to_thread(self.blob_store.read, self.blob_prefix + key)
+            if data is not None:
+                self._write_local(key, data)
+                self.hits += 1
+                return load_analyze_result(data)
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, result: AnalyzeResult) -> None:
+        data = dump_analyze_result(result)
+        self._write_local(key, data)
+        if self.blob_store is not None:
+            await asyncio.to_thread(self.blob_store.write, self.blob_prefix + key, data)
+
+    def _write_local(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        if path.exists():
+            self._size -= path.stat().st_size
+        path.write_bytes(data)
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        """removes the least recently used results until the cache is 10% below its maximum size"""
+        paths = sorted(self.directory.glob("*/*.ocr"), key=lambda path: path.stat().st_mtime)
+        for path in paths:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            self._size -= path.stat().st_size
+            path.unlink()
+        logger.debug(f"Evicted OCR results, cache size is now {self._size} bytes")
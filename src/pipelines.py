@@ -1,21 +1,28 @@
-import json
+import asyncio
+import hashlib
 import logging
 import shutil
 import time
+from concurrent.futures import Executor
 from datetime import timedelta
 from pathlib import Path
+from typing import Iterator, Optional
 from urllib.parse import urlparse
 
 import scrapy
-from scrapy.exceptions import DropItem
+from scrapy.exceptions import DropItem, NotConfigured
 from scrapy.pipelines.files import FilesPipeline
-from scrapy.utils.project import get_project_settings
+from scrapy.utils.defer import deferred_from_coro
 
-from src.extract_text import extract_text
+from src.codec import PayloadCodec
+from src.dataset import DatasetWriter
+from src.extract_text import OcrCrop, create_executor, extract_text
 from src.items import LegalEntityItem
+from src.metrics import NULL_METRICS
+from src.ocr import AdaptiveLimiter, OcrCache, OcrClient
 from src.spiders import BaseLegalEntitySpider
-
-SETTINGS = get_project_settings()
+from src.storage import AsyncAzureBlobStore, AsyncBlobStore, LocalBlobStore, ThreadedBlobStore, delete_blobs
+from src.uploader import BlobUploader
 
 # Azure info is used a lot (per putting a BLOB once)
 azurelogger = logging.getLogger("azure")
@@ -34,6 +41,20 @@ class LegalEntityFilePipeline(FilesPipeline):
         path = urlparse(request.url).path.replace("/tsv_pdf", "")
         return path
 
+    def file_downloaded(self, response, request, info, *, item=None):
+        """keeps the downloaded PDF in memory on the item, such that it does not need to be read again from disk.
+        The PDF is only written to FILES_STORE when PERSIST_PDFS is set.
+        """
+        metrics = getattr(info.spider, "metrics", NULL_METRICS)
+        metrics.observe("pdf_download", response.meta.get("download_latency"))
+        metrics.inc("pdfs_downloaded")
+        metrics.inc("pdf_bytes", len(response.body))
+        if item is not None:
+            item["file_body"] = response.body
+        if info.spider.settings.getbool("PERSIST_PDFS"):
+            return super().file_downloaded(response, request, info, item=item)
+        return hashlib.md5(response.body).hexdigest()
+
     def item_completed(self, results, item, info):
         """Runs after the PDF was downloaded.
 
@@ -41,8 +62,9 @@ class LegalEntityFilePipeline(FilesPipeline):
         (either PDF was digital from start or we OCR'ed it using Azure Cognitive Services)
         """
         status, result = results[0]  # only one pdf is downloaded per item so results is always of length 1
+        settings = info.spider.settings
 
-        if not status and SETTINGS["ROBOTSTXT_OBEY"]:
+        if not status and settings["ROBOTSTXT_OBEY"]:
             raise DropItem(f"{item['file_urls'][0]} could not be downloaded due to `ROBOTSTXT_OBEY=True`.")
 
         if not status:
@@ -52,7 +74,17 @@ class LegalEntityFilePipeline(FilesPipeline):
         if not publication_date:
             raise DropItem(f"Publication date was not correctly extracted for {item['file_urls'][0]}.")
 
-        item["file_path"] = str(Path(SETTINGS["FILES_STORE"]) / Path(result["path"]).relative_to("/"))
+        if settings.getbool("PERSIST_PDFS") or not item.get("file_body"):
+            file_path = Path(settings["FILES_STORE"]) / Path(result["path"]).relative_to("/")
+            # PDFs that were already on disk from a previous run are not downloaded again (and are not kept in memory).
+            # The body is only kept on the item that downloaded the PDF, another item with the same url gets the
+            # cached result of the download without the PDF.
+            if not file_path.is_file():
+                raise DropItem(
+                    f"{item['file_urls'][0]} was already downloaded for another publication in this run and is not "
+                    "kept (`PERSIST_PDFS=False`)."
+                )
+            item["file_path"] = str(file_path)
 
         return item
 
@@ -73,12 +105,76 @@ class LegalEntityFilePipeline(FilesPipeline):
         """
         if isinstance(spider, BaseLegalEntitySpider) and spider.settings["CLEANUP_FILESTORE"]:
             spider.logger.info(f"Cleaning up {spider.settings['FILES_STORE']}")
-            folder = Path(SETTINGS["FILES_STORE"])
+            folder = Path(spider.settings["FILES_STORE"])
             if folder.exists():
                 shutil.rmtree(str(folder))
 
 
 class LegalEntityPipeline:
+    def __init__(self):
+        self.executor: Optional[Executor] = None
+        self.uploader: Optional[BlobUploader] = None
+        self.ocr_client: Optional[OcrClient] = None
+        self.ocr_cache: Optional[OcrCache] = None
+        self.ocr_crop: Optional[OcrCrop] = None
+        self.codec = PayloadCodec()
+
+    def open_spider(self, spider: scrapy.Spider):
+        """creates the (optional) pool in which the text of the PDFs is extracted and the uploader"""
+        if isinstance(spider, BaseLegalEntitySpider):
+            self.executor = create_executor(
+                spider.settings["EXTRACT_TEXT_EXECUTOR"], spider.settings.getint("EXTRACT_TEXT_WORKERS", 2)
+            )
+            self.uploader = BlobUploader(
+                self.create_blob_store(spider),
+                max_concurrency=spider.settings.getint("UPLOAD_CONCURRENCY", 16),
+                max_retries=spider.settings.getint("UPLOAD_RETRIES", 3),
+                backoff=spider.settings.getfloat("UPLOAD_RETRY_BACKOFF", 1.0),
+                metrics=spider.metrics,
+            )
+            self.codec = PayloadCodec(
+                spider.settings["PUBLICATION_ENCODING"] or None, spider.settings["PUBLICATION_COMPRESSION_LEVEL"]
+            )
+            if spider.settings["OCR"]:
+                self.ocr_client = self.create_ocr_client(spider)
+            if spider.settings["OCR"] and spider.settings.getbool("OCR_CROP"):
+                self.ocr_crop = OcrCrop(
+                    dpi=spider.settings.getint("OCR_CROP_DPI") or None,
+                    grayscale=spider.settings.getbool("OCR_CROP_GRAYSCALE", True),
+                    margin=spider.settings.getfloat("OCR_CROP_MARGIN", 0.02),
+                )
+            if spider.settings["OCR"] and spider.settings["OCR_CACHE_DIR"]:
+                blob_prefix = spider.settings["OCR_CACHE_BLOB_PREFIX"]
+                self.ocr_cache = OcrCache(
+                    spider.settings["OCR_CACHE_DIR"],
+                    max_bytes=spider.settings.getint("OCR_CACHE_MAX_BYTES"),
+                    blob_store=spider.blob_store if blob_prefix else None,
+                    blob_prefix=blob_prefix or "",
+                )
+
+    def create_ocr_client(self, spider: BaseLegalEntitySpider) -> OcrClient:
+        """returns the OCR client shared by all scans of the run, override to OCR with a stand-in
+        (e.g. with the LocalDocumentAnalysisClient of the benchmarks)
+        """
+        limiter = AdaptiveLimiter(
+            initial=spider.settings.getint("OCR_CONCURRENCY", 4),
+            minimum=1,
+            maximum=spider.settings.getint("OCR_MAX_CONCURRENCY", 32),
+        )
+        return OcrClient.from_endpoint(
+            spider.document_intelligence_url,
+            spider.azure_credential,
+            limiter=limiter,
+            polling_interval=spider.settings.getfloat("OCR_POLLING_INTERVAL", 5.0),
+            metrics=spider.metrics,
+        )
+
+    def create_blob_store(self, spider: BaseLegalEntitySpider) -> AsyncBlobStore:
+        """returns the store the publications are uploaded to, override to upload somewhere else than Azure
+        (e.g. `ThreadedBlobStore(LocalBlobStore(...))` in tests)
+        """
+        return AsyncAzureBlobStore.from_url(spider.azure_storage_account_url, spider.azure_container_name)
+
     async def process_item(self, item, spider):
         """Runs after the PDF was downloaded. Runs the Azure OCR as a coroutine to not block
         the scrapy processes.
@@ -100,14 +196,22 @@ class LegalEntityPipeline:
             )
 
         publication = item["publication_meta"]
-        pdf_path = item["file_path"]
+        # the downloaded PDF is read from memory when available, the item does not need to hold on to it afterwards
+        pdf = item.pop("file_body", None) or item["file_path"]
 
         start = time.perf_counter()
         text, is_digital = await extract_text(
-            pdf_path,
+            pdf,
             do_ocr=spider.settings["OCR"],
             endpoint=spider.document_intelligence_url,
             credential=spider.azure_credential,
+            executor=self.executor,
+            ocr_client=self.ocr_client,
+            ocr_cache=self.ocr_cache,
+            fast=spider.settings.getbool("EXTRACT_TEXT_FAST"),
+            split_pages=spider.settings.getint("EXTRACT_TEXT_SPLIT_PAGES") or None,
+            ocr_crop=self.ocr_crop,
+            metrics=spider.metrics,
         )
 
         if not is_digital and not spider.settings["OCR"]:
@@ -115,6 +219,8 @@ class LegalEntityPipeline:
 
         duration = timedelta(seconds=time.perf_counter() - start)
         spider.logger.debug(f"Extracted text in {duration} from {'digital' if is_digital else 'scan'} PDF.")
+        spider.metrics.observe("extract_text", duration.total_seconds())
+        spider.metrics.inc("pdfs_digital" if is_digital else "pdfs_scan")
 
         publication["text"] = text
         publication["is_digital"] = is_digital
@@ -126,21 +232,153 @@ class LegalEntityPipeline:
             / f"{item['publication_number']}.json"
         )
         tags = {"vat": vat, "publication_date": publication_date.strftime("%Y-%m-%d"), "status": "unprocessed"}
-        blob_client = spider.blob_service_client.get_blob_client(container=spider.azure_container_name, blob=meta_path)
-        blob_client.upload_blob(json.dumps(publication).encode("utf-8"), overwrite=True, tags=tags)
+
+        def on_uploaded():
+            spider.run_statistics.record(vat, publication_number)
+            if spider.publication_index is not None:
+                spider.publication_index.add(vat, publication_number, publication_date)
+            if spider.checkpoint is not None:
+                spider.checkpoint.publication_done(vat, publication_number)
+
+        # the upload runs in the background, waits only when the maximum number of uploads is in flight
+        data = self.codec.encode(publication)
+        spider.metrics.inc("publication_bytes", len(data))
+        await self.uploader.submit(meta_path, data, tags, on_uploaded, self.codec.content_encoding)
         return item
 
     def close_spider(self, spider: scrapy.Spider):
         """
-        cleans up the temporary PDF files at the end of the run
+        waits for the pending uploads and cleans up the temporary PDF files at the end of the run
 
         CLEANUP_FILESTORE deletes tmp_pdfs ==> forces redownload of a pdf when not available on BLOB
         CLEANUP_BLOBSTORE deletes Azure Container content ==> forces Scrapy Item in next run
+        the publication index is saved when the container is not cleaned up
         """
-        if isinstance(spider, BaseLegalEntitySpider) and spider.settings["CLEANUP_BLOBSTORE"]:
-            container = spider.azure_container_name
-            spider.logger.info(f"Cleaning up BLOBs on {container}")
-            blobs = spider.container_client.list_blob_names()
-            for blob in blobs:
-                blob_client = spider.blob_service_client.get_blob_client(container=container, blob=blob)
-                blob_client.delete_blob("include")
+        if not isinstance(spider, BaseLegalEntitySpider):
+            return None
+        return deferred_from_coro(self._close_spider(spider))
+
+    async def _close_spider(self, spider: BaseLegalEntitySpider):
+        if self.uploader is not None:
+            spider.logger.info(f"Waiting for {self.uploader.num_pending} pending uploads...")
+            await self.uploader.close()
+            spider.logger.info(
+                f"Uploaded {self.uploader.num_uploaded} publications, {self.uploader.num_failed} failed."
+            )
+
+        if self.ocr_client is not None:
+            await self.ocr_client.close()
+
+        if self.ocr_cache is not None:
+            spider.logger.info(f"OCR cache: {self.ocr_cache.hits} hits, {self.ocr_cache.misses} misses.")
+
+        if self.executor is not None:
+            self.executor.shutdown()
+
+        if spider.publication_index is not None and not spider.settings["CLEANUP_BLOBSTORE"]:
+            spider.publication_index.save(spider.blob_store, spider.settings["PUBLICATION_INDEX_BLOB"])
+
+        if spider.settings["CLEANUP_BLOBSTORE"]:
+            spider.logger.info(f"Cleaning up BLOBs on {spider.azure_container_name}")
+            start = time.perf_counter()
+            num_deleted, num_failed = await asyncio.to_thread(
+                delete_blobs,
+                spider.blob_store,
+                self.cleanup_names(spider),
+                batch_size=spider.settings.getint("CLEANUP_BATCH_SIZE", 256),
+                max_concurrency=spider.settings.getint("CLEANUP_CONCURRENCY", 8),
+            )
+            duration = time.perf_counter() - start
+            spider.logger.info(
+                f"Deleted {num_deleted} BLOBs in {duration:.1f}s ({num_deleted / max(duration, 1e-9):.0f} BLOBs/s), "
+                f"{num_failed} could not be deleted."
+            )
+
+    @staticmethod
+    def internal_prefixes(settings) -> tuple[str, ...]:
+        """:return: the prefixes of the BLOBs that are not publications (OCR cache, checkpoints, shards of the
+        coordinator, dataset, publication index and run summary)
+        """
+        names = (
+            settings["OCR_CACHE_BLOB_PREFIX"],
+            (settings["CHECKPOINT_BLOB"] or "").partition("{")[0],
+            settings["COORDINATOR_BLOB_PREFIX"],
+            settings["DATASET_PREFIX"],
+            settings["PUBLICATION_INDEX_BLOB"],
+            settings["RUN_SUMMARY_BLOB"],
+        )
+        return tuple(name for name in names if name)
+
+    @classmethod
+    def cleanup_names(cls, spider: BaseLegalEntitySpider) -> Iterator[str]:
+        """lists the BLOBs deleted by CLEANUP_BLOBSTORE, restricted to CLEANUP_PREFIXES and CLEANUP_DATE_PREFIX.
+        Only publications are deleted, the other BLOBs (see internal_prefixes) stay valid for the next run or are
+        written at the same time (the dataset).
+        """
+        internal_prefixes = cls.internal_prefixes(spider.settings)
+        date_prefix = spider.settings["CLEANUP_DATE_PREFIX"]
+        prefixes = spider.settings.getlist("CLEANUP_PREFIXES")
+        # the publication index would still contain the deleted publications, it is rebuilt in the next run that
+        # uses it (a missing index is ignored by the deletion)
+        yield spider.settings["PUBLICATION_INDEX_BLOB"]
+        for prefix in prefixes or [None]:
+            for name in spider.blob_store.list_names(prefix):
+                if name.startswith(internal_prefixes):
+                    continue
+                # publications are stored as {vat}/{yyyy}/{mm}/{dd}/{number}.json
+                if date_prefix and not name.partition("/")[2].startswith(date_prefix):
+                    continue
+                yield name
+
+
+class DatasetExportPipeline:
+    """collects the publications (metadata and text) in a sharded Parquet or JSONL dataset next to the JSON blobs,
+    such that the dataset can be read in bulk instead of blob by blob. Only enabled when DATASET_FORMAT is set.
+    """
+
+    def __init__(self):
+        self.writer: Optional[DatasetWriter] = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings["DATASET_FORMAT"]:
+            raise NotConfigured("DATASET_FORMAT is not set.")
+        return cls()
+
+    def open_spider(self, spider: scrapy.Spider):
+        if isinstance(spider, BaseLegalEntitySpider):
+            self.writer = DatasetWriter(
+                self.create_store(spider),
+                prefix=spider.settings["DATASET_PREFIX"],
+                file_format=spider.settings["DATASET_FORMAT"],
+                compression=spider.settings["DATASET_COMPRESSION"] or None,
+                max_rows=spider.settings.getint("DATASET_MAX_ROWS", 50_000),
+                max_bytes=spider.settings.getint("DATASET_MAX_BYTES", 64 * 1024**2),
+                max_buffered_bytes=spider.settings.getint("DATASET_MAX_BUFFERED_BYTES", 256 * 1024**2),
+                run_id=spider.settings["DATASET_RUN_ID"],
+            )
+
+    def create_store(self, spider: BaseLegalEntitySpider) -> AsyncBlobStore:
+        """returns the store of the dataset: DATASET_DIR when set, otherwise the BLOB container"""
+        if spider.settings["DATASET_DIR"]:
+            return ThreadedBlobStore(LocalBlobStore(spider.settings["DATASET_DIR"]))
+        return AsyncAzureBlobStore.from_url(spider.azure_storage_account_url, spider.azure_container_name)
+
+    async def process_item(self, item, spider):
+        """buffers the publication after its text was extracted by the LegalEntityPipeline"""
+        if self.writer is not None and isinstance(item, LegalEntityItem) and "text" in item["publication_meta"]:
+            await self.writer.add(item["publication_meta"])
+        return item
+
+    def close_spider(self, spider: scrapy.Spider):
+        """writes the remaining shards and the manifest of the run"""
+        if self.writer is None:
+            return None
+        return deferred_from_coro(self._close_spider(spider))
+
+    async def _close_spider(self, spider: BaseLegalEntitySpider):
+        await self.writer.close()
+        spider.logger.info(
+            f"Exported {self.writer.num_rows} publications in {len(self.writer.shards)} dataset shards "
+            f"(run {self.writer.run_id})."
+        )
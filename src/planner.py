@@ -0,0 +1,128 @@
+"""
+contains the planner of the date windows searched by the date spider.
+
+Instead of one search per calendar day, the date range is searched in wide windows (sparse days like weekends and
+holidays are merged with their neighbours). The first listing page of a window tells the number of results, a window
+with more than `max_results` results is split in parts with about the same number of results which are searched
+again. Every date is covered by exactly one accepted window.
+"""
+
+import math
+from collections import deque
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Iterator
+
+PAGE_SIZE = 100  # publications per listing page
+
+__all__ = [
+    "DateWindow",
+    "DateWindowPlanner",
+    "PlanResult",
+]
+
+
+@dataclass(frozen=True, slots=True)
+class DateWindow:
+    """dates from start up to and including end"""
+
+    start: date
+    end: date
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days + 1
+
+    def dates(self) -> Iterator[date]:
+        for i in range(self.days):
+            yield self.start + timedelta(days=i)
+
+
+@dataclass(slots=True)
+class PlanResult:
+    windows: list[DateWindow]  # accepted windows, in search order
+    num_requests: int  # listing requests incl. the first pages of the windows that were split
+    num_pages: int  # listing pages of the accepted windows
+
+
+class DateWindowPlanner:
+    def __init__(self, max_results: int = 2000, initial_days: int = 14, weekend_weight: float = 0.1):
+        """
+        :param max_results: windows with more results are split
+        :param initial_days: number of days of the windows that are searched first
+        :param weekend_weight: expected number of publications on a saturday/sunday relative to a weekday, used to
+            split windows in parts with about the same number of results
+        """
+        if max_results < 1 or initial_days < 1:
+            raise ValueError("max_results and initial_days must be at least 1.")
+        self.max_results = max_results
+        self.initial_days = initial_days
+        self.weekend_weight = weekend_weight
+
+    def day_weight(self, day: date) -> float:
+        return self.weekend_weight if day.weekday() >= 5 else 1.0
+
+    def initial_windows(self, start: date, end: date) -> list[DateWindow]:
+        """splits the date range in consecutive windows of `initial_days` (the last window can be shorter)"""
+        windows = []
+        while start <= end:
+            window_end = min(end, start + timedelta(days=self.initial_days - 1))
+            windows.append(DateWindow(start, window_end))
+            start = window_end + timedelta(days=1)
+        return windows
+
+    def split(self, window: DateWindow, num_results: int) -> list[DateWindow]:
+        """splits a window with too many results in parts of about `max_results` results
+
+        :param window: searched window
+        :param num_results: number of results of the window
+        :return: [window] when the window is accepted, otherwise the parts that need to be searched
+        """
+        if num_results <= self.max_results or window.days == 1:
+            return [window]
+
+        num_parts = min(window.days, math.ceil(num_results / self.max_results))
+        weights = [self.day_weight(day) for day in window.dates()]
+        total = sum(weights)
+        if total <= 0:
+            weights, total = [1.0] * window.days, float(window.days)
+
+        # cut after the day at which the cumulative weight reaches the next multiple of total / num_parts
+        cuts, cumulative = [], 0.0
+        for i, weight in enumerate(weights[:-1]):
+            cumulative += weight
+            if cumulative >= total * (len(cuts) + 1) / num_parts:
+                cuts.append(i)
+                if len(cuts) == num_parts - 1:
+                    break
+        if not cuts:  # all weight on the last day
+            cuts = [window.days - 2]
+
+        parts, start = [], window.start
+        for cut in cuts:
+            parts.append(DateWindow(start, window.start + timedelta(days=cut)))
+            start = parts[-1].end + timedelta(days=1)
+        parts.append(DateWindow(start, window.end))
+        return parts
+
+    def simulate(self, start: date, end: date, count: Callable[[DateWindow], int]) -> PlanResult:
+        """plans the date range offline, e.g. with synthetic per day counts
+
+        :param count: number of results of a window
+        :return: PlanResult
+        """
+        queue = deque(self.initial_windows(start, end))
+        windows, num_requests, num_pages = [], 0, 0
+        while queue:
+            window = queue.popleft()
+            num_results = count(window)
+            num_requests += 1
+            parts = self.split(window, num_results)
+            if len(parts) > 1:
+                queue.extendleft(reversed(parts))
+                continue
+            pages = max(1, math.ceil(num_results / PAGE_SIZE))
+            windows.append(window)
+            num_pages += pages
+            num_requests += pages - 1
+        return PlanResult(windows, num_requests, num_pages)
@@ -0,0 +1,327 @@
+"""
+contains the opt-in profiling of a crawl, e.g. of a slow production run in the container instance.
+
+PROFILER selects the profiler that runs from the opening until the closing of the spider:
+- "cprofile": deterministic profile of the main thread (the event loop), written as `profile.pstats`
+- "sampler": samples the stacks of all threads every PROFILE_SAMPLE_INTERVAL seconds from a background thread (no
+  tracing overhead in the profiled code), written in the collapsed stack format (`profile.collapsed`, one
+  `frame;frame;frame count` line per stack) of flamegraph.pl and speedscope
+Both also write `profile.txt`, a summary of the functions that took the most time (by cumulative time or by share of
+the samples) that can be read without any tools.
+
+The functions in PROFILE_SECTIONS are tagged: their calls are timed (`sections.json`: calls and wall time per tag)
+and sampled stacks that pass through them start with `[tag]`, so their share of the samples can be broken out.
+Tagged functions that run in the EXTRACT_TEXT_EXECUTOR process pool are not seen.
+
+With PROFILE_TRACEMALLOC_INTERVAL a tracemalloc snapshot is written every that many seconds and at the end of the
+run, `tracemalloc-top.txt` lists the lines that allocated the most memory since the first snapshot.
+All files are written to `{PROFILE_DIR}/{spider}-{start time}-{pid}/` when the spider closes.
+"""
+
+import cProfile
+import functools
+import importlib
+import inspect
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from types import CodeType, FrameType
+from typing import Any, Callable, Optional
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+# number of functions in the summaries (profile.txt) and of lines in tracemalloc-top.txt
+SUMMARY_LINES = 50
+
+# tag: "module:qualified name" of the function
+DEFAULT_SECTIONS = {
+    "parse_publications": "src.spiders.legal_entities:BaseLegalEntitySpider.parse_publications",
+    "extract_text_digital": "src.extract_text:extract_text_digital",
+    "extract_text_scan": "src.extract_text:extract_text_scan",
+    "upload": "src.uploader:BlobUploader._upload",
+}
+
+__all__ = [
+    "StackSampler",
+    "Sections",
+    "ProfilingExtension",
+]
+
+
+def _frame_label(code: CodeType) -> str:
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """samples the stacks of all threads (but its own) from a background thread"""
+
+    def __init__(self, interval: float = 0.005, tags: Optional[dict[CodeType, str]] = None):
+        """
+        :param interval: seconds between samples
+        :param tags: tag per code object, a stack that passes through the code starts with `[tag]`
+        """
+        self.interval = interval
+        self.tags = tags or {}
+        self.stacks: Counter[str] = Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.stacks[self._collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.num_samples += 1
+
+    def _collapse(self, thread_name: str, frame: Optional[FrameType]) -> str:
+        labels, tag = [], None
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            tag = self.tags.get(frame.f_code, tag)  # the outermost tagged function wins
+            frame = frame.f_back
+        labels.append(thread_name)
+        if tag is not None:
+            labels.append(f"[{tag}]")
+        return ";".join(reversed(labels))
+
+    def write_collapsed(self, path: Path) -> None:
+        with path.open("w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    def write_summary(self, path: Path, limit: int = SUMMARY_LINES) -> None:
+        """writes the frames (functions, threads and `[tag]`s) sorted by their share of the stacks they are in
+        (total) and the share of the stacks they are the innermost frame of (self)
+        """
+        total, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            labels = stack.split(";")
+            own[labels[-1]] += count
+            for label in set(labels):
+                total[label] += count
+        num_stacks = max(sum(self.stacks.values()), 1)
+        with path.open("w", encoding="utf-8") as file:
+            file.write(f"{self.num_samples} samples of {num_stacks} stacks, every {self.interval * 1000:g} ms\n\n")
+            file.write(f"{'total %':>8} {'self %':>8}  frame\n")
+            for label, count in total.most_common(limit):
+                file.write(f"{count / num_stacks:8.1%} {own[label] / num_stacks:8.1%}  {label}\n")
+
+
+class Sections:
+    """number of calls and wall time per tagged function"""
+
+    def __init__(self):
+        self.calls: Counter[str] = Counter()
+        self.seconds: Counter[str] = Counter()
+        self.max_seconds: dict[str, float] = {}
+
+    def record(self, tag: str, seconds: float) -> None:
+        self.calls[tag] += 1
+        self.seconds[tag] += seconds
+        self.max_seconds[tag] = max(self.max_seconds.get(tag, 0.0), seconds)
+
+    def wrap(self, tag: str, function: Callable) -> Callable:
+        """:return: the function that records its calls under `tag` (only the time spent inside generators counts)"""
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.record(tag, perf_counter() - start)
+
+        elif inspect.isgeneratorfunction(function):
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                generator, seconds = function(*args, **kwargs), 0.0
+                try:
+                    while True:
+                        start = perf_counter()
+                        try:
+                            value = next(generator)
+                        finally:
+                            seconds += perf_counter() - start
+                        yield value
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    self.record(tag, seconds)
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(tag, perf_counter() - start)
+
+        return wrapper
+
+    def to_dict(self) -> dict:
+        return {
+            tag: {
+                "calls": self.calls[tag],
+                "seconds": round(self.seconds[tag], 6),
+                "mean_ms": round(self.seconds[tag] / self.calls[tag] * 1000, 3),
+                "max_ms": round(self.max_seconds[tag] * 1000, 3),
+            }
+            for tag in sorted(self.calls)
+        }
+
+
+def _resolve(target: str) -> tuple[Any, str, Callable]:
+    """:return: the owner (module or class), attribute name and function of `module:qualified.name`"""
+    module_name, _, qualname = target.partition(":")
+    owner = importlib.import_module(module_name)
+    *path, name = qualname.split(".")
+    for attribute in path:
+        owner = getattr(owner, attribute)
+    return owner, name, getattr(owner, name)
+
+
+class ProfilingExtension:
+    """profiles the crawl from the opening until the closing of the spider, see the module documentation.
+    Only enabled when PROFILER or PROFILE_TRACEMALLOC_INTERVAL is set.
+    """
+
+    def __init__(
+        self,
+        profiler: Optional[str],
+        directory: str | Path,
+        sample_interval: float = 0.005,
+        tracemalloc_interval: Optional[float] = None,
+        tracemalloc_frames: int = 10,
+        sections: Optional[dict[str, str]] = None,
+    ):
+        if profiler not in (None, "cprofile", "sampler"):
+            raise ValueError(f"Unknown PROFILER {profiler!r}, use 'cprofile', 'sampler' or None.")
+        self.profiler = profiler
+        self.directory = Path(directory)
+        self.sample_interval = sample_interval
+        self.tracemalloc_interval = tracemalloc_interval
+        self.tracemalloc_frames = tracemalloc_frames
+        self.section_targets = DEFAULT_SECTIONS if sections is None else sections
+        self.sections = Sections()
+        self.output: Optional[Path] = None
+        self.profile: Optional[cProfile.Profile] = None
+        self.sampler: Optional[StackSampler] = None
+        self.snapshotter = task.LoopingCall(self.take_snapshot)
+        self.num_snapshots = 0
+        self._first_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._patched: list[tuple[Any, str, Callable]] = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings["PROFILER"] and not settings["PROFILE_TRACEMALLOC_INTERVAL"]:
+            raise NotConfigured("PROFILER and PROFILE_TRACEMALLOC_INTERVAL are not set.")
+        extension = cls(
+            settings["PROFILER"] or None,
+            settings["PROFILE_DIR"],
+            sample_interval=settings.getfloat("PROFILE_SAMPLE_INTERVAL", 0.005),
+            tracemalloc_interval=settings.getfloat("PROFILE_TRACEMALLOC_INTERVAL") or None,
+            tracemalloc_frames=settings.getint("PROFILE_TRACEMALLOC_FRAMES", 10),
+            sections=settings.getdict("PROFILE_SECTIONS") or None,
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def tag_sections(self) -> dict[CodeType, str]:
+        """wraps the functions of the sections
+
+        :return: tag per code object of the original functions (used by the sampler)
+        """
+        tags = {}
+        for tag, target in self.section_targets.items():
+            owner, name, function = _resolve(target)
+            self._patched.append((owner, name, function))
+            setattr(owner, name, self.sections.wrap(tag, function))
+            tags[function.__code__] = tag
+        return tags
+
+    def untag_sections(self) -> None:
+        for owner, name, function in reversed(self._patched):
+            setattr(owner, name, function)
+        self._patched.clear()
+
+    def spider_opened(self, spider) -> None:
+        self.output = self.directory / f"{spider.name}-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+        tags = self.tag_sections()
+        if self.profiler == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.profiler == "sampler":
+            self.sampler = StackSampler(self.sample_interval, tags)
+            self.sampler.start()
+        if self.tracemalloc_interval:
+            tracemalloc.start(self.tracemalloc_frames)
+            self.snapshotter.start(self.tracemalloc_interval, now=False)
+        logger.info(f"Profiling the crawl ({self.profiler or 'tracemalloc'}), results are written to {self.output}")
+
+    def take_snapshot(self) -> tracemalloc.Snapshot:
+        """writes a tracemalloc snapshot, e.g. `tracemalloc-003.snapshot` (load with tracemalloc.Snapshot.load)"""
+        snapshot = tracemalloc.take_snapshot()
+        self.output.mkdir(parents=True, exist_ok=True)
+        snapshot.dump(str(self.output / f"tracemalloc-{self.num_snapshots:03d}.snapshot"))
+        self.num_snapshots += 1
+        self._first_snapshot = self._first_snapshot or snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info(f"tracemalloc: {current / 1024**2:.1f} MiB traced, peak {peak / 1024**2:.1f} MiB.")
+        return snapshot
+
+    def spider_closed(self, spider) -> None:
+        self.output.mkdir(parents=True, exist_ok=True)
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.output / "profile.pstats")
+            with (self.output / "profile.txt").open("w", encoding="utf-8") as file:
+                pstats.Stats(self.profile, stream=file).sort_stats("cumulative").print_stats(SUMMARY_LINES)
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler.write_collapsed(self.output / "profile.collapsed")
+            self.sampler.write_summary(self.output / "profile.txt")
+            logger.info(f"Collected {self.sampler.num_samples} stack samples.")
+        self.untag_sections()
+        (self.output / "sections.json").write_text(json.dumps(self.sections.to_dict(), indent=2))
+
+        if tracemalloc.is_tracing():
+            if self.snapshotter.running:
+                self.snapshotter.stop()
+            first = self._first_snapshot
+            last = self.take_snapshot()
+            tracemalloc.stop()
+            top = last.compare_to(first, "lineno") if first is not last else last.statistics("lineno")
+            (self.output / "tracemalloc-top.txt").write_text(
+                "\n".join(str(stat) for stat in top[:SUMMARY_LINES]) + "\n"
+            )
+        logger.info(f"Wrote the profile of the crawl to {self.output}")
@@ -56,21 +56,25 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    "src.middlewares.BelgianJournalDownloaderMiddleware": 543,
-# }
+# the archive middleware sits right before the downloader (after the HTTP cache), see HTTP_ARCHIVE_MODE
+DOWNLOADER_MIDDLEWARES = {
+    "src.middlewares.BelgianJournalDownloaderMiddleware": 950,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-# }
+# the extensions of this project are only enabled by their settings (see METRICS and PROFILER)
+EXTENSIONS = {
+    "src.metrics.MetricsExtension": 500,
+    "src.profiling.ProfilingExtension": 510,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     "src.pipelines.LegalEntityFilePipeline": 100,
     "src.pipelines.LegalEntityPipeline": 200,
+    "src.pipelines.DatasetExportPipeline": 300,
 }
 
 # Enable and configure the AutoThrottle extension (disabled by default)
@@ -91,11 +95,17 @@ RETRY_TIMES = 5
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED = True
-# HTTPCACHE_EXPIRATION_SECS = 0
-# HTTPCACHE_DIR = "httpcache"
-# HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# PDFs are cached forever, listings of dates older than HTTPCACHE_SETTLED_DAYS for HTTPCACHE_SETTLED_TTL seconds
+# (0 = forever) and listings of recent dates and VAT searches are revalidated after HTTPCACHE_RECENT_TTL seconds.
+# Responses are stored compressed in HTTPCACHE_DIR, least recently used responses are evicted above HTTPCACHE_MAX_BYTES.
+HTTPCACHE_ENABLED = False
+HTTPCACHE_DIR = "httpcache"  # relative to the .scrapy folder of the project
+HTTPCACHE_POLICY = "src.httpcache.BelgianJournalCachePolicy"
+HTTPCACHE_STORAGE = "src.httpcache.CompressedSqliteCacheStorage"
+HTTPCACHE_SETTLED_DAYS = 7
+HTTPCACHE_SETTLED_TTL = 180 * 24 * 3600
+HTTPCACHE_RECENT_TTL = 0
+HTTPCACHE_MAX_BYTES = 5 * 1024**3
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -106,14 +116,175 @@ ROOT_DIR = Path(__file__).parents[1]
 LOG_LEVEL = "INFO"
 # LOG_FILE = str(ROOT_DIR / "scrapy.log")
 FILES_STORE = str(ROOT_DIR / "tmp_pdfs")
+# Downloaded PDFs are passed in memory to the text extraction and are not written to disk. Set PERSIST_PDFS to True
+# to also keep them in FILES_STORE (then they are not downloaded again in a next run when the publication is not yet
+# on BLOB).
+PERSIST_PDFS = False
 
 # Perform OCR on scans (cost of €1.5 per 1000 pages), if set to False drops the scan PDFs.
 # for pricing see https://azure.microsoft.com/en-us/pricing/details/ai-document-intelligence/
 OCR = True
+# Number of concurrent OCR jobs, lowered when Document Intelligence throttles (HTTP 429) and raised while the jobs
+# succeed (never above OCR_MAX_CONCURRENCY). OCR_POLLING_INTERVAL is the number of seconds between status polls.
+OCR_CONCURRENCY = 4
+OCR_MAX_CONCURRENCY = 32
+OCR_POLLING_INTERVAL = 5.0
+# Cache of OCR results keyed by PDF content and OCR model, kept on local disk (least recently used results are evicted
+# above OCR_CACHE_MAX_BYTES) and, when OCR_CACHE_BLOB_PREFIX is set (e.g. "_ocr_cache/"), in the BLOB container such
+# that workers without the local cache (container instances) reuse the results. Set OCR_CACHE_DIR to None to disable
+# the cache.
+OCR_CACHE_DIR = str(ROOT_DIR / "ocr_cache")
+OCR_CACHE_MAX_BYTES = 2 * 1024**3
+OCR_CACHE_BLOB_PREFIX = None
+# Submit only the region within the dotted lines of every page (widened by OCR_CROP_MARGIN, relative to the page size)
+# to OCR, the lines outside of it are dropped anyway. The pages keep their scanned images whole unless OCR_CROP_DPI is
+# set, so the crop is not a payload saving. With OCR_CROP_DPI the region is rasterized at that resolution (in grayscale
+# with OCR_CROP_GRAYSCALE), which only makes the payload smaller for large color or high-resolution scans.
+OCR_CROP = False
+OCR_CROP_DPI = None
+OCR_CROP_GRAYSCALE = True
+OCR_CROP_MARGIN = 0.02
+
+# Extract the text of digital PDFs in a pool instead of inside the event loop (None, "process" or "thread")
+# pymupdf is not thread safe, "thread" uses a single thread (EXTRACT_TEXT_WORKERS only sizes the process pool), use
+# "process" to extract several PDFs at once on multi-core containers
+EXTRACT_TEXT_EXECUTOR = None
+EXTRACT_TEXT_WORKERS = 2
+# Fast text extraction: scans are detected from their first page (no text within the dotted lines) and sent to OCR
+# right away, digital PDFs are extracted in a single pass per page (same text). With a pool, the scan detection runs in
+# the pool too. With a process pool, PDFs with more than EXTRACT_TEXT_SPLIT_PAGES pages are extracted in parts of that
+# many pages at once (None disables splitting), a thread pool extracts every PDF in one part.
+EXTRACT_TEXT_FAST = False
+EXTRACT_TEXT_SPLIT_PAGES = 20
+
+# Encoding of the uploaded publication JSON BLOBs: "gzip", "zstd" (requires zstandard) or None (uncompressed), set as
+# their Content-Encoding. Read them with `src.codec.read_payload` (also reads uncompressed BLOBs of earlier runs).
+# PUBLICATION_COMPRESSION_LEVEL defaults to 6 (gzip) or 3 (zstd).
+PUBLICATION_ENCODING = None
+PUBLICATION_COMPRESSION_LEVEL = None
+
+# Publications are uploaded in the background, at most UPLOAD_CONCURRENCY uploads are in flight at once.
+# A failed upload is retried UPLOAD_RETRIES times, waiting UPLOAD_RETRY_BACKOFF seconds (doubling every retry).
+UPLOAD_CONCURRENCY = 16
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_BACKOFF = 1.0
+
+# Besides a JSON BLOB per publication, collect the publications in a dataset of compressed shards partitioned by month
+# of publication: DATASET_FORMAT "parquet" (requires pyarrow) or "jsonl", DATASET_COMPRESSION "zstd" (JSONL requires
+# zstandard), "gzip" or None. A shard holds at most DATASET_MAX_ROWS publications or DATASET_MAX_BYTES of text, the
+# largest buffered shard is written when all buffered publications reach DATASET_MAX_BUFFERED_BYTES. Every run writes
+# its shards and a manifest below DATASET_PREFIX in the BLOB container or in the local folder DATASET_DIR.
+# DATASET_RUN_ID identifies the shards of the run (defaults to the start time). None disables the dataset.
+DATASET_FORMAT = None
+DATASET_COMPRESSION = "zstd"
+DATASET_PREFIX = "_dataset/"
+DATASET_DIR = None
+DATASET_MAX_ROWS = 50000
+DATASET_MAX_BYTES = 64 * 1024**2
+DATASET_MAX_BUFFERED_BYTES = 256 * 1024**2
+DATASET_RUN_ID = None
+
+# Record the responses of a crawl (listing pages and PDFs) in HTTP_ARCHIVE_DIR with HTTP_ARCHIVE_MODE = "record" and
+# serve them from there without hitting the website with "replay" (None disables the archive). In replay mode every
+# response is delayed by HTTP_ARCHIVE_LATENCY seconds, requests that were not recorded are ignored.
+HTTP_ARCHIVE_MODE = None
+HTTP_ARCHIVE_DIR = str(ROOT_DIR / "http_archive")
+HTTP_ARCHIVE_LATENCY = 0.0
+
+# Record latency histograms per stage (listing/PDF downloads, text extraction, OCR, uploads), queue depths, bytes and
+# digital/scan counts in `spider.metrics`. They are copied to the Scrapy stats (`metrics/...`) every METRICS_INTERVAL
+# seconds, served in the Prometheus format on http://{METRICS_HOST}:{METRICS_PORT}/metrics (None: no endpoint) and
+# written to the JSON file METRICS_FILE when the spider closes (None: no file). The endpoint has no authentication, it
+# only listens on the loopback interface unless METRICS_HOST is set (e.g. "0.0.0.0" behind a firewall).
+METRICS = False
+METRICS_INTERVAL = 10.0
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+METRICS_FILE = None
+
+# Profile a crawl with PROFILER = "cprofile" (deterministic, the event loop thread, `profile.pstats`) or "sampler"
+# (stacks of all threads every PROFILE_SAMPLE_INTERVAL seconds, collapsed stacks for flame graphs), both summarized in
+# `profile.txt`. The calls of the functions in PROFILE_SECTIONS ({tag: "module:qualified name"}, None:
+# parse_publications, extract_text_digital, extract_text_scan and the uploads) are timed per tag and their samples are
+# prefixed with the tag. With PROFILE_TRACEMALLOC_INTERVAL a tracemalloc snapshot (of PROFILE_TRACEMALLOC_FRAMES frames)
+# is taken every that many seconds. The results are written to PROFILE_DIR/{spider}-{start time}-{pid}/ when the
+# spider closes.
+PROFILER = None
+PROFILE_DIR = str(ROOT_DIR / "profiles")
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_SECTIONS = None
+PROFILE_TRACEMALLOC_INTERVAL = None
+PROFILE_TRACEMALLOC_FRAMES = 10
 
 # useful for debugging, should be False in PROD
 CLEANUP_FILESTORE = False  # deletes tmp_pdfs ==> forces redownload of a pdf when not available on BLOB
 CLEANUP_BLOBSTORE = False  # deletes Azure Container content ==> forces Scrapy Item in next run
+# CLEANUP_BLOBSTORE deletes batches of CLEANUP_BATCH_SIZE (at most 256) BLOBs with CLEANUP_CONCURRENCY batch requests
+# at once (a batch size of 1 deletes the BLOBs one by one). Restrict the cleanup to BLOB name prefixes with
+# CLEANUP_PREFIXES (e.g. ["0123456789/"] for a VAT number) and/or to publication dates with CLEANUP_DATE_PREFIX (e.g.
+# "2024/05"). Only the publications and the publication index are deleted, the OCR cache, checkpoints, shards of the
+# coordinator, dataset and run summary are kept.
+CLEANUP_BATCH_SIZE = 256
+CLEANUP_CONCURRENCY = 8
+CLEANUP_PREFIXES = []
+CLEANUP_DATE_PREFIX = None
+
+# index of already scraped publications, loaded once per run instead of listing the BLOBs per publication (opt-in)
+# the index is stored as a BLOB in the container and built from a full listing the first time it is enabled
+PUBLICATION_INDEX = False
+PUBLICATION_INDEX_BLOB = "_index/publications.bin"
+# summary BLOB with the total number of companies and publications, updated at the end of each run (opt-in, e.g.
+# "_index/summary.json"). The totals are only exact with PUBLICATION_INDEX.
+RUN_SUMMARY_BLOB = None
+
+# yield the publications of a listing page as soon as it is parsed instead of after the last page
+STREAM_PUBLICATIONS = True
+# request all listing pages of a date search at once based on the number of results on the first page. Only applies to
+# the date spider with STREAM_PUBLICATIONS: VAT searches stop at the first publication before PUB_DATE_THRESHOLD, so
+# their later pages are usually not needed, and without streaming the publications of the pages are collected one page
+# after the other. Otherwise (or when the number of results cannot be parsed) the pages are requested one by one.
+LISTING_FANOUT = True
+
+# the date spider searches day by day, with DATE_WINDOW_PLANNER (opt-in) it searches windows of
+# DATE_WINDOW_INITIAL_DAYS days instead and splits the windows with more than DATE_WINDOW_MAX_RESULTS results
+DATE_WINDOW_PLANNER = False
+DATE_WINDOW_INITIAL_DAYS = 14
+DATE_WINDOW_MAX_RESULTS = 2000
+
+# progress of the date spider (completed windows, parsed pages, pending publications) is saved in the BLOB container
+# every CHECKPOINT_INTERVAL seconds, a crawl of the same date range resumes from it. Disabled by default (None), set it
+# for long date ranges, e.g. "_checkpoints/{spider}/{start_date}_{end_date}.json"
+CHECKPOINT_BLOB = None
+CHECKPOINT_INTERVAL = 5.0
+
+# share a crawl over several workers: the date windows (date spider) or VAT numbers (VAT spider) are shards that the
+# workers lease ("blob": leases on BLOBs below COORDINATOR_BLOB_PREFIX, "sqlite": COORDINATOR_SQLITE_PATH for workers
+# on one machine, None: a single worker crawls everything). Leases are renewed every COORDINATOR_HEARTBEAT seconds and
+# reclaimed by other workers after COORDINATOR_LEASE_SECONDS (blob leases last 15 to 60 seconds). A worker crawls
+# COORDINATOR_MAX_SHARDS shards at once, a shard is given up after COORDINATOR_MAX_ATTEMPTS failed attempts. When no
+# shard is free (or other workers still crawl theirs) the pending shards are listed again after
+# COORDINATOR_POLL_INTERVAL s. The shards are registered in a thread once the spider opened, in batches of
+# COORDINATOR_REGISTER_BATCH_SIZE shards that are leased while the next batches are registered.
+# The progress within a shard is not checkpointed, CHECKPOINT_BLOB is ignored with a coordinator.
+COORDINATOR = None
+COORDINATOR_WORKER_ID = None  # defaults to {hostname}-{pid}
+COORDINATOR_BLOB_PREFIX = "_shards/"
+COORDINATOR_SQLITE_PATH = str(ROOT_DIR / "coordinator.sqlite")
+COORDINATOR_LEASE_SECONDS = 60
+COORDINATOR_HEARTBEAT = 15.0
+COORDINATOR_MAX_SHARDS = 2
+COORDINATOR_MAX_ATTEMPTS = 3
+COORDINATOR_POLL_INTERVAL = 30.0
+COORDINATOR_REGISTER_BATCH_SIZE = 1000
+
+# the VAT spider reads the VAT numbers from VAT_INPUT_FILE instead of LEGAL_ENTITIES (also `-a vat_file=...`): a text
+# file with one VAT number per line or a CSV/Parquet file with a `vat` column and optional `start_date`, `end_date` and
+# `last_publication_date` columns (Parquet requires pyarrow). The file is read in chunks of VAT_INPUT_CHUNK_SIZE rows.
+# VAT_INCREMENTAL (opt-in) only lists the publications since the last scraped publication of a company: older
+# publications that were dropped or failed in an earlier run are then never scraped.
+VAT_INPUT_FILE = None
+VAT_INPUT_CHUNK_SIZE = 10000
+VAT_INCREMENTAL = False
 
 # PUBLICATION_DATE_THRESHOLD (do not consider publications before this date)
 PUB_DATE_THRESHOLD = date(2010, 1, 1)
@@ -4,23 +4,36 @@ https://www.ejustice.just.fgov.be/cgi_tsv/rech.pl
 """
 
 import logging
+import math
 import os
-import re
 import sys
-from datetime import date, datetime, timedelta
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+from itertools import islice
 from pathlib import Path
-from typing import Generator, Iterable, Literal, Optional, Tuple
+from typing import Generator, Iterable, Iterator, Literal, Optional
 
 import scrapy
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.http import Request, Response
-from scrapy.selector.unified import SelectorList
 from scrapy.utils.project import get_project_settings
-
-from src.items import LegalEntityItem
+from twisted.internet import defer, task, threads
+
+from src.checkpoint import CrawlCheckpoint
+from src.coordinator import BlobCoordinatorBackend, SqliteCoordinatorBackend, WorkCoordinator
+from src.index import PublicationIndex
+from src.items import LegalEntityItem, PublicationRecord
+from src.listing import parse_listing, parse_num_results, parse_page_number
+from src.metrics import NULL_METRICS, Metrics
+from src.planner import DateWindow, DateWindowPlanner
+from src.stats import RunStatistics
+from src.storage import AzureBlobStore
+from src.vat_input import read_legal_entities
 
 # Azure info is used a lot (per putting a BLOB once)
 azurelogger = logging.getLogger("azure")
@@ -37,9 +50,14 @@ LEGAL_ENTITIES = [
 ]
 
 
-class BaseLegalEntitySpider(scrapy.Spider):
+class BaseLegalEntitySpider(scrapy.Spider, ABC):
     base_url = "https://www.ejustice.just.fgov.be"
     type: Optional[Literal["vat", "date"]] = None
+    planner: Optional[DateWindowPlanner] = None
+    checkpoint: Optional[CrawlCheckpoint] = None
+    coordinator: Optional[WorkCoordinator] = None
+    coordinator_finished = False  # no shards are held and none are pending, the spider can close
+    metrics: Metrics = NULL_METRICS
 
     def __init__(self, *args, **kwargs):
         # initialize parent class
@@ -67,80 +85,320 @@ class BaseLegalEntitySpider(scrapy.Spider):
         # initialize Azure Blob storage
         self.blob_service_client = BlobServiceClient(self.azure_storage_account_url, self.azure_credential)
         self.container_client = self.blob_service_client.get_container_client(self.azure_container_name)
-        blobs = list(self.container_client.list_blob_names())
-        self.vats = {str(Path(blob).parents[-2]) for blob in blobs}
-        self.num_pubs = len(blobs)
+        self.blob_store = AzureBlobStore(self.container_client)
+
+        # index of already scraped publications, avoids listing the container per publication
+        self.publication_index: Optional[PublicationIndex] = None
+        if SETTINGS["PUBLICATION_INDEX"]:
+            self.publication_index = PublicationIndex.load(self.blob_store, SETTINGS["PUBLICATION_INDEX_BLOB"])
+
+        # counts the new companies and publications while they are uploaded by the pipeline
+        self.run_statistics = RunStatistics(self.publication_index)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.item_dropped, signal=signals.item_dropped)
+        if crawler.settings.getbool("METRICS"):
+            spider.metrics = Metrics()
+        if crawler.settings["COORDINATOR"]:
+            spider.setup_coordinator()
+        return spider
+
+    def setup_coordinator(self) -> None:
+        """shares the shards of the crawl with the other workers, the shards are leased when the spider is idle"""
+        if not self.settings["STREAM_PUBLICATIONS"]:
+            raise ValueError("COORDINATOR needs STREAM_PUBLICATIONS, shards are completed page by page.")
+
+        namespace = self.coordinator_namespace()
+        max_attempts = self.settings.getint("COORDINATOR_MAX_ATTEMPTS", 3)
+        batch_size = self.settings.getint("COORDINATOR_REGISTER_BATCH_SIZE", 1000)
+        if self.settings["COORDINATOR"] == "blob":
+            prefix = f"{self.settings['COORDINATOR_BLOB_PREFIX']}{namespace}/"
+            backend = BlobCoordinatorBackend(self.container_client, prefix, max_attempts, batch_size)
+        elif self.settings["COORDINATOR"] == "sqlite":
+            path = self.settings["COORDINATOR_SQLITE_PATH"]
+            backend = SqliteCoordinatorBackend(path, namespace, max_attempts, batch_size)
+        else:
+            raise ValueError(f"Unknown COORDINATOR {self.settings['COORDINATOR']!r}, use 'blob' or 'sqlite'.")
+
+        self.coordinator = WorkCoordinator(
+            backend,
+            owner=self.settings["COORDINATOR_WORKER_ID"],
+            lease_seconds=self.settings.getfloat("COORDINATOR_LEASE_SECONDS", 60.0),
+            max_shards=self.settings.getint("COORDINATOR_MAX_SHARDS", 2),
+            poll_interval=self.settings.getfloat("COORDINATOR_POLL_INTERVAL", 30.0),
+        )
+        self._coordinating: Optional[defer.Deferred] = None
+        self._registering: Optional[defer.Deferred] = None
+        # only tracks (in memory) when a shard is completed: all its pages parsed and all its publications uploaded
+        self.checkpoint = CrawlCheckpoint(None, None)
+        self.heartbeat = task.LoopingCall(self.coordinate)
+        self.crawler.signals.connect(self.start_heartbeat, signal=signals.spider_opened)
+        self.crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+
+    def coordinator_namespace(self) -> str:
+        """identifies the crawl of which the workers share the shards"""
+        return self.name
+
+    @abstractmethod
+    def shards(self) -> Iterable[str]:
+        """:return: the search keys (see search_key) that are shared by the workers"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def shard_requests(self, shard: str) -> list[Request]:
+        """:return: the requests of the first listing page(s) of the shard"""
+        raise NotImplementedError
+
+    def start_heartbeat(self, spider) -> None:
+        """registers the shards in a thread (blob uploads in batches) and starts the heartbeat, the shards of the
+        first batches are leased while the next ones are registered
+        """
+        self._registering = threads.deferToThread(self.coordinator.register, self.shards())
+        self._registering.addErrback(
+            lambda failure: self.logger.error(f"Registering the shards failed: {failure.value!r}")
+        )
+        self.heartbeat.start(self.settings.getfloat("COORDINATOR_HEARTBEAT", 15.0), now=False)
+
+    def coordinate(self, idle: bool = False) -> defer.Deferred:
+        """renews the leases of the held shards, completes the finished shards and leases new shards up to
+        COORDINATOR_MAX_SHARDS. The calls of the backend block (blob listings and leases), they are made in a thread
+        such that the crawl goes on in the meantime. One coordination runs at a time.
+
+        :param idle: no requests are in flight, a held shard that is not completed by now and has no publications
+            left to upload failed (e.g. one of its listing pages could not be downloaded)
+        :return: Deferred that fires once the requests of the newly leased shards are scheduled
+        """
+        if self._coordinating is not None:
+            return defer.succeed(None)
+        held = sorted(self.coordinator.held)
+        completed = [shard for shard in held if self.checkpoint.is_completed(shard)]
+        failed = [shard for shard in held if idle and shard not in completed and not self.checkpoint.has_pending(shard)]
+        self._coordinating = threads.deferToThread(self._coordinate_backend, completed, failed, idle)
+        self._coordinating.addCallback(self._request_shards)
+        self._coordinating.addErrback(lambda failure: self.logger.error(f"Coordination failed: {failure.value!r}"))
+        self._coordinating.addBoth(self._coordinated)
+        return self._coordinating
+
+    def _coordinate_backend(self, completed: list[str], failed: list[str], idle: bool) -> tuple:
+        """runs in a thread, see coordinate"""
+        coordinator = self.coordinator
+        coordinator.heartbeat()
+        for shard in completed:
+            coordinator.complete(shard)
+        for shard in failed:
+            coordinator.fail(shard)
+        acquired = []
+        while (shard := coordinator.acquire()) is not None:
+            acquired.append(shard)
+        finished = idle and not acquired and not coordinator.held and not coordinator.has_unfinished()
+        return completed, failed, acquired, finished
+
+    def _request_shards(self, result: tuple) -> None:
+        completed, failed, acquired, finished = result
+        stats = self.crawler.stats
+        for key, shards in (("completed", completed), ("failed", failed), ("leased", acquired)):
+            if shards:
+                stats.inc_value(f"coordinator/{key}", len(shards))
+        if self.coordinator.closed:
+            return  # the spider closed in the meantime, the shards were released
+        for shard in acquired:
+            for request in self.shard_requests(shard):
+                self.crawler.engine.crawl(request)
+        self.coordinator_finished = finished
+
+    def _coordinated(self, result) -> None:
+        self._coordinating = None
+
+    def spider_idle(self, spider) -> None:
+        """keeps the spider open while shards are pending, the shards of other workers are reclaimed when their
+        leases expire. The spider closes on an idle signal after a coordination found no shards left.
+        """
+        self.coordinate(idle=True)
+        if not self.coordinator_finished:
+            raise DontCloseSpider
+
+    def listing_request(self, meta: dict) -> Request:
+        # a shard can be retried by the same worker, the duplicate filter would drop the requests of the retry
+        return scrapy.Request(
+            self.format_url(meta), callback=self.parse, meta=meta, dont_filter=self.coordinator is not None
+        )
 
     def parse(self, response: Response) -> Optional[Iterable[Request] | Generator[scrapy.Item, None, None]]:
         """
         Checks if any publications are found for a given company. If there are more than 100 results, then
         recursively calls itself to get all publication blocks.
 
+        With `STREAM_PUBLICATIONS` the publications of each page are yielded as soon as the page is parsed (after
+        requesting the next page), otherwise the publications of all pages are collected before yielding.
+
         :param response: scrapy.Response
         :yield: a scrapy Request per publication category OR Item
         :return: None when no div elements are found in this act
         """
         meta = response.meta
+        self.metrics.observe("listing_download", meta.get("download_latency"))
+        self.metrics.inc("listing_pages")
+        self.metrics.inc("listing_bytes", len(response.body))
         any_publications = "Geen tekst komt overeen met uw zoekopdracht" not in response.text
 
         if not any_publications and "page" not in meta:
             self.logger.info(f"No publications found for {response.url}")
+            yield from self.checkpointed(meta, [], is_last=True)
             return None
 
-        # publication element is the `block` per publication
-        publication_elements = response.xpath("/html/body/div/div[4]/div/main/div[2]/div/div[*]")
-
-        # process elements on page by collecting publication elements
-        if publication_elements:
-            meta["publication_elements"] = response.meta.get("publication_elements", []) + publication_elements
+        # windows of a date search with too many results are split before their pages are requested
+        if self.planner is not None and meta.get("page", 1) == 1 and not meta.get("num_pages"):
+            window_requests = self.split_window(response)
+            if window_requests:
+                yield from window_requests
+                return None
 
+        # publication element is the `block` per publication, parsed into lightweight records in a single pass
+        with self.metrics.timer("listing_parse"):
+            records = parse_listing(response.selector.root, self.base_url)
         # max number of publication elements on a page = 100, in this case next page needs to be crawled
-        if len(publication_elements) == 100:
+        has_next_page = len(records) == 100
+
+        if self.settings["STREAM_PUBLICATIONS"]:
+            # publications are sorted from new to old, pages after the threshold date can be skipped
+            pub_date_threshold = meta["start_date"] or self.settings["PUB_DATE_THRESHOLD"]
+            is_last = not has_next_page or any(self.before_threshold(record, pub_date_threshold) for record in records)
+            if not is_last:
+                yield from self.next_page_requests(response)
+
+            yield from self.checkpointed(meta, self.parse_publications(meta, records) if records else [], is_last)
+            if not records and meta.get("page", 1) == 1:
+                self.logger.info(f"No publications found for {response.url}")
+            return None
+
+        # process elements on page by collecting publication records
+        if records:
+            meta["publications"] = response.meta.get("publications", []) + records
+
+        if has_next_page:
             meta["page"] = response.meta.get("page", 1) + 1
-            url = self.format_url(meta)
             self.logger.debug(f"100 publications on page {response.url}, continueing on next page {meta['page']}")
-            yield scrapy.Request(url, callback=self.parse, meta=meta)
+            yield self.listing_request(meta)
         # at least one publication element was found, parse the publications
-        elif meta.get("publication_elements"):
-            yield from self.parse_publications(meta)
+        elif meta.get("publications"):
+            yield from self.parse_publications(meta, meta["publications"])
         else:
             self.logger.info(f"No publications found for {response.url}")
             return None
 
-    def parse_publications(self, meta: dict) -> Iterable[scrapy.Item]:
+    def next_page_requests(self, response: Response) -> Iterable[Request]:
+        """requests the next listing page(s) when streaming publications
+
+        Date searches need every page, so with `LISTING_FANOUT` all remaining pages are requested at once based on
+        the number of results on the first page. VAT searches stop at the publication date threshold, their pages
+        (like those of a date search without `LISTING_FANOUT` or of which the number of results cannot be parsed) are
+        probed one after the other. Without `STREAM_PUBLICATIONS` the pages are requested by `parse` one by one.
+
+        :param response: scrapy.Response of a listing page with 100 publications
+        :yield: scrapy Request per listing page
+        """
+        meta = response.meta
+        page = meta.get("page", 1)
+        num_pages = meta.get("num_pages")
+        if num_pages and page < num_pages:
+            return  # the remaining pages were already requested by the first page
+
+        if not num_pages and page == 1 and self.type == "date" and self.settings["LISTING_FANOUT"]:
+            num_pages = self.parse_num_pages(response)
+            if num_pages and num_pages > page:
+                self.logger.debug(f"{num_pages} pages found for {response.url}, requesting all pages")
+                for next_page in range(page + 1, num_pages + 1):
+                    if self.checkpoint is not None and self.checkpoint.is_page_done(self.search_key(meta), next_page):
+                        continue  # parsed and uploaded before the crawl was resumed
+                    yield self.listing_request({**meta, "page": next_page, "num_pages": num_pages})
+                return
+
+        # sequential probing, also when the last fanned out page turns out to be full
+        next_meta = {**meta, "page": page + 1}
+        self.logger.debug(f"100 publications on page {response.url}, continueing on page {next_meta['page']}")
+        yield self.listing_request(next_meta)
+
+    def split_window(self, response: Response) -> list[Request]:
+        """splits the date window of the search when it has too many results (see DateWindowPlanner)
+
+        :param response: scrapy.Response of the first listing page of the window
+        :return: a scrapy Request per part of the window or an empty list when the window is not split
+        """
+        meta = response.meta
+        window = DateWindow(meta["start_date"], meta["end_date"])
+        num_results = self.parse_num_results(response)
+        parts = self.planner.split(window, num_results) if num_results is not None else [window]
+        if len(parts) == 1:
+            return []
+
+        self.logger.debug(f"{num_results} results from {window.start} to {window.end}, splitting in {len(parts)}")
+        parts_meta = [{**meta, "start_date": part.start, "end_date": part.end, "page": 1} for part in parts]
+        if self.checkpoint is not None:
+            self.checkpoint.split(self.search_key(meta), [self.search_key(part_meta) for part_meta in parts_meta])
+
+        requests = []
+        for part_meta in parts_meta:
+            if self.checkpoint is not None and self.checkpoint.is_completed(self.search_key(part_meta)):
+                continue
+            requests.append(self.listing_request(part_meta))
+        return requests
+
+    def parse_num_results(self, response: Response) -> Optional[int]:
+        """parses the number of results of the search from the first listing page (e.g. `Lijst (109)`)
+
+        :param response: scrapy.Response of the first listing page
+        :return: number of results or None when it could not be parsed
+        """
+        return parse_num_results(response.text)
+
+    def parse_num_pages(self, response: Response) -> Optional[int]:
+        """parses the number of listing pages from the number of results (e.g. `Lijst (109)`) or from the link
+        to the last page
+
+        :param response: scrapy.Response of the first listing page
+        :return: number of pages or None when it could not be parsed
+        """
+        num_results = self.parse_num_results(response)
+        if num_results is not None:
+            return max(1, math.ceil(num_results / 100))
+
+        last_page = parse_page_number(response.css("a.pagination-last::attr(href)").get())
+        if last_page:
+            return last_page
+
+        self.logger.debug(f"Could not parse the number of pages from {response.url}")
+        return None
+
+    @staticmethod
+    def before_threshold(record: PublicationRecord, pub_date_threshold: date) -> bool:
+        return bool(record.publication_date and record.publication_date < pub_date_threshold)
+
+    def parse_publications(self, meta: dict, records: list[PublicationRecord]) -> Iterable[scrapy.Item]:
         """Creates a scrapy ItemLoader such that the PDFs get downloaded
         This method gets called multiple times, once per act that contains pdfs
 
-        :param publication_elements: all publication elements found for the legal entity for the given filters
         :param meta: response.meta from previous request
+        :param records: publication records found for the legal entity for the given filters
         """
         # scraping based on VAT number, can create a set of already scraped publications for this VAT
-        if meta.get("vat"):
+        scraped = set()
+        if meta.get("vat") and self.publication_index is None:
             scraped = {Path(item).stem for item in self.container_client.list_blob_names(name_starts_with=meta["vat"])}
 
         pub_date_threshold = meta["start_date"] or self.settings["PUB_DATE_THRESHOLD"]
 
-        publication_elements: SelectorList = meta["publication_elements"]
-        publications = []
-        for i, publication_element in enumerate(publication_elements):
-            # fetch metadata from the publication element
-            urls = publication_element.xpath("./div//a/@href").getall()
-            pdf_relative_url, pdf_absolute_url, pubid = self.parse_publication_url(urls)
-            company_name = publication_element.xpath("./div/p/font/text()").get()
-            company_juridical_form = publication_element.xpath("./div/p/text()[2]").get(default="").strip()
-            pub_metadata = [i.strip() for i in publication_element.xpath("./div/a[1]/text()").getall()]
-
-            address, vat, act_description, pub_date_and_number = self.parse_metadata(pub_metadata)
-            vat = vat.replace(".", "").strip() if vat else None
-            city, zipcode, street = self.extract_address(address)
-            publication_date, publication_number = self.extract_publication_date_and_number(pub_date_and_number)
+        for i, record in enumerate(records):
+            pdf_relative_url, pdf_absolute_url, pubid = record.pdf_relative_url, record.pdf_absolute_url, record.pubid
+            vat, publication_date, publication_number = record.vat, record.publication_date, record.publication_number
 
             # Date scrape doesnt have one VAT number, so we check per publication if it's already scraped
-            if not meta.get("vat") and vat:
+            if not meta.get("vat") and vat and self.publication_index is None:
                 scraped = {Path(i).stem for i in self.container_client.list_blob_names(name_starts_with=vat)}
 
-            if publication_date and publication_date < pub_date_threshold:
-                remaining = len(publication_elements) - (i + 1)
+            if self.before_threshold(record, pub_date_threshold):
+                remaining = len(records) - (i + 1)
                 self.logger.info(f"Threshold date reached {pub_date_threshold}, skipping {remaining} pubs...")
                 break
 
@@ -153,25 +411,24 @@ class BaseLegalEntitySpider(scrapy.Spider):
                 self.logger.debug(f"Could not extract url from publication: {url}")
                 continue
 
-            if publication_number in scraped:
+            if self.is_scraped(meta.get("vat", vat), publication_number, scraped):
                 self.logger.info(f"Already scraped {pdf_absolute_url}, skipping download...")
                 continue
 
             publication_meta = {
                 "vat": meta.get("vat", vat),
                 "pubid": pubid,  # last two digits of publication date year + publication number
-                "act_description": act_description,
-                "company_name": company_name,
-                "company_juridical_form": company_juridical_form,
-                "address": address,
-                "street": street,
-                "zipcode": zipcode,
-                "city": city,
+                "act_description": record.act_description,
+                "company_name": record.company_name,
+                "company_juridical_form": record.company_juridical_form,
+                "address": record.address,
+                "street": record.street,
+                "zipcode": record.zipcode,
+                "city": record.city,
                 "publication_date": str(publication_date),
                 "publication_number": publication_number,
                 "publication_link": pdf_absolute_url,
             }
-            publications.append(publication_meta)
 
             self.logger.info(f"Creating Scrapy Item to download {pdf_absolute_url}")
             item = LegalEntityItem(
@@ -184,6 +441,48 @@ class BaseLegalEntitySpider(scrapy.Spider):
             )
             yield item
 
+    def checkpointed(self, meta: dict, items: Iterable[scrapy.Item], is_last: bool) -> Iterable[scrapy.Item]:
+        """registers the publications of a listing page in the checkpoint while they are yielded
+
+        :param meta: response.meta of the listing page
+        :param items: items of the publications on the page
+        :param is_last: no further pages of the search are needed
+        """
+        if self.checkpoint is None:
+            yield from items
+            return
+
+        search, page = self.search_key(meta), meta.get("page", 1)
+        for item in items:
+            self.checkpoint.add_pending(search, page, item["vat"], item["publication_number"])
+            yield item
+        self.checkpoint.page_parsed(search, page, is_last)
+
+    def search_key(self, meta: dict) -> str:
+        """identifies the search (date window or VAT number) of a listing page in the checkpoint"""
+        if self.type == "date":
+            return f"{meta['start_date'].isoformat()}/{meta['end_date'].isoformat()}"
+        return meta.get("shard") or str(meta["vat"])
+
+    def item_dropped(self, item, response, exception, spider) -> None:
+        """marks a dropped publication as done in the checkpoint, such that resuming the crawl does not retry it.
+        It is not in the publication index, so a new crawl (without the checkpoint) does retry it.
+        """
+        if self.checkpoint is not None and isinstance(item, LegalEntityItem):
+            self.checkpoint.publication_done(item["vat"], item["publication_number"])
+
+    def is_scraped(self, vat: Optional[str], publication_number: Optional[str], scraped: set[str]) -> bool:
+        """checks if the publication is already saved in the blob storage
+
+        :param vat: vat number under which the publication is saved
+        :param publication_number: publication number
+        :param scraped: publication numbers listed from the blob storage, only used without publication index
+        :return: bool
+        """
+        if self.publication_index is None:
+            return publication_number in scraped
+        return (vat, publication_number) in self.publication_index
+
     def format_url(self, meta: dict) -> str:
         """creates the to-scrape url based on the meta
 
@@ -204,141 +503,148 @@ class BaseLegalEntitySpider(scrapy.Spider):
 
         return url
 
-    def parse_publication_url(self, urls: list[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
-        """finds the publication url from all the urls in the publication div
-
-        :param urls: list of urls
-        :return: pdf_relative_url, pdf_absolute_url, pubid
-        """
-        urls = [url for url in urls if url.endswith(".pdf")]
-        if len(urls) == 1:
-            pdf_relative_url = urls[0]
-            pdf_absolute_url = self.base_url + pdf_relative_url
-            pubid = Path(pdf_relative_url).stem
-            return pdf_relative_url, pdf_absolute_url, pubid
-
-        if len(urls) > 1:
-            self.logger.error(f"Multiple urls found in the publication div, could not extract pdfurl from {urls}")
-
-        return None, None, None
-
-    def parse_metadata(
-        self, pub_metadata: list[str]
-    ) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
-        """parses the metadata section in the publication element
-
-        :param pub_metadata: metadata section in publication element
-        :return: address, vat, act_description and pub_date_and_number
-
-        example standard format:
-        https://www.ejustice.just.fgov.be/cgi_tsv/rech_res.pl?btw=0736812790&pdd=2020-03-16&pdf=2020-03-16
-
-        example no address and act format:
-        https://www.ejustice.just.fgov.be/cgi_tsv/rech_res.pl?btw=1009987358&pdd=2024-06-05&pdf=2024-06-05
-        (can be outdated - new publications / new companies are sometimes missing it but gets corrected)
-        """
-        if len(pub_metadata) == 4:
-            self.logger.debug("Metadata section of publication is of length 4.")
-            address, vat, act_description, pub_date_and_number = pub_metadata
-        elif len(pub_metadata) == 6:
-            self.logger.debug("Metadata section of publication is of length 6.")
-            address, vat, act_description, pub_date_and_number, _, _ = pub_metadata
-        else:
-            self.logger.warning(f"Unimplemented metadata format with length {len(pub_metadata)}: {pub_metadata}")
-            address = vat = act_description = pub_date_and_number = None
-
-        return address, vat, act_description, pub_date_and_number
-
-    def extract_address(self, address: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
-        """extracts the city, zipcode and street from the address metadata section
-
-        :param address: address metadata
-        :return: city, zipcode and street
-
-        standard address structure:
-        RUE JACQUES JORDAENS 32A, BTE6 1000 BRUXELLES
-        """
-        if not address:
-            self.logger.debug("Address was blank or empty, could not extract city, zipcode, street")
-            return None, None, None
-
-        address_matched = re.match(r"^(?P<street>.*)\s(?P<zipcode>\d{4})\s(?P<city>.*)$", address)
-        if address_matched:
-            street = address_matched.group("street")
-            zipcode = address_matched.group("zipcode")
-            city = address_matched.group("city")
-        else:
-            self.logger.warning(f"Could not extract street, zipcode and city from address: '{address}'. ")
-            city = street = zipcode = None
-
-        return city, zipcode, street
-
-    def extract_publication_date_and_number(
-        self, pub_date_and_number: Optional[str]
-    ) -> Tuple[Optional[date], Optional[str]]:
-        """extracts the publication date and number
-
-        :param pub_date_and_number: combined date and number
-        :return: publication_date, publication_number
-
-        example pub_date_and_number:
-        "2024-06-05 / 0402585"
-        """
-        if not pub_date_and_number:
-            self.logger.debug("Could not extract publication date and number from empty pub_date_and_number")
-            return None, None
-
-        match = re.match(r"^(?P<date>\d{4}-\d{2}-\d{2})\s/\s(?P<number>\d*-?\d+)$", pub_date_and_number)
-        if match:
-            self.logger.debug("¨Publication date and number are in standard format")
-            publication_date = datetime.strptime(match.group("date"), "%Y-%m-%d").date()
-            publication_number = match.group("number")
-            return publication_date, publication_number
-
-        # older publications have often only the year specified.
-        match = re.match(r"^(?P<date>\d{4})\s/\s(?P<number>\d*-?\d+)$", pub_date_and_number)
-        if match:
-            self.logger.debug("¨Publication date contains only the year.")
-            publication_date = datetime.strptime(match.group("date"), "%Y").date()
-            publication_number = match.group("number")
-            return publication_date, publication_number
-
-        self.logger.warning(f"Could not extract publication date and number from: '{pub_date_and_number}'")
-        publication_date = publication_number = None
-        return publication_date, publication_number
-
     def closed(self, reason: Literal["finished", "cancelled", "cancelled"]) -> None:
         """Called whenever the spider gets closed
 
         :param reason: reason of the closing of the spider
         """
+        if self.coordinator is not None:
+            if self.heartbeat.running:
+                self.heartbeat.stop()
+            self.coordinator.close()
+            self.logger.info(f"Shards of {self.coordinator_namespace()}: {self.coordinator.backend.progress()}")
+        elif self.checkpoint is not None:
+            self.close_checkpoint(reason)
+
+        summary_blob = self.settings["RUN_SUMMARY_BLOB"]
+        if summary_blob and not self.settings["CLEANUP_BLOBSTORE"]:
+            self.run_statistics.save(self.blob_store, summary_blob)
+
         if reason != "finished":
             return
 
-        blobs = list(self.container_client.list_blob_names())
-        vats = {str(Path(blob).parents[-2]) for blob in blobs}
-        num_pubs = len(blobs)
+        new_vats = self.run_statistics.new_vats
         self.logger.info("Successfully finished scraping run.")
-        self.logger.info(f"Created {len(vats - self.vats)} new companies and {num_pubs - self.num_pubs} publications.")
-        self.logger.info(f"New companies: {vats - self.vats}.")
+        self.logger.info(
+            f"Created {len(new_vats)} new companies and {self.run_statistics.num_new_publications} publications."
+        )
+        self.logger.info(f"New companies: {new_vats}.")
+
+    def close_checkpoint(self, reason: str) -> None:
+        """saves the checkpoint, it is removed when the crawl finished without unfinished work"""
+        self.checkpoint.save()
+        self.checkpoint.close()
 
 
 class LegalEntityVatSpider(BaseLegalEntitySpider):
     name = "legal-entity-vat-spider"
     type: Optional[Literal["vat", "date"]] = "vat"
 
+    def __init__(self, *args, vat_file: Optional[str] = None, **kwargs):
+        super(LegalEntityVatSpider, self).__init__(*args, **kwargs)
+        # VAT numbers are read from this text, CSV or Parquet file instead of LEGAL_ENTITIES (see src.vat_input)
+        self.vat_file = vat_file or SETTINGS["VAT_INPUT_FILE"]
+
+    def legal_entities(self) -> Iterator[dict]:
+        """:return: the legal entities to scrape, read lazily from the VAT file or `LEGAL_ENTITIES`"""
+        if self.vat_file:
+            return read_legal_entities(self.vat_file)
+        return (dict(legal_entity) for legal_entity in LEGAL_ENTITIES)
+
     def start_requests(self) -> Iterable[Request]:
         """starting point for the scraper
 
-        Makes a request for each vat number in `LEGAL_ENTITIES` between a given date range.
-        This request is continued in the method `continue requests`.
+        Makes a request for each vat number in `LEGAL_ENTITIES` (or the VAT file) between a given date range.
+        The legal entities are read in chunks of `VAT_INPUT_CHUNK_SIZE`, within a chunk the companies with the most
+        recent publications are requested first.
 
         :yield: a scrapy Request per to-scrape legal entity.
         """
-        for legal_entity in LEGAL_ENTITIES:
-            url = self.format_url(legal_entity)
-            legal_entity["vat"] = str(int(legal_entity["vat"]))
-            yield Request(url=url, callback=self.parse, meta=legal_entity)
+        if self.coordinator is not None:
+            return  # the VAT numbers are leased from the coordinator when the spider is idle
+        legal_entities = self.legal_entities()
+        chunk_size = self.settings.getint("VAT_INPUT_CHUNK_SIZE", 10000)
+        while chunk := list(islice(legal_entities, chunk_size)):
+            requests = [request for request in map(self.legal_entity_request, chunk) if request is not None]
+            yield from sorted(requests, key=lambda request: request.priority, reverse=True)
+
+    def legal_entity_request(self, legal_entity: dict, dont_filter: bool = False) -> Optional[Request]:
+        """creates the request of the first listing page of a legal entity
+
+        A company of which the newest publication (`last_publication_date`) is already scraped is skipped. With
+        `VAT_INCREMENTAL` (opt-in) only the publications since the last scraped publication of the company are
+        listed, the older publications that were dropped or failed in an earlier run are then skipped for good.
+
+        :param legal_entity: dict with vat, start_date, end_date and optionally last_publication_date
+        :param dont_filter: passed to the Request
+        :return: scrapy Request or None when the company is up to date
+        """
+        url = self.format_url(legal_entity)
+        vat = str(int(legal_entity["vat"]))
+        meta = {"vat": vat, "start_date": legal_entity.get("start_date"), "end_date": legal_entity.get("end_date")}
+
+        last_scraped = self.last_scraped_date(vat)
+        newest = legal_entity.get("last_publication_date")
+        if last_scraped and newest and last_scraped >= newest:
+            self.logger.debug(f"Newest publication of {vat} ({newest}) is already scraped, skipping...")
+            return None
+        if last_scraped and self.settings["VAT_INCREMENTAL"]:
+            meta["start_date"] = max(meta["start_date"] or self.settings["PUB_DATE_THRESHOLD"], last_scraped)
+
+        priority = self.refresh_priority(last_scraped)
+        return Request(url=url, callback=self.parse, meta=meta, priority=priority, dont_filter=dont_filter)
+
+    def last_scraped_date(self, vat: str) -> Optional[date]:
+        """:return: date of the latest scraped publication of the company according to the publication index"""
+        if self.publication_index is None:
+            return None
+        # the VAT spider saves publications below the VAT without leading zero, the date spider with leading zero
+        dates = [self.publication_index.last_publication_date(key) for key in {vat, vat.zfill(10)}]
+        return max(filter(None, dates), default=None)
+
+    @staticmethod
+    def refresh_priority(last_scraped: Optional[date]) -> int:
+        """companies with recent publications are refreshed first, companies without scraped publications last
+
+        :return: minus the number of weeks since the last scraped publication
+        """
+        max_weeks = 10_000
+        if last_scraped is None:
+            return -max_weeks
+        return -min((date.today() - last_scraped).days // 7, max_weeks - 1)
+
+    @staticmethod
+    def shard_key(legal_entity: dict) -> str:
+        """:return: the shard of a legal entity, its VAT number followed by its dates (when set), e.g.
+        `471938850/2020-01-01//` (start_date/end_date/last_publication_date)
+        """
+        vat = str(int(legal_entity["vat"]))
+        dates = [legal_entity.get(column) for column in ("start_date", "end_date", "last_publication_date")]
+        if not any(dates):
+            return vat
+        return "/".join([vat, *(value.isoformat() if value else "" for value in dates)])
+
+    @staticmethod
+    def parse_shard_key(shard: str) -> dict:
+        """:return: the legal entity of a shard (see shard_key)"""
+        vat, *dates = shard.split("/")
+        columns = ("start_date", "end_date", "last_publication_date")
+        return {"vat": vat.zfill(10)} | {
+            column: date.fromisoformat(value) if value else None for column, value in zip(columns, dates)
+        }
+
+    def shards(self) -> Iterator[str]:
+        """:return: the shards, read lazily from the VAT file such that it is never loaded in memory"""
+        return map(self.shard_key, self.legal_entities())
+
+    def shard_requests(self, shard: str) -> list[Request]:
+        request = self.legal_entity_request(self.parse_shard_key(shard), dont_filter=True)
+        if request is None:
+            self.checkpoint.page_parsed(shard, 1, is_last=True)  # up to date, the shard is completed
+            return []
+        # the pages of the shard are tracked under the shard, not only the VAT number (see search_key)
+        request.meta["shard"] = shard
+        return [request]
 
 
 class LegalEntityDateSpider(BaseLegalEntitySpider):
@@ -349,6 +655,58 @@ class LegalEntityDateSpider(BaseLegalEntitySpider):
         super(LegalEntityDateSpider, self).__init__(*args, **kwargs)
         self.start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
         self.end_date = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else date.today()
+        if SETTINGS["DATE_WINDOW_PLANNER"]:
+            self.planner = DateWindowPlanner(
+                max_results=SETTINGS.getint("DATE_WINDOW_MAX_RESULTS"),
+                initial_days=SETTINGS.getint("DATE_WINDOW_INITIAL_DAYS"),
+            )
+        # checkpoints need the publications of every page to be yielded with the page (STREAM_PUBLICATIONS)
+        # with a coordinator the workers share the date range, the progress is tracked per shard instead
+        if SETTINGS["CHECKPOINT_BLOB"] and SETTINGS["STREAM_PUBLICATIONS"] and not SETTINGS["COORDINATOR"]:
+            name = SETTINGS["CHECKPOINT_BLOB"].format(
+                spider=self.name, start_date=self.start_date, end_date=self.end_date
+            )
+            self.checkpoint = CrawlCheckpoint.load(self.blob_store, name, SETTINGS.getfloat("CHECKPOINT_INTERVAL", 5.0))
+
+    def initial_windows(self) -> list[DateWindow]:
+        if self.planner is not None:
+            # wide windows first, windows with too many results are split when their first page is parsed
+            return self.planner.initial_windows(self.start_date, self.end_date)
+        return [
+            DateWindow(scrape_date, scrape_date) for scrape_date in DateWindow(self.start_date, self.end_date).dates()
+        ]
+
+    def coordinator_namespace(self) -> str:
+        return f"{self.name}/{self.start_date}_{self.end_date}"
+
+    def shards(self) -> list[str]:
+        return [
+            self.search_key({"start_date": window.start, "end_date": window.end}) for window in self.initial_windows()
+        ]
+
+    def shard_requests(self, shard: str) -> list[Request]:
+        start_date, end_date = map(date.fromisoformat, shard.split("/"))
+        return [self.listing_request({"start_date": start_date, "end_date": end_date, "page": 1})]
+
+    def close_checkpoint(self, reason: str) -> None:
+        if reason == "finished" and not self.checkpoint.pending and not self.remaining_windows():
+            self.checkpoint.delete()
+            self.checkpoint.close()
+            self.logger.info(f"All windows completed, removed checkpoint {self.checkpoint.name}.")
+            return
+        super().close_checkpoint(reason)
+        self.logger.info(f"Saved checkpoint {self.checkpoint.name}, rerun the same date range to resume.")
+
+    def remaining_windows(self) -> list[DateWindow]:
+        """:return: the windows to search, without the windows that were completed before the crawl was resumed"""
+        if self.checkpoint is None:
+            return self.initial_windows()
+        windows = []
+        for window in self.initial_windows():
+            search = self.search_key({"start_date": window.start, "end_date": window.end})
+            for remaining in self.checkpoint.remaining(search):
+                windows.append(DateWindow(*map(date.fromisoformat, remaining.split("/"))))
+        return windows
 
     def start_requests(self) -> Iterable[Request]:
         """starting point for the scraper
@@ -358,9 +716,9 @@ class LegalEntityDateSpider(BaseLegalEntitySpider):
 
         :yield: a scrapy Request per to-scrape legal entity.
         """
-        delta_days = self.end_date - self.start_date
-        for i in range(delta_days.days + 1):
-            scrape_date = self.start_date + timedelta(days=i)
-            meta = {"start_date": scrape_date, "end_date": scrape_date, "page": 1}
+        if self.coordinator is not None:
+            return  # the windows are leased from the coordinator when the spider is idle
+        for window in self.remaining_windows():
+            meta = {"start_date": window.start, "end_date": window.end, "page": 1}
             url = self.format_url(meta)
             yield Request(url=url, callback=self.parse, meta=meta)
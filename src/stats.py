@@ -0,0 +1,82 @@
+"""
+contains the run statistics of the spiders.
+
+The statistics are counted while the pipeline uploads publications, such that the end-of-run report does not need
+a full listing of the blob container. The totals over all runs are kept in a small summary BLOB.
+"""
+
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from src.index import PublicationIndex
+from src.storage import BlobStore
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "RunStatistics",
+]
+
+
+class RunStatistics:
+    """counts the new companies and publications that are uploaded during a run
+
+    When a publication index is available, publications and companies that were already stored are not counted as
+    new. Without an index every uploaded publication and company is counted.
+    """
+
+    def __init__(self, index: Optional[PublicationIndex] = None):
+        self.index = index
+        self.new_vats: set[str] = set()
+        self.num_new_publications = 0
+        self.num_uploads = 0
+
+    def record(self, vat: str, publication_number: str) -> None:
+        """registers an uploaded publication, must be called before the publication is added to the index"""
+        self.num_uploads += 1
+        if self.index is None or not self.index.has_vat(vat):
+            self.new_vats.add(vat)
+        if self.index is None or (vat, publication_number) not in self.index:
+            self.num_new_publications += 1
+
+    def summary(self, previous: Optional[dict] = None) -> dict:
+        """combines the counts of this run with the totals of the previous runs
+
+        :param previous: summary of the previous runs
+        :return: summary dict
+        """
+        if previous:
+            num_companies = previous["num_companies"] + len(self.new_vats)
+            num_publications = previous["num_publications"] + self.num_new_publications
+        elif self.index is not None:
+            # no summary yet, the index (which already contains this run) knows the totals
+            num_companies, num_publications = self.index.num_vats, len(self.index)
+        else:
+            num_companies, num_publications = len(self.new_vats), self.num_new_publications
+
+        return {
+            "num_companies": num_companies,
+            "num_publications": num_publications,
+            "last_run": {
+                "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "new_companies": len(self.new_vats),
+                "new_publications": self.num_new_publications,
+                "uploads": self.num_uploads,
+            },
+        }
+
+    def save(self, store: BlobStore, name: str) -> dict:
+        """updates the summary BLOB with the counts of this run
+
+        :param store: BlobStore in which the publications are saved
+        :param name: name of the summary blob
+        :return: the updated summary
+        """
+        data = store.read(name)
+        summary = self.summary(json.loads(data) if data is not None else None)
+        store.write(name, json.dumps(summary, indent=2).encode("utf-8"))
+        num_companies, num_publications = summary["num_companies"], summary["num_publications"]
+        logger.info(f"Saved run summary {name}: {num_companies} companies, {num_publications} publications.")
+        return summary
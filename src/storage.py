@@ -0,0 +1,291 @@
+"""
+contains the storage backends used to persist publications and run metadata.
+
+Azure Blob Storage is used in production, a local folder can stand in for it when developing or testing offline.
+"""
+
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+from azure.storage.blob import ContainerClient, ContentSettings
+from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+
+logger = logging.getLogger(__name__)
+
+# maximum number of blobs of a batch request
+MAX_BATCH_SIZE = 256
+
+__all__ = [
+    "BlobStore",
+    "AzureBlobStore",
+    "LocalBlobStore",
+    "MemoryBlobStore",
+    "AsyncBlobStore",
+    "AsyncAzureBlobStore",
+    "ThreadedBlobStore",
+    "delete_blobs",
+]
+
+
+class BlobStore(ABC):
+    """minimal blob storage interface shared by the Azure and local backends.
+
+    Blob names are `/` separated paths relative to the root of the store (e.g. `{vat}/{yyyy}/{mm}/{dd}/{nr}.json`).
+    """
+
+    @abstractmethod
+    def list_names(self, prefix: Optional[str] = None) -> Iterator[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def read(self, name: str) -> Optional[bytes]:
+        """:return: content of the blob or None when the blob does not exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def write(
+        self, name: str, data: bytes, tags: Optional[dict[str, str]] = None, content_encoding: Optional[str] = None
+    ) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+    def delete_many(self, names: list[str]) -> int:
+        """deletes several blobs, one by one unless the backend supports batches
+
+        :return: number of blobs that could not be deleted
+        """
+        for name in names:
+            self.delete(name)
+        return 0
+
+
+class AzureBlobStore(BlobStore):
+    def __init__(self, container_client: ContainerClient):
+        self.container_client = container_client
+
+    def list_names(self, prefix: Optional[str] = None) -> Iterator[str]:
+        yield from self.container_client.list_blob_names(name_starts_with=prefix)
+
+    def read(self, name: str) -> Optional[bytes]:
+        try:
+            return self.container_client.download_blob(name).readall()
+        except ResourceNotFoundError:
+            return None
+
+    def write(
+        self, name: str, data: bytes, tags: Optional[dict[str, str]] = None, content_encoding: Optional[str] = None
+    ) -> None:
+        content_settings = ContentSettings(content_encoding=content_encoding) if content_encoding else None
+        self.container_client.upload_blob(name, data, overwrite=True, tags=tags, content_settings=content_settings)
+
+    def delete(self, name: str) -> None:
+        self.container_client.delete_blob(name, delete_snapshots="include")
+
+    def delete_many(self, names: list[str]) -> int:
+        """deletes up to MAX_BATCH_SIZE blobs (and their snapshots) with a single batch request"""
+        responses = self.container_client.delete_blobs(*names, delete_snapshots="include", raise_on_any_failure=False)
+        # 404: deleted in the meantime
+        return sum(response.status_code not in (200, 202, 404) for response in responses)
+
+
+class LocalBlobStore(BlobStore):
+    """stores blobs as files below `root`, tags and content encodings are not persisted."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def list_names(self, prefix: Optional[str] = None) -> Iterator[str]:
+        for path in sorted(self.root.rglob("*")):
+            name = path.relative_to(self.root).as_posix()
+            if path.is_file() and not path.name.endswith(".tmp") and (not prefix or name.startswith(prefix)):
+                yield name
+
+    def read(self, name: str) -> Optional[bytes]:
+        path = self.root / name
+        return path.read_bytes() if path.is_file() else None
+
+    def write(
+        self, name: str, data: bytes, tags: Optional[dict[str, str]] = None, content_encoding: Optional[str] = None
+    ) -> None:
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so readers never see a half written blob
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+    def delete(self, name: str) -> None:
+        (self.root / name).unlink(missing_ok=True)
+
+
+class MemoryBlobStore(BlobStore):
+    """keeps the blobs in a dict, useful in tests"""
+
+    def __init__(self):
+        self.blobs: dict[str, bytes] = {}
+        self.tags: dict[str, dict[str, str]] = {}
+
+    def list_names(self, prefix: Optional[str] = None) -> Iterator[str]:
+        yield from sorted(name for name in self.blobs if not prefix or name.startswith(prefix))
+
+    def read(self, name: str) -> Optional[bytes]:
+        return self.blobs.get(name)
+
+    def write(
+        self, name: str, data: bytes, tags: Optional[dict[str, str]] = None, content_encoding: Optional[str] = None
+    ) -> None:
+        self.blobs[name] = data
+        self.tags[name] = tags or {}
+
+    def delete(self, name: str) -> None:
+        self.blobs.pop(name, None)
+        self.tags.pop(name, None)
+
+
+class AsyncBlobStore(ABC):
+    """asynchronous counterpart of BlobStore used for uploading from within the event loop"""
+
+    @abstractmethod
+    async def write(
+        self, name: str, data: bytes, tags: Optional[dict[str, str]] = None, content_encoding: Optional[str] = None
+    ) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class AsyncAzureBlobStore(AsyncBlobStore):
+    """uploads with the async Azure client, all uploads share the connection pool of one container client"""
+
+    def __init__(
+        self, container_client: AsyncContainerClient, credential: Optional[AsyncDefaultAzureCredential] = None
+    ):
+        self.container_client = container_client
+        self.credential = credential  # closed together with the store
+
+    @classmethod
+    def from_url(cls, account_url: str, container_name: str) -> "AsyncAzureBlobStore":
+        credential = AsyncDefaultAzureCredential()
+        return cls(AsyncContainerClient(account_url, container_name, credential=credential), credential)
+
+    async def write(
+        self, name: str, data: bytes, tags: Optional[dict[str, str]] = None, content_encoding: Optional[str] = None
+    ) -> None:
+        content_settings = ContentSettings(content_encoding=content_encoding) if content_encoding else None
+        await self.container_client.upload_blob(
+            name, data, overwrite=True, tags=tags, content_settings=content_settings
+        )
+
+    async def close(self) -> None:
+        await self.container_client.close()
+        if self.credential is not None:
+            await self.credential.close()
+
+
+class ThreadedBlobStore(AsyncBlobStore):
+    """runs the writes of a synchronous BlobStore (e.g. LocalBlobStore) in a thread"""
+
+    def __init__(self, store: BlobStore):
+        self.store = store
+
+    async def write(
+        self, name: str, data: bytes, tags: Optional[dict[str, str]] = None, content_encoding: Optional[str] = None
+    ) -> None:
+        await asyncio.to_thread(self.store.write, name, data, tags, content_encoding)
+
+
+def _delete_one_by_one(store: BlobStore, names: list[str]) -> int:
+    failed = 0
+    for name in names:
+        try:
+            store.delete(name)
+        except ResourceNotFoundError:
+            pass
+        except Exception as e:
+            failed += 1
+            logger.warning(f"Could not delete {name}: {e!r}")
+    return failed
+
+
+def delete_blobs(
+    store: BlobStore,
+    names: Iterable[str],
+    batch_size: int = MAX_BATCH_SIZE,
+    max_concurrency: int = 8,
+    log_interval: float = 10.0,
+) -> tuple[int, int]:
+    """deletes blobs in batches of `batch_size` with at most `max_concurrency` batch requests in flight
+
+    The names are consumed lazily, listing the blobs and deleting them overlap. When a batch request fails (e.g. an
+    emulator or storage account without support for batches), the remaining blobs are deleted one by one.
+    With a `batch_size` of 1 the blobs are deleted one by one in the calling thread.
+
+    :param store: BlobStore, batches are only supported by the AzureBlobStore
+    :param names: names of the blobs to delete
+    :param batch_size: blobs per batch request, at most 256
+    :param max_concurrency: number of batch requests in flight
+    :param log_interval: seconds between progress logs
+    :return: number of deleted blobs and number of blobs that could not be deleted
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    names = iter(names)
+    start = last_log = time.monotonic()
+    num_deleted = num_failed = 0
+    one_by_one = batch_size == 1
+
+    def delete_batch(batch: list[str]) -> tuple[int, int]:
+        nonlocal one_by_one
+        if not one_by_one:
+            try:
+                failed = store.delete_many(batch)
+                return len(batch) - failed, failed
+            except Exception as e:
+                one_by_one = True
+                logger.warning(f"Batch deletion failed ({e!r}), deleting the remaining blobs one by one.")
+        failed = _delete_one_by_one(store, batch)
+        return len(batch) - failed, failed
+
+    def log_progress(final: bool = False) -> None:
+        nonlocal last_log
+        now = time.monotonic()
+        if final or now - last_log >= log_interval:
+            last_log = now
+            rate = num_deleted / max(now - start, 1e-9)
+            logger.info(f"Deleted {num_deleted} blobs ({num_failed} failed), {rate:.0f} blobs/s.")
+
+    if one_by_one:
+        for name in names:
+            deleted, failed = delete_batch([name])
+            num_deleted, num_failed = num_deleted + deleted, num_failed + failed
+            log_progress()
+        log_progress(final=True)
+        return num_deleted, num_failed
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="delete-blobs") as executor:
+        pending: set[Future] = set()
+        while True:
+            # keeps a few batches queued per request in flight, without listing all blobs upfront
+            while len(pending) < 2 * max_concurrency and (batch := list(islice(names, batch_size))):
+                pending.add(executor.submit(delete_batch, batch))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                deleted, failed = future.result()
+                num_deleted, num_failed = num_deleted + deleted, num_failed + failed
+            log_progress()
+    log_progress(final=True)
+    return num_deleted, num_failed
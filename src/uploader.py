@@ -0,0 +1,117 @@
+"""
+contains the uploader that saves the publications in the blob storage without blocking the event loop.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from src.metrics import NULL_METRICS, Metrics
+from src.storage import AsyncBlobStore
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "BlobUploader",
+]
+
+
+class BlobUploader:
+    """uploads blobs in background tasks with a bounded number of uploads in flight
+
+    `submit` waits until an upload slot is free (backpressure towards the pipeline) and returns as soon as the
+    upload is started. Failed uploads are retried with exponential backoff. `flush` waits for all pending uploads.
+    """
+
+    def __init__(
+        self,
+        store: AsyncBlobStore,
+        max_concurrency: int = 16,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        metrics: Metrics = NULL_METRICS,
+    ):
+        """
+        :param store: AsyncBlobStore to upload to
+        :param max_concurrency: maximum number of uploads in flight
+        :param max_retries: number of retries of a failed upload
+        :param backoff: seconds to wait before the first retry, doubles every retry
+        :param metrics: records the latency (upload) and size (upload_bytes) of the uploads and the pending uploads
+        """
+        self.store = store
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self.num_uploaded = 0
+        self.num_failed = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: set[asyncio.Task] = set()
+
+    async def submit(
+        self,
+        name: str,
+        data: bytes,
+        tags: Optional[dict[str, str]] = None,
+        on_success: Optional[Callable[[], None]] = None,
+        content_encoding: Optional[str] = None,
+    ) -> None:
+        """starts the upload of a blob in the background
+
+        :param name: name of the blob
+        :param data: content of the blob
+        :param tags: blob index tags
+        :param on_success: called after the blob was uploaded
+        :param content_encoding: Content-Encoding of the blob, e.g. "gzip" (see PayloadCodec)
+        """
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._upload(name, data, tags, on_success, content_encoding))
+        self._pending.add(task)
+        task.add_done_callback(self._on_done)
+        self.metrics.set_gauge("uploads_pending", len(self._pending))
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._pending.discard(task)
+        self.metrics.set_gauge("uploads_pending", len(self._pending))
+
+    async def _upload(
+        self,
+        name: str,
+        data: bytes,
+        tags: Optional[dict[str, str]],
+        on_success: Optional[Callable[[], None]],
+        content_encoding: Optional[str],
+    ) -> None:
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with self.metrics.timer("upload"):
+                        await self.store.write(name, data, tags, content_encoding)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self.num_failed += 1
+                        logger.error(f"Could not upload {name} after {attempt + 1} attempts: {e!r}")
+                        return
+                    delay = self.backoff * 2**attempt
+                    logger.warning(f"Upload of {name} failed ({e!r}), retrying in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+
+            self.num_uploaded += 1
+            self.metrics.inc("upload_bytes", len(data))
+            if on_success is not None:
+                on_success()
+        finally:
+            self._semaphore.release()
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> None:
+        """waits until all submitted uploads are done"""
+        while self._pending:
+            await asyncio.gather(*self._pending)
+
+    async def close(self) -> None:
+        await self.flush()
+        await self.store.close()
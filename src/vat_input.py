@@ -0,0 +1,121 @@
+"""
+contains the readers of the file with the VAT numbers scraped by the VAT spider.
+
+The file is read lazily, row by row (text and CSV) or batch by batch (Parquet), such that hundreds of thousands of
+VAT numbers do not need to be kept in memory. Every row becomes a legal entity like the ones in `LEGAL_ENTITIES`:
+{"vat", "start_date", "end_date"} and optionally "last_publication_date" (the date of the newest publication of the
+company when known, e.g. from a KBO extract).
+
+Supported formats (by file extension):
+- `.txt`: one VAT number per line, empty lines and lines starting with `#` are skipped
+- `.csv`: a header with a `vat` column and the optional columns `start_date`, `end_date` and `last_publication_date`
+- `.parquet`: the same columns as the CSV file, requires pyarrow
+"""
+
+import csv
+import logging
+import re
+from datetime import date
+from pathlib import Path
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DATE_COLUMNS = ("start_date", "end_date", "last_publication_date")
+PARQUET_BATCH_SIZE = 10_000
+
+__all__ = [
+    "normalize_vat",
+    "read_legal_entities",
+]
+
+
+def normalize_vat(vat: object) -> Optional[str]:
+    """normalizes a VAT (enterprise) number to its 10 digits, e.g. `BE 0471.938.850` becomes `0471938850`
+
+    :param vat: VAT number as str or int
+    :return: the 10 digits or None when the VAT number is invalid
+    """
+    if vat is None:
+        return None
+    digits = re.sub(r"[\s.\-]", "", str(vat)).upper().removeprefix("BE")
+    if not digits.isdigit() or len(digits) > 10:
+        return None
+    return digits.zfill(10)
+
+
+def _parse_date(value: object) -> Optional[date]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip())
+
+
+def _legal_entity(row: dict, line: int | str) -> Optional[dict]:
+    """:return: the legal entity of a row or None when the row is invalid (a warning is logged)"""
+    vat = normalize_vat(row.get("vat"))
+    if vat is None:
+        logger.warning(f"Skipping invalid VAT number {row.get('vat')!r} at {line}.")
+        return None
+    try:
+        dates = {column: _parse_date(row.get(column)) for column in DATE_COLUMNS}
+    except ValueError as error:
+        logger.warning(f"Skipping VAT number {vat} at {line}, invalid date: {error}")
+        return None
+    return {"vat": vat, **dates}
+
+
+def _read_text(path: Path) -> Iterator[dict]:
+    with path.open("r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            legal_entity = _legal_entity({"vat": line}, f"{path}:{line_number}")
+            if legal_entity is not None:
+                yield legal_entity
+
+
+def _read_csv(path: Path) -> Iterator[dict]:
+    with path.open("r", encoding="utf-8-sig", newline="") as file:
+        reader = csv.DictReader(file)
+        if "vat" not in (reader.fieldnames or ()):
+            raise ValueError(f"{path} has no `vat` column in its header: {reader.fieldnames}")
+        for row in reader:
+            legal_entity = _legal_entity(row, f"{path}:{reader.line_num}")
+            if legal_entity is not None:
+                yield legal_entity
+
+
+def _read_parquet(path: Path) -> Iterator[dict]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("Reading VAT numbers from Parquet requires pyarrow: pip install pyarrow") from error
+
+    parquet_file = pq.ParquetFile(path)
+    if "vat" not in parquet_file.schema_arrow.names:
+        raise ValueError(f"{path} has no `vat` column: {parquet_file.schema_arrow.names}")
+    columns = [column for column in ("vat", *DATE_COLUMNS) if column in parquet_file.schema_arrow.names]
+    row_number = 0
+    for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=columns):
+        for row in batch.to_pylist():
+            row_number += 1
+            legal_entity = _legal_entity(row, f"{path} row {row_number}")
+            if legal_entity is not None:
+                yield legal_entity
+
+
+def read_legal_entities(path: str | Path) -> Iterator[dict]:
+    """reads the VAT numbers (and optional date ranges) to scrape lazily from a text, CSV or Parquet file
+
+    :param path: file with the VAT numbers
+    :yield: a legal entity dict per valid row
+    """
+    path = Path(path)
+    readers = {".txt": _read_text, ".csv": _read_csv, ".parquet": _read_parquet}
+    reader = readers.get(path.suffix.lower())
+    if reader is None:
+        raise ValueError(f"Unsupported VAT file {path}, use one of {', '.join(readers)}.")
+    return reader(path)
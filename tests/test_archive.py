@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.utils.test import get_crawler
+
+from benchmarks.fixtures import LISTING_PAGE, PDFS
+from src.archive import HttpArchive
+from src.middlewares import BelgianJournalDownloaderMiddleware
+
+LISTING_URL = "https://www.ejustice.just.fgov.be/cgi_tsv/rech_res.pl?language=nl&btw=0471938850"
+PDF_URL = "https://www.ejustice.just.fgov.be/tsv_pdf/2024/07/11/24104762.pdf"
+
+
+def recorded_responses() -> list[Response]:
+    listing = HtmlResponse(
+        url=LISTING_URL,
+        status=200,
+        headers={"Content-Type": "text/html; charset=utf-8", "Set-Cookie": ["a=1", "b=2"]},
+        body=LISTING_PAGE.read_bytes(),
+    )
+    pdf = Response(url=PDF_URL, status=200, headers={"Content-Type": "application/pdf"}, body=PDFS[0].read_bytes())
+    not_found = HtmlResponse(url=f"{LISTING_URL}&page=9", status=404, body=b"<html>Not found</html>")
+    return [listing, pdf, not_found]
+
+
+def assert_same_response(replayed: Response, recorded: Response) -> None:
+    assert type(replayed) is type(recorded)
+    assert (replayed.url, replayed.status, replayed.body) == (recorded.url, recorded.status, recorded.body)
+    assert replayed.headers == recorded.headers
+    assert "archived" in replayed.flags
+
+
+def test_archive_round_trip(tmp_path):
+    responses = recorded_responses()
+    archive = HttpArchive(tmp_path, writable=True)
+    for i, response in enumerate(responses):
+        archive.write(str(i), response)
+    archive.close()
+
+    archive = HttpArchive(tmp_path)
+    assert len(archive) == len(responses)
+    for i, response in enumerate(responses):
+        assert_same_response(archive.read(str(i)), response)
+    assert archive.read("missing") is None
+    with pytest.raises(PermissionError):
+        archive.write("3", responses[0])
+    archive.close()
+
+
+def test_the_last_recording_of_a_request_wins(tmp_path):
+    listing, pdf, _ = recorded_responses()
+    archive = HttpArchive(tmp_path, writable=True)
+    archive.write("0", listing)
+    archive.write("0", pdf)
+    archive.close()
+
+    archive = HttpArchive(tmp_path)
+    assert len(archive) == 1
+    assert_same_response(archive.read("0"), pdf)
+    archive.close()
+
+
+def test_replay_needs_a_recorded_archive(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        HttpArchive(tmp_path / "missing")
+
+
+def middleware(mode: str, directory) -> BelgianJournalDownloaderMiddleware:
+    crawler = get_crawler(settings_dict={"HTTP_ARCHIVE_MODE": mode, "HTTP_ARCHIVE_DIR": str(directory)})
+    return BelgianJournalDownloaderMiddleware.from_crawler(crawler)
+
+
+def test_middleware_replays_the_recorded_responses(tmp_path):
+    responses = recorded_responses()
+    requests = [Request(response.url) for response in responses]
+
+    recorder = middleware("record", tmp_path)
+    for request, response in zip(requests, responses):
+        assert asyncio.run(recorder.process_request(request, None)) is None  # downloaded from the website
+        assert recorder.process_response(request, response, None) is response
+    assert recorder.crawler.stats.get_value("http_archive/recorded") == len(responses)
+    recorder.spider_closed(None)
+
+    replayer = middleware("replay", tmp_path)
+    for request, response in zip(requests, responses):
+        replayed = asyncio.run(replayer.process_request(request, None))
+        assert_same_response(replayed, response)
+        assert replayed.request is request
+        # replayed responses are not recorded again
+        assert replayer.process_response(request, replayed, None) is replayed
+    assert replayer.crawler.stats.get_value("http_archive/replayed") == len(responses)
+
+    # a request that was not recorded is ignored instead of downloaded
+    with pytest.raises(IgnoreRequest):
+        asyncio.run(replayer.process_request(Request(f"{LISTING_URL}&page=2"), None))
+    assert replayer.crawler.stats.get_value("http_archive/miss") == 1
+    replayer.spider_closed(None)
+
+
+def test_middleware_without_archive(tmp_path):
+    passthrough = middleware(None, tmp_path / "archive")
+    request, response = Request(LISTING_URL), recorded_responses()[0]
+    assert passthrough.archive is None
+    assert asyncio.run(passthrough.process_request(request, None)) is None
+    assert passthrough.process_response(request, response, None) is response
+    assert not (tmp_path / "archive").exists()
@@ -0,0 +1,44 @@
+from src.checkpoint import CrawlCheckpoint
+from src.storage import MemoryBlobStore
+
+
+def test_a_search_is_completed_when_its_pages_are_parsed_and_uploaded():
+    checkpoint = CrawlCheckpoint(None, None)
+    checkpoint.add_pending("2024-01-01", 1, "0471938850", "0000001")
+    checkpoint.page_parsed("2024-01-01", 1, is_last=False)
+    checkpoint.page_parsed("2024-01-01", 2, is_last=True)
+    assert not checkpoint.is_page_done("2024-01-01", 1) and checkpoint.is_page_done("2024-01-01", 2)
+    assert checkpoint.has_pending("2024-01-01") and not checkpoint.is_completed("2024-01-01")
+
+    checkpoint.publication_done("0471938850", "0000001")
+    assert checkpoint.is_completed("2024-01-01") and not checkpoint.has_pending("2024-01-01")
+
+
+def test_a_split_search_is_completed_when_its_parts_are_completed():
+    checkpoint = CrawlCheckpoint(None, None)
+    checkpoint.split("2024-01", ["2024-01-a", "2024-01-b"])
+    checkpoint.split("2024-01-b", ["2024-01-b1", "2024-01-b2"])
+    for search in ("2024-01-a", "2024-01-b1"):
+        checkpoint.page_parsed(search, 1, is_last=True)
+    assert checkpoint.remaining("2024-01") == ["2024-01-b2"]
+    checkpoint.page_parsed("2024-01-b2", 1, is_last=True)
+    assert checkpoint.is_completed("2024-01") and checkpoint.remaining("2024-01") == []
+
+
+def test_resume():
+    store = MemoryBlobStore()
+    checkpoint = CrawlCheckpoint(store, "_checkpoint.json")
+    checkpoint.page_parsed("2024-01-01", 1, is_last=True)
+    checkpoint.add_pending("2024-01-02", 1, "0471938850", "0000001")
+    checkpoint.page_parsed("2024-01-02", 1, is_last=False)
+    checkpoint.page_parsed("2024-01-02", 2, is_last=False)
+    checkpoint.save()
+    checkpoint.close()
+
+    resumed = CrawlCheckpoint.load(store, "_checkpoint.json")
+    assert resumed.is_completed("2024-01-01")
+    # the page with a pending publication is parsed again
+    assert not resumed.is_page_done("2024-01-02", 1) and resumed.is_page_done("2024-01-02", 2)
+    resumed.delete()
+    resumed.close()
+    assert store.read("_checkpoint.json") is None
@@ -0,0 +1,53 @@
+import json
+from unittest import mock
+
+import pytest
+
+from src import codec
+from src.codec import PayloadCodec, decode_payload, dumps, read_payload
+from src.storage import MemoryBlobStore
+
+PUBLICATION = {
+    "vat": "0471938850",
+    "company_name": "ERNST & YOUNG CONSULTING",
+    "publication_date": "2024-07-11",
+    "text": "Benoeming van de bestuurders, société à responsabilité limitée\n" * 50,
+    "is_digital": True,
+}
+
+
+@pytest.mark.parametrize("encoding", [None, "gzip", "zstd"])
+def test_round_trip(encoding):
+    if encoding == "zstd":
+        pytest.importorskip("zstandard")
+    payload_codec = PayloadCodec(encoding)
+    data = payload_codec.encode(PUBLICATION)
+    assert payload_codec.content_encoding == encoding
+    assert decode_payload(data) == PUBLICATION
+    if encoding:
+        assert len(data) < len(dumps(PUBLICATION))
+        assert data == payload_codec.encode(PUBLICATION)  # the same publication gives the same blob
+
+
+def test_json_fallback():
+    with mock.patch.object(codec, "orjson", None):
+        data = dumps(PUBLICATION)
+        assert codec.loads(data) == PUBLICATION
+    assert json.loads(data) == json.loads(dumps(PUBLICATION))
+
+
+def test_uncompressed_blobs_of_earlier_runs():
+    data = json.dumps(PUBLICATION).encode("utf-8")
+    assert decode_payload(data) == PUBLICATION
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        PayloadCodec("brotli")
+
+
+def test_read_payload():
+    store = MemoryBlobStore()
+    store.write("0471938850/2024/07/11/0104762.json", PayloadCodec("gzip").encode(PUBLICATION))
+    assert read_payload(store, "0471938850/2024/07/11/0104762.json") == PUBLICATION
+    assert read_payload(store, "0471938850/2024/07/11/0000000.json") is None
@@ -0,0 +1,290 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Iterator, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+
+from src.coordinator import BlobCoordinatorBackend, SqliteCoordinatorBackend, WorkCoordinator
+
+SHARDS = [f"2024-01-{day:02d}" for day in range(1, 11)]
+
+
+def create_backend(tmp_path, **kwargs) -> SqliteCoordinatorBackend:
+    backend = SqliteCoordinatorBackend(tmp_path / "coordinator.sqlite", "test", **kwargs)
+    backend.add_shards(SHARDS)
+    return backend
+
+
+def test_workers_share_the_shards(tmp_path):
+    create_backend(tmp_path)
+    completed = []
+
+    def work(owner):
+        coordinator = WorkCoordinator(create_backend(tmp_path), owner, max_shards=2, poll_interval=0)
+        while (shard := coordinator.acquire()) is not None:
+            completed.append((owner, shard))
+            coordinator.complete(shard)
+
+    workers = [threading.Thread(target=work, args=(f"worker-{i}",)) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted(shard for _, shard in completed) == SHARDS
+    assert create_backend(tmp_path).progress() == {"pending": 0, "done": 10, "failed": 0, "leased": 0}
+
+
+def test_max_shards_and_poll_interval(tmp_path):
+    coordinator = WorkCoordinator(create_backend(tmp_path), "worker", max_shards=2, poll_interval=60)
+    assert coordinator.acquire() == SHARDS[0] and coordinator.acquire() == SHARDS[1]
+    assert coordinator.acquire() is None  # at capacity
+    for shard in list(coordinator.held):
+        coordinator.complete(shard)
+
+    other = WorkCoordinator(create_backend(tmp_path), "other", max_shards=10, poll_interval=60)
+    while other.acquire() is not None:
+        pass
+    assert len(other.held) == 8
+    assert coordinator.acquire() is None
+    for shard in list(other.held):
+        other.fail(shard)
+    # no shard was available, the shards are not listed again within the poll interval
+    assert coordinator.acquire() is None
+
+
+def test_an_expired_lease_is_reclaimed(tmp_path):
+    crashed = WorkCoordinator(create_backend(tmp_path), "crashed", lease_seconds=0.01, max_shards=1)
+    assert crashed.acquire() == SHARDS[0]
+    time.sleep(0.02)
+
+    worker = WorkCoordinator(create_backend(tmp_path), "worker", max_shards=1)
+    assert worker.acquire() == SHARDS[0]
+    crashed.heartbeat()
+    assert not crashed.held
+    crashed.complete(SHARDS[0])  # the lease was lost, the shard stays with the other worker
+    assert create_backend(tmp_path).progress()["done"] == 0
+
+
+def test_a_shard_is_given_up_after_max_attempts(tmp_path):
+    coordinator = WorkCoordinator(create_backend(tmp_path, max_attempts=2), "worker", max_shards=1, poll_interval=0)
+    for _ in range(2):
+        assert coordinator.acquire() == SHARDS[0]
+        coordinator.fail(SHARDS[0])
+    assert coordinator.acquire() == SHARDS[1]
+    assert create_backend(tmp_path).progress()["failed"] == 1
+
+
+def test_close_releases_the_held_shards(tmp_path):
+    coordinator = WorkCoordinator(create_backend(tmp_path), "worker", max_shards=2)
+    coordinator.acquire()
+    coordinator.acquire()
+    coordinator.close()
+    assert coordinator.acquire() is None
+    assert create_backend(tmp_path).progress() == {"pending": 10, "done": 0, "failed": 0, "leased": 0}
+    assert WorkCoordinator(create_backend(tmp_path), "other").acquire() == SHARDS[0]
+
+
+def test_has_unfinished(tmp_path):
+    coordinator = WorkCoordinator(create_backend(tmp_path), "worker", max_shards=10, poll_interval=0)
+    while (shard := coordinator.acquire()) is not None:
+        assert coordinator.has_unfinished()
+        coordinator.complete(shard)
+    assert not coordinator.has_unfinished()
+
+
+class FakeBlob:
+    def __init__(self, metadata: dict):
+        self.metadata = dict(metadata)
+        self.etag = 0
+        self.last_modified = datetime.now(timezone.utc)
+        self.lease_id: Optional[str] = None
+        self.lease_expires = 0.0
+
+    @property
+    def lease_state(self) -> str:
+        if self.lease_id is None:
+            return "available"
+        return "leased" if self.lease_expires > time.time() else "expired"
+
+    def check_lease(self, lease: Optional["FakeLease"]) -> None:
+        lease_id = lease.id if lease is not None else None
+        if (self.lease_state == "leased" or lease_id) and self.lease_id != lease_id:
+            raise HttpResponseError("lease id mismatch")
+
+
+class FakeBlobClient:
+    def __init__(self, container: "FakeContainerClient", name: str):
+        self.container = container
+        self.name = name
+
+    def blob(self) -> FakeBlob:
+        if self.name not in self.container.blobs:
+            raise ResourceNotFoundError(self.name)
+        return self.container.blobs[self.name]
+
+    def upload_blob(self, data: bytes, metadata: dict, overwrite: bool = False) -> None:
+        self.container.upload_blob(self.name, data, metadata=metadata, overwrite=overwrite)
+
+    def get_blob_properties(self) -> SimpleNamespace:
+        blob = self.blob()
+        return SimpleNamespace(metadata=dict(blob.metadata), etag=blob.etag, last_modified=blob.last_modified)
+
+    def set_blob_metadata(self, metadata: dict, lease=None, etag=None, match_condition=None) -> None:
+        blob = self.blob()
+        blob.check_lease(lease)
+        if match_condition == MatchConditions.IfNotModified and etag != blob.etag:
+            raise HttpResponseError("etag mismatch")
+        blob.metadata, blob.etag, blob.last_modified = dict(metadata), blob.etag + 1, datetime.now(timezone.utc)
+
+    def delete_blob(self, lease=None) -> None:
+        self.blob().check_lease(lease)
+        del self.container.blobs[self.name]
+
+
+class FakeLease:
+    def __init__(self, blob_client: FakeBlobClient, lease_id: str):
+        self.blob_client = blob_client
+        self.id = lease_id
+
+    def acquire(self, lease_duration: int) -> None:
+        blob = self.blob_client.blob()
+        if blob.lease_state == "leased" and blob.lease_id != self.id:
+            raise HttpResponseError("leased")
+        blob.lease_id, blob.lease_expires = self.id, time.time() + lease_duration
+
+    def renew(self) -> None:
+        self.acquire(60)
+
+    def release(self) -> None:
+        self.blob_client.blob().check_lease(self)
+        self.blob_client.blob().lease_id = None
+
+
+class FakeContainerClient:
+    """keeps the blobs in memory and counts the pages of the listings and the uploads"""
+
+    page_size = 4
+
+    def __init__(self):
+        self.blobs: dict[str, FakeBlob] = {}
+        self.listed_pages = 0
+        self.uploads = 0
+
+    def get_blob_client(self, name: str) -> FakeBlobClient:
+        return FakeBlobClient(self, name)
+
+    def upload_blob(self, name: str, data: bytes, metadata: dict, overwrite: bool = False) -> None:
+        if name in self.blobs and not overwrite:
+            raise ResourceExistsError(name)
+        self.uploads += 1
+        self.blobs[name] = FakeBlob(metadata)
+
+    def list_blobs(self, name_starts_with: str, results_per_page: Optional[int] = None) -> Iterator[SimpleNamespace]:
+        page_size, marker = results_per_page or self.page_size, ""
+        while True:
+            self.listed_pages += 1
+            page = sorted(name for name in self.blobs if name.startswith(name_starts_with) and name > marker)
+            for name in page[:page_size]:
+                yield SimpleNamespace(name=name, lease=SimpleNamespace(state=self.blobs[name].lease_state))
+            if len(page) <= page_size:
+                return
+            marker = page[page_size - 1]
+
+
+class FakeBlobCoordinatorBackend(BlobCoordinatorBackend):
+    def _lease(self, shard: str, owner: str) -> FakeLease:
+        return FakeLease(self.container_client.get_blob_client(self._name(shard)), self._lease_id(shard, owner))
+
+
+BLOB_SHARDS = [f"4719388{i:02d}/2020-01-01/" for i in range(40)]
+
+
+def test_blob_backend_lists_the_pending_shards_once():
+    container = FakeContainerClient()
+    backend = FakeBlobCoordinatorBackend(container, "_shards/test/", batch_size=16)
+    coordinator = WorkCoordinator(backend, "worker", max_shards=len(BLOB_SHARDS), poll_interval=0)
+    coordinator.register(BLOB_SHARDS)
+    assert container.listed_pages == 0 and container.uploads == len(BLOB_SHARDS) + 1
+    assert "_shards/test/pending/471938800%2F2020-01-01%2F" in container.blobs
+
+    acquired = []
+    while (shard := coordinator.acquire()) is not None:
+        acquired.append(shard)
+    assert sorted(acquired) == BLOB_SHARDS
+    # the listing of the pending shards continues where the previous acquire stopped
+    assert container.listed_pages == len(BLOB_SHARDS) // container.page_size
+
+    # the shards leased by a worker are still pending, one page of one blob tells
+    assert coordinator.has_unfinished() and container.listed_pages == len(BLOB_SHARDS) // container.page_size + 1
+    for shard in acquired:
+        coordinator.complete(shard)
+    assert not coordinator.has_unfinished() and container.listed_pages == len(BLOB_SHARDS) // container.page_size + 2
+    assert backend.progress() == {"pending": 0, "done": len(BLOB_SHARDS), "failed": 0, "leased": 0}
+
+
+def test_blob_backend_moves_failed_shards():
+    container = FakeContainerClient()
+    backend = FakeBlobCoordinatorBackend(container, "_shards/test/", max_attempts=2)
+    backend.add_shards(BLOB_SHARDS[:2])
+    coordinator = WorkCoordinator(backend, "worker", max_shards=2, poll_interval=0)
+    assert coordinator.acquire() == BLOB_SHARDS[0]
+    coordinator.fail(BLOB_SHARDS[0])
+    assert coordinator.acquire() == BLOB_SHARDS[1]
+    # the failed shard is retried once the pending shards are listed again, from the start
+    assert coordinator.acquire() is None
+    assert coordinator.acquire() == BLOB_SHARDS[0]
+    coordinator.fail(BLOB_SHARDS[0])
+    assert container.blobs["_shards/test/failed/471938800%2F2020-01-01%2F"].metadata == {"attempts": "2"}
+    assert backend.progress() == {"pending": 1, "done": 0, "failed": 1, "leased": 1}
+    coordinator.close()
+    assert backend.progress() == {"pending": 1, "done": 0, "failed": 1, "leased": 0}
+
+
+def test_blob_backend_registers_the_shards_once():
+    container = FakeContainerClient()
+    backend = FakeBlobCoordinatorBackend(container, "_shards/test/", batch_size=16)
+    backend.add_shards(BLOB_SHARDS)
+    assert container.uploads == len(BLOB_SHARDS) + 1
+    FakeBlobCoordinatorBackend(container, "_shards/test/").add_shards(BLOB_SHARDS)
+    assert container.uploads == len(BLOB_SHARDS) + 1  # registered by the first worker
+
+    # a registration that is in progress is left to the other worker, its shards are still to come
+    container = FakeContainerClient()
+    container.upload_blob("_shards/test/registration", b"", metadata={"registered": "16", "complete": "false"})
+    backend = FakeBlobCoordinatorBackend(container, "_shards/test/", batch_size=16)
+    backend.add_shards(BLOB_SHARDS)
+    assert container.uploads == 1 and backend.has_pending()
+
+    # a registration that stopped is resumed after the shards that were registered
+    registration = container.blobs["_shards/test/registration"]
+    registration.last_modified -= timedelta(seconds=backend.REGISTRATION_TIMEOUT)
+    backend.add_shards(BLOB_SHARDS)
+    assert container.uploads == 1 + len(BLOB_SHARDS) - 16
+    assert registration.metadata == {"registered": str(len(BLOB_SHARDS)), "complete": "true"}
+    assert backend.progress()["pending"] == len(BLOB_SHARDS) - 16
+
+
+def test_shards_are_leased_while_they_are_registered(tmp_path):
+    read_more = threading.Event()
+
+    def read_shards():
+        # e.g. a VAT file that is read lazily
+        yield from SHARDS[:2]
+        read_more.wait(5)
+        yield from SHARDS[2:]
+
+    backend = SqliteCoordinatorBackend(tmp_path / "coordinator.sqlite", "test", batch_size=2)
+    coordinator = WorkCoordinator(backend, "worker", max_shards=10, poll_interval=0)
+    registration = threading.Thread(target=coordinator.register, args=(read_shards(),))
+    registration.start()
+    while coordinator.acquire() is None:
+        time.sleep(0.01)
+    assert coordinator.registering and coordinator.has_unfinished()
+    read_more.set()
+    registration.join()
+    while coordinator.acquire() is not None:
+        pass
+    assert sorted(coordinator.held) == SHARDS and not coordinator.registering
@@ -0,0 +1,113 @@
+import asyncio
+import gzip
+import io
+import json
+from unittest import mock
+
+import pytest
+
+from src.dataset import COLUMNS, DatasetWriter, encode_shard, read_manifest
+from src.storage import LocalBlobStore, ThreadedBlobStore
+
+
+def publication(i: int, publication_date: str = "2024-05-01") -> dict:
+    return {
+        "vat": f"{i:010d}",
+        "publication_number": f"{i:07d}",
+        "publication_date": publication_date,
+        "text": "x" * 10,
+    }
+
+
+def read_jsonl(data: bytes) -> list[dict]:
+    return [json.loads(line) for line in gzip.decompress(data).splitlines()]
+
+
+def test_encode_jsonl():
+    rows = [publication(1), {"vat": "0471938850", "unknown": 1}]
+    decoded = read_jsonl(encode_shard(rows, "jsonl", "gzip"))
+    assert [list(row) for row in decoded] == [list(COLUMNS)] * 2
+    assert decoded[0]["vat"] == "0000000001" and decoded[1]["text"] is None
+
+
+def test_encode_parquet():
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pq.read_table(io.BytesIO(encode_shard([publication(1)], "parquet", "zstd")))
+    assert table.column_names == list(COLUMNS) and table.num_rows == 1
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        encode_shard([], "csv", None)
+    with pytest.raises(ValueError):
+        DatasetWriter(ThreadedBlobStore(LocalBlobStore(tmp_path)), file_format="csv")
+
+
+def test_missing_dependencies_fail_when_the_writer_is_created(tmp_path):
+    with mock.patch.dict("sys.modules", {"pyarrow": None, "pyarrow.parquet": None, "zstandard": None}):
+        for file_format, compression in (("parquet", None), ("jsonl", "zstd")):
+            with pytest.raises(ImportError):
+                DatasetWriter(
+                    ThreadedBlobStore(LocalBlobStore(tmp_path)), file_format=file_format, compression=compression
+                )
+
+
+def test_writer(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    publications = [publication(i, f"2024-0{1 + i % 2}-01") for i in range(25)] + [publication(99, None)]
+
+    async def write():
+        writer = DatasetWriter(
+            ThreadedBlobStore(store), file_format="jsonl", compression="gzip", max_rows=5, run_id="r"
+        )
+        for row in publications:
+            await writer.add(row)
+        await writer.close()
+        return writer
+
+    writer = asyncio.run(write())
+    shards = read_manifest(store)
+    assert writer.num_rows == sum(shard["rows"] for shard in shards) == len(publications)
+    assert {shard["partition"] for shard in shards} == {
+        "year=2024/month=01",
+        "year=2024/month=02",
+        "year=unknown/month=unknown",
+    }
+    assert all(shard["rows"] <= 5 for shard in shards)
+    rows = [row for shard in shards for row in read_jsonl(store.read(shard["name"]))]
+    assert sorted(row["vat"] for row in rows) == sorted(row["vat"] for row in publications)
+    assert shards[0]["name"] == "_dataset/year=2024/month=01/part-r-00000.jsonl.gz"
+
+
+def test_a_failed_encoding_keeps_the_publications_buffered(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    async def write():
+        writer = DatasetWriter(ThreadedBlobStore(store), file_format="jsonl", compression="gzip", max_rows=3)
+        with mock.patch("src.dataset.encode_shard", side_effect=MemoryError):
+            await writer.add(publication(0))
+            await writer.add(publication(1))
+            with pytest.raises(MemoryError):
+                await writer.add(publication(2))  # the shard is full
+        assert writer.buffered_bytes > 0
+        await writer.close()
+
+    asyncio.run(write())
+    assert sum(shard["rows"] for shard in read_manifest(store)) == 3
+
+
+def test_read_manifest_combines_the_runs(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    async def write(run_id, publications):
+        writer = DatasetWriter(ThreadedBlobStore(store), file_format="jsonl", compression="gzip", run_id=run_id)
+        for row in publications:
+            await writer.add(row)
+        await writer.close()
+
+    asyncio.run(write("first", [publication(1)]))
+    asyncio.run(write("second", [publication(2), publication(3)]))
+    # a shard without manifest (e.g. of a run that crashed) is ignored
+    store.write("_dataset/year=2024/month=05/part-crashed-00000.jsonl.gz", gzip.compress(b"{}\n"))
+    shards = read_manifest(store)
+    assert [(shard["run_id"], shard["rows"]) for shard in shards] == [("first", 1), ("second", 2)]
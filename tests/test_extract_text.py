@@ -0,0 +1,240 @@
+import asyncio
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from statistics import mode
+from types import SimpleNamespace
+
+import pymupdf
+import pytest
+
+from benchmarks.fixtures import PDFS, LocalDocumentAnalysisClient, digital_pdfs, scanned_pdfs, synthesize_ocr_result
+from src.extract_text import (
+    PAGE_0_REL_COORDS,
+    PAGE_N_REL_COORDS,
+    OcrCrop,
+    _textbox,
+    create_executor,
+    extract_text,
+    extract_text_digital,
+    is_scan,
+    join_lines,
+    layout_page,
+    ocr_pdf,
+)
+from src.ocr import OCR_MODEL_ID, OcrCache, OcrClient
+
+
+def reference_layout(ocr_pages, scan_pages) -> str:
+    """the line by line layout of the OCR'ed pages that layout_page and join_lines replace"""
+    text = ""
+    for ocr_page, scan_page in zip(ocr_pages, scan_pages):
+        _, _, width, height = scan_page.rect
+        sf_x, sf_y = width / ocr_page.width, height / ocr_page.height
+        line_coords = [[point.y for point in line.polygon] for line in ocr_page.lines]
+        line_height = mode([max(coords) - min(coords) for coords in line_coords]) * sf_y
+        rel_coords = PAGE_0_REL_COORDS if scan_page.number == 0 else PAGE_N_REL_COORDS
+        crop = (rel_coords[0] * width, rel_coords[1] * height, rel_coords[2] * width, rel_coords[3] * height)
+        lines = sorted(ocr_page.lines, key=lambda l: (min(p.y for p in l.polygon), min(p.x for p in l.polygon)))  # noqa
+        py0 = py1 = None
+        for line in lines:
+            x_coords = [point.x for point in line.polygon]
+            y_coords = [point.y for point in line.polygon]
+            x0, y0, x1, y1 = min(x_coords) * sf_x, min(y_coords) * sf_y, max(x_coords) * sf_x, max(y_coords) * sf_y
+            same_line = bool(
+                py0
+                and py1
+                and abs(py0 - y0) / y0 <= 0.05
+                and abs(py1 - y1) / y1 <= 0.05
+                and (max(y1, py1) - min(y0, py0)) <= line_height * 1.25
+            )
+            if not (crop[0] <= x0 and x1 <= crop[2] and crop[1] <= y0 and y1 <= crop[3]):
+                continue
+            if same_line:
+                text += "\t" + line.content
+            elif not text or text.endswith("\n") or line.content.startswith("\n"):
+                text += line.content
+            else:
+                text += "\n" + line.content
+            py0, py1 = y0, y1
+    return text
+
+
+def layout(ocr_pages, scan_pages) -> str:
+    return join_lines(layout_page(ocr_page, scan_page) for ocr_page, scan_page in zip(ocr_pages, scan_pages))
+
+
+def random_page(rng: random.Random) -> SimpleNamespace:
+    """an OCR'ed page in inches with lines on the same row, duplicate coordinates and polygons of 3 to 5 points"""
+    width, height = 8.27, 11.69
+    lines = []
+    for _ in range(rng.randint(1, 80)):
+        x = round(rng.uniform(0, width), rng.choice([1, 2, 6]))
+        y = round(rng.uniform(0, height), rng.choice([1, 2, 6]))
+        if lines and rng.random() < 0.3:
+            y = lines[-1].polygon[0].y + rng.choice([0, 0.01, 0.2])
+        w, h = rng.uniform(0.2, 4), rng.choice([0.15, 0.15, 0.16, 0.3, rng.uniform(0.1, 0.4)])
+        points = [(x, y), (x + w, y + rng.choice([0, 0.01])), (x + w, y + h), (x, y + h), (x + w / 2, y + h / 2)]
+        polygon = [SimpleNamespace(x=px, y=py) for px, py in points[: rng.choice([4, 4, 4, 3, 5])]]
+        content = rng.choice(["abc", "", "\nx", "y\n", "Ondernemingsnr", "z"])
+        lines.append(SimpleNamespace(content=content, polygon=polygon))
+    return SimpleNamespace(width=width, height=height, lines=lines)
+
+
+def test_layout_matches_the_reference_on_random_pages():
+    rng = random.Random(1)
+    num_pages = 0
+    while num_pages < 3000:
+        ocr_pages = [random_page(rng) for _ in range(rng.randint(1, 4))]
+        scan_pages = [SimpleNamespace(rect=(0, 0, 595.0, 842.0), number=number) for number in range(len(ocr_pages))]
+        assert layout(ocr_pages, scan_pages) == reference_layout(ocr_pages, scan_pages)
+        num_pages += len(ocr_pages)
+
+
+@pytest.mark.parametrize("path", scanned_pdfs(), ids=lambda path: path.name)
+def test_layout_matches_the_reference_on_the_scans(path):
+    with pymupdf.open(path) as scan, pymupdf.open(digital_pdfs()[0]) as digital:
+        ocr_pages = synthesize_ocr_result(scan, digital).pages
+        text = layout(ocr_pages, scan)
+        assert text and text == reference_layout(ocr_pages, scan)
+
+
+def test_layout_of_an_empty_page():
+    page = SimpleNamespace(width=8.27, height=11.69, lines=[])
+    assert layout_page(page, SimpleNamespace(rect=(0, 0, 595.0, 842.0), number=0)) == ([], [])
+
+
+@pytest.fixture(scope="module", params=[None, "thread", "process"])
+def executor(request):
+    executor = create_executor(request.param, max_workers=2)
+    yield executor
+    if executor is not None:
+        executor.shutdown()
+
+
+@pytest.mark.parametrize("path", PDFS, ids=lambda path: path.name)
+def test_fast_textbox_matches_get_textbox(path):
+    with pymupdf.open(path) as pdf:
+        for page in pdf:
+            clip = (page.rect.width * 0.1, page.rect.height * 0.2, page.rect.width * 0.9, page.rect.height * 0.8)
+            assert _textbox(page, clip) == page.get_textbox(clip)
+        assert extract_text_digital(pdf, fast=True) == extract_text_digital(pdf)
+
+
+@pytest.mark.parametrize("path", PDFS, ids=lambda path: path.name)
+def test_is_scan(path):
+    with pymupdf.open(path) as pdf:
+        assert is_scan(pdf) == (path in scanned_pdfs()) == (not extract_text_digital(pdf))
+
+
+@pytest.mark.parametrize("split_pages", [None, 1, 2])
+@pytest.mark.parametrize("path", PDFS, ids=lambda path: path.name)
+def test_fast_extraction_matches_the_extraction(path, executor, split_pages):
+    with pymupdf.open(path) as pdf:
+        expected = extract_text_digital(pdf)
+
+    for source in (path, path.read_bytes()):
+        text, is_digital = asyncio.run(
+            extract_text(source, do_ocr=False, executor=executor, fast=True, split_pages=split_pages)
+        )
+        assert (text, is_digital) == ((expected, True) if expected else (None, False))
+
+
+def test_create_executor():
+    assert create_executor(None) is None
+    thread_pool = create_executor("thread", max_workers=4)
+    process_pool = create_executor("process", max_workers=3)
+    try:
+        # pymupdf is not thread safe, the thread pool has a single worker
+        assert isinstance(thread_pool, ThreadPoolExecutor) and thread_pool._max_workers == 1
+        assert isinstance(process_pool, ProcessPoolExecutor) and process_pool._max_workers == 3
+    finally:
+        thread_pool.shutdown()
+        process_pool.shutdown()
+    with pytest.raises(ValueError):
+        create_executor("gpu")
+
+
+@pytest.mark.parametrize("path", PDFS, ids=lambda path: path.name)
+def test_extraction_in_the_executor_matches_the_extraction(path, executor):
+    with pymupdf.open(path) as pdf:
+        expected = extract_text_digital(pdf)
+        # a pymupdf.Document cannot be sent to another process, it is extracted in the event loop
+        for source in (path, path.read_bytes(), pdf):
+            text, is_digital = asyncio.run(extract_text(source, do_ocr=False, executor=executor))
+            assert (text, is_digital) == ((expected, True) if expected else (None, False))
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_scans_extracted_in_the_executor_are_ocred(tmp_path, executor, fast):
+    path = scanned_pdfs()[0]
+    with pymupdf.open(path) as scan, pymupdf.open(digital_pdfs()[0]) as digital:
+        result = synthesize_ocr_result(scan, digital)
+        expected = layout(result.pages, scan)
+    LocalDocumentAnalysisClient.record(tmp_path, path.read_bytes(), result)
+
+    text, is_digital = asyncio.run(
+        extract_text(path, executor=executor, ocr_client=OcrClient(LocalDocumentAnalysisClient(tmp_path)), fast=fast)
+    )
+    assert (text, is_digital) == (expected, False)
+
+
+def cropped_ocr_page(ocr_page, region: tuple[float, float, float, float]) -> SimpleNamespace:
+    """the OCR result of the region of the page: only the lines within the region, relative to the region"""
+    rx0, ry0, rx1, ry1 = (value / 72 for value in region)  # points to inch
+
+    def within(line):
+        return all(rx0 <= point.x <= rx1 and ry0 <= point.y <= ry1 for point in line.polygon)
+
+    lines = [
+        SimpleNamespace(
+            content=line.content, polygon=[SimpleNamespace(x=point.x - rx0, y=point.y - ry0) for point in line.polygon]
+        )
+        for line in ocr_page.lines
+        if within(line)
+    ]
+    return SimpleNamespace(width=rx1 - rx0, height=ry1 - ry0, lines=lines)
+
+
+@pytest.mark.parametrize("path", scanned_pdfs(), ids=lambda path: path.name)
+def test_layout_of_the_cropped_region_matches_the_layout_of_the_page(path):
+    crop = OcrCrop()
+    with pymupdf.open(path) as scan, pymupdf.open(digital_pdfs()[0]) as digital:
+        ocr_pages = synthesize_ocr_result(scan, digital).pages
+        expected = layout(ocr_pages, scan)
+        regions = [crop.region(scan_page) for scan_page in scan]
+        text = join_lines(
+            layout_page(cropped_ocr_page(ocr_page, region), scan_page, region)
+            for ocr_page, scan_page, region in zip(ocr_pages, scan, regions)
+        )
+        assert text == expected
+
+
+@pytest.mark.parametrize("crop", [OcrCrop(), OcrCrop(dpi=100)], ids=["crop box", "100 dpi"])
+@pytest.mark.parametrize("path", scanned_pdfs(), ids=lambda path: path.name)
+def test_crop(path, crop):
+    with pymupdf.open(path) as scan, pymupdf.open(stream=crop.apply(path.read_bytes()), filetype="pdf") as cropped:
+        assert cropped.page_count == scan.page_count
+        for scan_page, cropped_page in zip(scan, cropped):
+            x0, y0, x1, y1 = crop.region(scan_page)
+            assert cropped_page.rect.width == pytest.approx(x1 - x0, abs=0.5)
+            assert cropped_page.rect.height == pytest.approx(y1 - y0, abs=0.5)
+
+
+def test_ocr_pdf_submits_the_cropped_pdf(tmp_path):
+    crop = OcrCrop()
+    path = scanned_pdfs()[0]
+    pdf_bytes = path.read_bytes()
+    with pymupdf.open(path) as scan, pymupdf.open(digital_pdfs()[0]) as digital:
+        result = synthesize_ocr_result(scan, digital)
+    # only the cropped pdf has a recorded result
+    LocalDocumentAnalysisClient.record(tmp_path / "results", crop.apply(pdf_bytes), result)
+    local = LocalDocumentAnalysisClient(tmp_path / "results")
+    cache = OcrCache(tmp_path / "cache")
+
+    with pymupdf.open(path) as scan:
+        ocred = asyncio.run(ocr_pdf(scan, None, None, OcrClient(local), cache, pdf_bytes, crop))
+        assert len(ocred.pages) == len(result.pages)
+        asyncio.run(ocr_pdf(scan, None, None, OcrClient(local), cache, pdf_bytes, crop))
+    assert local.num_requests == 1
+    assert asyncio.run(cache.get(OcrCache.key(pdf_bytes, f"{OCR_MODEL_ID}-{crop.variant}"))) is not None
+    assert asyncio.run(cache.get(OcrCache.key(pdf_bytes))) is None
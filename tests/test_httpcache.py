@@ -0,0 +1,165 @@
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from benchmarks.fixtures import LISTING_PAGE, PDFS
+from src.httpcache import STORED_AT_HEADER, BelgianJournalCachePolicy, CompressedSqliteCacheStorage, classify_url
+
+BASE_URL = "https://www.ejustice.just.fgov.be"
+SETTLED_BEFORE = date(2024, 7, 1)
+
+
+@pytest.mark.parametrize(
+    "url, kind",
+    [
+        (f"{BASE_URL}/tsv_pdf/2024/07/11/24104762.pdf", "pdf"),
+        (f"{BASE_URL}/cgi_tsv/rech_res.pl?language=nl&pdd=2024-06-01&pdf=2024-06-14", "settled"),
+        (f"{BASE_URL}/cgi_tsv/list.pl?language=nl&page=2&pdd=2024-06-01&pdf=2024-06-14", "settled"),
+        (f"{BASE_URL}/cgi_tsv/rech_res.pl?language=nl&pdd=2024-06-20&pdf=2024-07-01", "recent"),
+        (f"{BASE_URL}/cgi_tsv/rech_res.pl?language=nl&btw=471938850", "recent"),
+        (f"{BASE_URL}/cgi_tsv/rech_res.pl?language=nl&pdf=not-a-date", "recent"),
+        (f"{BASE_URL}/robots.txt", "other"),
+        (f"{BASE_URL}/tsv_pdf/2024/07/11/", "other"),
+    ],
+)
+def test_classify_url(url, kind):
+    assert classify_url(url, SETTLED_BEFORE) == kind
+
+
+def settled_listing_url(days_ago: int = 30) -> str:
+    end_date = date.today() - timedelta(days=days_ago)
+    return f"{BASE_URL}/cgi_tsv/rech_res.pl?language=nl&pdd={end_date}&pdf={end_date}"
+
+
+def cached_response(url: str, age: float, **headers) -> Response:
+    headers = {STORED_AT_HEADER: str(time.time() - age), **headers}
+    return HtmlResponse(url=url, headers=headers, body=b"<html></html>")
+
+
+def policy(**settings) -> BelgianJournalCachePolicy:
+    return BelgianJournalCachePolicy(Settings({"HTTPCACHE_SETTLED_DAYS": 7, **settings}))
+
+
+def test_policy_caches_successful_get_requests():
+    cache_policy = policy()
+    request = Request(settled_listing_url())
+    assert cache_policy.should_cache_request(request)
+    assert not cache_policy.should_cache_request(request.replace(method="POST"))
+    assert not cache_policy.should_cache_request(Request("file:///tmp/page.html"))
+    assert cache_policy.should_cache_response(HtmlResponse(request.url, status=200), request)
+    assert not cache_policy.should_cache_response(HtmlResponse(request.url, status=404), request)
+    assert not policy(HTTPCACHE_IGNORE_HTTP_CODES=[200]).should_cache_response(HtmlResponse(request.url), request)
+
+
+def test_pdfs_are_always_fresh():
+    url = f"{BASE_URL}/tsv_pdf/2024/07/11/24104762.pdf"
+    assert policy(HTTPCACHE_RECENT_TTL=0).is_cached_response_fresh(cached_response(url, 10 * 365 * 86400), Request(url))
+
+
+def test_settled_listings_expire_after_the_settled_ttl():
+    request = Request(settled_listing_url())
+    cache_policy = policy(HTTPCACHE_SETTLED_TTL=3600)
+    assert cache_policy.is_cached_response_fresh(cached_response(request.url, 60), request)
+    assert not cache_policy.is_cached_response_fresh(cached_response(request.url, 7200), request)
+    # a TTL of 0 keeps settled listings forever
+    assert policy(HTTPCACHE_SETTLED_TTL=0).is_cached_response_fresh(cached_response(request.url, 7200), request)
+
+
+def test_recent_listings_expire_after_the_recent_ttl():
+    # the end date is within HTTPCACHE_SETTLED_DAYS, new publications can still be added to the listing
+    request = Request(settled_listing_url(days_ago=2))
+    assert not policy(HTTPCACHE_RECENT_TTL=0).is_cached_response_fresh(cached_response(request.url, 1), request)
+    assert policy(HTTPCACHE_RECENT_TTL=600).is_cached_response_fresh(cached_response(request.url, 60), request)
+    assert not policy(HTTPCACHE_RECENT_TTL=600).is_cached_response_fresh(cached_response(request.url, 900), request)
+
+    vat_request = Request(f"{BASE_URL}/cgi_tsv/rech_res.pl?language=nl&btw=471938850")
+    cache_policy = policy(HTTPCACHE_SETTLED_TTL=0, HTTPCACHE_RECENT_TTL=600)
+    assert not cache_policy.is_cached_response_fresh(cached_response(vat_request.url, 900), vat_request)
+
+
+def test_expired_responses_are_revalidated():
+    request = Request(f"{BASE_URL}/cgi_tsv/rech_res.pl?language=nl&btw=471938850")
+    cached = cached_response(request.url, 900, ETag='"abc"', **{"Last-Modified": "Thu, 11 Jul 2024 08:00:00 GMT"})
+    cache_policy = policy(HTTPCACHE_RECENT_TTL=600)
+    assert not cache_policy.is_cached_response_fresh(cached, request)
+    assert request.headers[b"If-None-Match"] == b'"abc"'
+    assert request.headers[b"If-Modified-Since"] == b"Thu, 11 Jul 2024 08:00:00 GMT"
+
+    # the cached response is used when the server answers 304 Not Modified
+    assert cache_policy.is_cached_response_valid(cached, HtmlResponse(request.url, status=304), request)
+    assert not cache_policy.is_cached_response_valid(cached, HtmlResponse(request.url, status=200), request)
+
+    # without validators the request is unconditional
+    request = Request(request.url)
+    assert not cache_policy.is_cached_response_fresh(cached_response(request.url, 900), request)
+    assert b"If-None-Match" not in request.headers and b"If-Modified-Since" not in request.headers
+
+
+def storage(tmp_path, max_bytes: int = 0) -> tuple[CompressedSqliteCacheStorage, SimpleNamespace]:
+    spider = SimpleNamespace(name="legal-entity-date-spider", crawler=get_crawler())
+    cache_storage = CompressedSqliteCacheStorage(
+        Settings({"HTTPCACHE_DIR": str(tmp_path / "httpcache"), "HTTPCACHE_MAX_BYTES": max_bytes})
+    )
+    cache_storage.open_spider(spider)
+    return cache_storage, spider
+
+
+def responses() -> list[Response]:
+    listing = HtmlResponse(
+        url=settled_listing_url(),
+        headers={"Content-Type": "text/html; charset=utf-8", "Set-Cookie": ["a=1", "b=2"]},
+        body=LISTING_PAGE.read_bytes(),
+    )
+    pdf = Response(
+        url=f"{BASE_URL}/tsv_pdf/2024/07/11/24104762.pdf",
+        headers={"Content-Type": "application/pdf"},
+        body=PDFS[0].read_bytes(),
+    )
+    return [listing, pdf]
+
+
+def test_storage_round_trip(tmp_path):
+    cache_storage, spider = storage(tmp_path)
+    for response in responses():
+        cache_storage.store_response(spider, Request(response.url), response)
+    assert cache_storage.retrieve_response(spider, Request(f"{BASE_URL}/robots.txt")) is None
+    cache_storage.close_spider(spider)
+
+    # the responses are kept across runs
+    before = time.time()
+    cache_storage, spider = storage(tmp_path)
+    for response in responses():
+        cached = cache_storage.retrieve_response(spider, Request(response.url))
+        assert type(cached) is type(response)
+        assert (cached.url, cached.status, cached.body) == (response.url, response.status, response.body)
+        assert cached.headers.getlist("Set-Cookie") == response.headers.getlist("Set-Cookie")
+        assert cached.headers["Content-Type"] == response.headers["Content-Type"]
+        assert float(cached.headers[STORED_AT_HEADER]) <= before
+    cache_storage.close_spider(spider)
+
+
+def test_storage_evicts_the_least_recently_used_responses(tmp_path):
+    listing, pdf = responses()
+    cache_storage, spider = storage(tmp_path)
+    cache_storage.store_response(spider, Request(listing.url), listing)
+    listing_size = cache_storage._size
+    assert listing_size < len(listing.body)  # stored compressed
+    cache_storage.store_response(spider, Request(pdf.url), pdf)
+    pdf_size = cache_storage._size - listing_size
+    cache_storage.close_spider(spider)
+
+    cache_storage, spider = storage(tmp_path, max_bytes=listing_size + pdf_size)
+    assert cache_storage._size == listing_size + pdf_size
+    cache_storage.retrieve_response(spider, Request(listing.url))  # the pdf is now the least recently used
+    # storing the same response again replaces it and does not grow the cache
+    cache_storage.store_response(spider, Request(listing.url), listing)
+    assert cache_storage._size == listing_size + pdf_size
+    cache_storage.store_response(spider, Request(f"{listing.url}&page=2"), listing)
+    assert cache_storage.retrieve_response(spider, Request(pdf.url)) is None
+    assert cache_storage.retrieve_response(spider, Request(listing.url)) is not None
+    cache_storage.close_spider(spider)
@@ -0,0 +1,83 @@
+from datetime import date
+
+import pytest
+
+from src.index import INDEX_MAGIC, PublicationIndex, parse_blob_name
+from src.storage import MemoryBlobStore
+
+NAMES = [
+    "0471938850/2024/07/11/0104762.json",
+    "0471938850/2023/01/02/0001234.json",
+    "0203201340/2024/02/30/0000001.json",  # invalid date
+    "_publication_index.bin",
+    "0471938850/2024/07/11/0104762.pdf",
+]
+
+
+def test_parse_blob_name():
+    assert parse_blob_name(NAMES[0]) == ("0471938850", "0104762", date(2024, 7, 11))
+    assert parse_blob_name(NAMES[2]) == ("0203201340", "0000001", None)
+    assert parse_blob_name(NAMES[3]) is None
+    assert parse_blob_name(NAMES[4]) is None
+
+
+def test_from_blob_names():
+    index = PublicationIndex.from_blob_names(NAMES)
+    assert len(index) == 3
+    assert ("0471938850", "0104762") in index
+    assert ("0471938850", "0104763") not in index
+    assert index.num_vats == 2
+    assert index.last_publication_date("0471938850") == date(2024, 7, 11)
+    assert index.last_publication_date("0203201340") is None
+    assert not index.has_vat("0000000000")
+
+
+def test_add():
+    index = PublicationIndex.from_blob_names(NAMES)
+    index.add("0471938850", "0104762", date(2024, 7, 11))  # already indexed
+    index.add("0471938850", "0200000", date(2025, 1, 1))
+    index.add("0999999999", "0000001")
+    assert len(index) == 5
+    assert ("0471938850", "0200000") in index
+    assert index.num_vats == 3
+    assert index.last_publication_date("0471938850") == date(2025, 1, 1)
+    index.add("0471938850", "0100000", date(2020, 1, 1))
+    assert index.last_publication_date("0471938850") == date(2025, 1, 1)
+
+
+def test_bytes_round_trip():
+    index = PublicationIndex.from_blob_names(NAMES)
+    index.add("0999999999", "0000001", date(2024, 1, 1))
+    loaded = PublicationIndex.from_bytes(index.to_bytes())
+    assert len(loaded) == len(index)
+    assert ("0999999999", "0000001") in loaded
+    assert loaded.last_publication_date("0999999999") == date(2024, 1, 1)
+    assert loaded.last_publication_date("0471938850") == date(2024, 7, 11)
+
+
+def test_load_builds_the_index_from_the_store():
+    store = MemoryBlobStore()
+    for name in NAMES:
+        store.write(name, b"{}")
+    index = PublicationIndex.load(store, "_publication_index.bin.missing")
+    assert len(index) == 3
+
+
+def test_unknown_versions_are_rejected():
+    data = PublicationIndex.from_blob_names(NAMES).to_bytes()
+    for invalid in (b"XXXX" + data[4:], INDEX_MAGIC + bytes([1]) + data[5:], INDEX_MAGIC + bytes([3]) + data[5:]):
+        with pytest.raises(ValueError):
+            PublicationIndex.from_bytes(invalid)
+
+
+def test_save_keeps_publications_of_other_runs():
+    store = MemoryBlobStore()
+    first, second = PublicationIndex(), PublicationIndex()
+    first.add("0471938850", "0000001", date(2024, 1, 1))
+    first.save(store, "_index.bin")
+    second.add("0471938850", "0000002", date(2024, 2, 1))
+    second.save(store, "_index.bin")
+
+    index = PublicationIndex.load(store, "_index.bin")
+    assert ("0471938850", "0000001") in index and ("0471938850", "0000002") in index
+    assert index.last_publication_date("0471938850") == date(2024, 2, 1)
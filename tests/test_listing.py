@@ -0,0 +1,178 @@
+from dataclasses import fields, replace
+from datetime import date
+
+import lxml.html
+import pytest
+from scrapy.http import HtmlResponse
+
+from benchmarks.fixtures import LISTING_PAGE, LISTING_XPATH, listing_page
+from src.listing import (
+    extract_address,
+    extract_publication_date_and_number,
+    parse_listing,
+    parse_num_results,
+    parse_page_number,
+)
+from src.items import PublicationRecord
+
+BASE_URL = "https://www.ejustice.just.fgov.be"
+EY_CONSULTING = {
+    "company_name": "ERNST & YOUNG CONSULTING, AFGEKORT : EY CONSULTING",
+    "company_juridical_form": "BV",
+    "address": "KOUTERVELDSTRAAT 7B BUS 001 1831 DIEGEM (MACHELEN)",
+    "vat": "471938850",
+    "street": "KOUTERVELDSTRAAT 7B BUS 001",
+    "zipcode": "1831",
+    "city": "DIEGEM (MACHELEN)",
+}
+# records of page.html by position, the publications of EY consulting
+EXPECTED_RECORDS = {
+    0: PublicationRecord(
+        pdf_relative_url="/tsv_pdf/2024/07/11/24104762.pdf",
+        pdf_absolute_url=f"{BASE_URL}/tsv_pdf/2024/07/11/24104762.pdf",
+        pubid="24104762",
+        company_name="ERNST  &  YOUNG CONSULTING (VERKORT) EY CONSULTING",
+        company_juridical_form="",
+        address="",
+        vat="471938850",
+        act_description="",
+        street=None,
+        zipcode=None,
+        city=None,
+        publication_date=date(2024, 7, 11),
+        publication_number="0104762",
+    ),
+    1: PublicationRecord(
+        pdf_relative_url="/tsv_pdf/2024/05/08/24071723.pdf",
+        pdf_absolute_url=f"{BASE_URL}/tsv_pdf/2024/05/08/24071723.pdf",
+        pubid="24071723",
+        act_description="KAPITAAL - AANDELEN -  RUBRIEK HERSTRUCTURERING (FUSIE, SPLITSING, OVERDRACHT VERMOGEN, ENZ...)",
+        publication_date=date(2024, 5, 8),
+        publication_number="0071723",
+        **EY_CONSULTING,
+    ),
+    2: PublicationRecord(
+        pdf_relative_url="/tsv_pdf/2024/04/25/24066518.pdf",
+        pdf_absolute_url=f"{BASE_URL}/tsv_pdf/2024/04/25/24066518.pdf",
+        pubid="24066518",
+        act_description="ONTSLAGEN - BENOEMINGEN",
+        publication_date=date(2024, 4, 25),
+        publication_number="0066518",
+        **EY_CONSULTING,
+    ),
+    99: PublicationRecord(
+        pdf_relative_url="/tsv_pdf/2004/06/17/04089237.pdf",
+        pdf_absolute_url=f"{BASE_URL}/tsv_pdf/2004/06/17/04089237.pdf",
+        pubid="04089237",
+        company_name="ERNST & YOUNG SPECIAL BUSINESS SERVICES",
+        company_juridical_form="CVBA",
+        address="MARCEL THIRYLAAN.204 1200 SINT-LAMBRECHTS-WOLUWE",
+        vat="471938850",
+        act_description="ONTSLAGEN - BENOEMINGEN",
+        street="MARCEL THIRYLAAN.204",
+        zipcode="1200",
+        city="SINT-LAMBRECHTS-WOLUWE",
+        publication_date=date(2004, 6, 17),
+        publication_number="0089237",
+    ),
+}
+NO_RECORD = PublicationRecord(
+    **{field.name: None for field in fields(PublicationRecord)} | {"company_juridical_form": ""}
+)
+
+
+def response(body: bytes) -> HtmlResponse:
+    return HtmlResponse(url=f"{BASE_URL}/cgi_tsv/rech_res.pl", body=body, encoding="utf-8")
+
+
+def reference_fields(body: bytes) -> list[tuple]:
+    """the fields of every publication element with the relative XPath queries that parse_listing replaces"""
+    fields = []
+    for element in response(body).xpath(LISTING_XPATH):
+        urls = [url for url in element.xpath("./div//a/@href").getall() if url.endswith(".pdf")]
+        company_name = element.xpath("./div/p/font/text()").get()
+        company_juridical_form = element.xpath("./div/p/text()[2]").get(default="").strip()
+        pub_metadata = [text.strip() for text in element.xpath("./div/a[1]/text()").getall()]
+        fields.append((urls, company_name, company_juridical_form, pub_metadata))
+    return fields
+
+
+def edited_page() -> bytes:
+    """page.html without the company name, the pdf url or the metadata of some publication elements"""
+    tree = lxml.html.fromstring(LISTING_PAGE.read_text(encoding="utf-8"))
+    elements = tree.xpath(LISTING_XPATH)
+    for node in elements[0].xpath("./div/p/font"):
+        node.getparent().remove(node)
+    for node in elements[1].xpath("./div//a[substring(@href, string-length(@href) - 3) = '.pdf']"):
+        node.getparent().remove(node)
+    for node in elements[2].xpath("./div/a[1]"):
+        node.getparent().remove(node)
+    for node in elements[-1].xpath("./div"):
+        node.getparent().remove(node)
+    return lxml.html.tostring(tree, encoding="unicode").encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "body", [LISTING_PAGE.read_bytes(), listing_page(3), edited_page()], ids=["page.html", "synthesized", "edited"]
+)
+def test_parse_listing_matches_the_element_queries(body):
+    root = response(body).selector.root
+    records = parse_listing(root, BASE_URL)
+    expected = reference_fields(body)
+    assert len(records) == len(expected) > 0
+    for record, (urls, company_name, juridical_form, pub_metadata) in zip(records, expected):
+        assert record.pdf_relative_url == (urls[0] if len(urls) == 1 else None)
+        assert record.company_name == company_name
+        assert record.company_juridical_form == juridical_form
+        if len(pub_metadata) in (4, 6):
+            assert record.address == pub_metadata[0]
+            assert record.vat == pub_metadata[1].replace(".", "").strip()
+            assert record.act_description == pub_metadata[2]
+            assert (record.publication_date, record.publication_number) == extract_publication_date_and_number(
+                pub_metadata[3]
+            )
+        else:
+            assert record.vat is None and record.publication_number is None
+
+
+def test_parse_listing_page_html():
+    records = parse_listing(response(LISTING_PAGE.read_bytes()).selector.root, BASE_URL)
+    assert len(records) == 100
+    assert {i: records[i] for i in EXPECTED_RECORDS} == EXPECTED_RECORDS
+
+
+def test_parse_listing_edited_page():
+    records = parse_listing(response(edited_page()).selector.root, BASE_URL)
+    assert len(records) == 100
+    assert records[0] == replace(EXPECTED_RECORDS[0], company_name=None)
+    assert records[1] == replace(EXPECTED_RECORDS[1], pdf_relative_url=None, pdf_absolute_url=None, pubid=None)
+    metadata = ("address", "vat", "act_description", "street", "zipcode", "city", "publication_date")
+    assert records[2] == replace(EXPECTED_RECORDS[2], **dict.fromkeys(metadata), publication_number=None)
+    assert records[99] == NO_RECORD
+
+
+def test_parse_num_results():
+    assert parse_num_results(LISTING_PAGE.read_text(encoding="utf-8")) == 109
+    assert parse_num_results("<html></html>") is None
+
+
+def test_parse_page_number():
+    assert parse_page_number("/cgi_tsv/rech_res.pl?btw=0471938850&page=3") == 3
+    assert parse_page_number("/cgi_tsv/rech_res.pl?btw=0471938850") is None
+    assert parse_page_number(None) is None
+
+
+def test_extract_address():
+    assert extract_address("RUE JACQUES JORDAENS 32A, BTE6 1000 BRUXELLES") == (
+        "BRUXELLES",
+        "1000",
+        "RUE JACQUES JORDAENS 32A, BTE6",
+    )
+    assert extract_address("BRUXELLES") == (None, None, None)
+    assert extract_address(None) == (None, None, None)
+
+
+def test_extract_publication_date_and_number():
+    assert extract_publication_date_and_number("2024-06-05 / 0402585") == (date(2024, 6, 5), "0402585")
+    assert extract_publication_date_and_number("1998 / 0402585") == (date(1998, 1, 1), "0402585")
+    assert extract_publication_date_and_number("2024-06-05") == (None, None)
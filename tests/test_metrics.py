@@ -0,0 +1,74 @@
+import threading
+import urllib.request
+
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from src.metrics import NULL_METRICS, Histogram, Metrics, MetricsExtension, _MetricsServer
+
+
+def test_histogram():
+    histogram = Histogram()
+    for i in range(1, 101):
+        histogram.observe(i / 1000)  # 1 to 100 ms
+    assert histogram.count == 100 and histogram.max == 0.1
+    assert 0.025 <= histogram.quantile(0.5) <= 0.05
+    assert 0.05 <= histogram.quantile(0.99) <= 0.1
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_metrics():
+    metrics = Metrics()
+    with metrics.timer("ocr"):
+        pass
+    metrics.observe("pdf_download", None)  # unknown latency
+    metrics.inc("pdf_bytes", 1024)
+    metrics.inc("pdf_bytes", 1024)
+    metrics.set_gauge("uploads_pending", 3)
+    metrics.set_gauge("uploads_pending", 1)
+    assert metrics.to_dict()["counters"] == {"pdf_bytes": 2048}
+    assert metrics.to_dict()["gauges"] == {"uploads_pending": {"value": 1, "max": 3}}
+    assert list(metrics.to_dict()["stages"]) == ["ocr"]
+
+    stats = MemoryStatsCollector(get_crawler())
+    metrics.to_stats(stats)
+    assert stats.get_value("metrics/ocr/count") == 1 and stats.get_value("metrics/uploads_pending/max") == 3
+
+    text = metrics.render_prometheus()
+    assert 'belgian_journal_stage_seconds_count{stage="ocr"} 1' in text
+    assert "belgian_journal_pdf_bytes_total 2048" in text
+
+
+def test_null_metrics_record_nothing():
+    with NULL_METRICS.timer("ocr"):
+        NULL_METRICS.inc("pdf_bytes")
+        NULL_METRICS.set_gauge("uploads_pending", 1)
+    assert NULL_METRICS.to_dict() == {"stages": {}, "counters": {}, "gauges": {}}
+
+
+def test_extension_settings():
+    with pytest.raises(NotConfigured):
+        MetricsExtension.from_crawler(get_crawler(settings_dict={"METRICS": False}))
+    extension = MetricsExtension.from_crawler(get_crawler(settings_dict={"METRICS": True, "METRICS_PORT": 9410}))
+    assert (extension.host, extension.port) == ("127.0.0.1", 9410)
+    extension = MetricsExtension.from_crawler(
+        get_crawler(settings_dict={"METRICS": True, "METRICS_HOST": "0.0.0.0", "METRICS_PORT": 9410})
+    )
+    assert extension.host == "0.0.0.0"
+
+
+def test_endpoint_listens_on_the_loopback_interface():
+    metrics = Metrics()
+    metrics.inc("pdf_bytes", 1)
+    server = _MetricsServer("127.0.0.1", 0, metrics)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert b"belgian_journal_pdf_bytes_total 1" in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
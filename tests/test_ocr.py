@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+
+from benchmarks.fixtures import LocalDocumentAnalysisClient, record_ocr_results
+from src.ocr import AdaptiveLimiter, OcrCache, OcrClient, dump_analyze_result, load_analyze_result
+from src.storage import MemoryBlobStore
+
+
+@pytest.fixture(scope="module")
+def recorded(tmp_path_factory):
+    results_dir = tmp_path_factory.mktemp("ocr_results")
+    return results_dir, record_ocr_results(results_dir)
+
+
+def create_client(results_dir, throttle_rate: float = 0.0, **kwargs) -> tuple[OcrClient, LocalDocumentAnalysisClient]:
+    local = LocalDocumentAnalysisClient(results_dir, throttle_rate=throttle_rate)
+    client = OcrClient(local, polling_interval=0.001, **kwargs)
+    local.raw_response_hook = client.on_response
+    return client, local
+
+
+def test_limiter():
+    limiter = AdaptiveLimiter(initial=8, maximum=9)
+    limiter.on_throttled()
+    assert limiter.limit == 4
+    for _ in range(5):  # roughly +1 per round of 4 jobs
+        limiter.on_success()
+    assert limiter.limit == 5
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 9
+    for _ in range(10):
+        limiter.on_throttled()
+    assert limiter.limit == 1
+
+
+def test_limiter_bounds_the_jobs_in_flight():
+    limiter = AdaptiveLimiter(initial=3)
+    max_in_flight = 0
+
+    async def job():
+        nonlocal max_in_flight
+        await limiter.acquire()
+        max_in_flight = max(max_in_flight, limiter.in_flight)
+        await asyncio.sleep(0.001)
+        await limiter.release()
+
+    async def run():
+        await asyncio.gather(*(job() for _ in range(20)))
+
+    asyncio.run(run())
+    assert max_in_flight == 3 and limiter.in_flight == 0
+
+
+def test_analyze(recorded):
+    results_dir, results = recorded
+    client, local = create_client(results_dir)
+    for path, expected in results.items():
+        result = asyncio.run(client.analyze(path.read_bytes()))
+        assert [line.content for page in result.pages for line in page.lines] == [
+            line.content for page in expected.pages for line in page.lines
+        ]
+    assert local.num_requests == len(results)
+
+
+def test_a_throttled_request_halves_the_limit_once(recorded):
+    results_dir, results = recorded
+    client, local = create_client(results_dir, throttle_rate=1.0, limiter=AdaptiveLimiter(initial=8))
+
+    def on_response(response):
+        client.on_response(response)
+        local.throttle_rate = 0.0  # only the first request is throttled
+
+    local.raw_response_hook = on_response
+    asyncio.run(client.analyze(next(iter(results)).read_bytes()))
+    assert local.num_requests == 2
+    assert client.limiter.limit == 4
+
+
+def test_gives_up_after_max_retries(recorded):
+    results_dir, results = recorded
+    client, local = create_client(results_dir, throttle_rate=1.0, max_retries=2)
+    with pytest.raises(HttpResponseError):
+        asyncio.run(client.analyze(next(iter(results)).read_bytes()))
+    assert local.num_requests == 3
+    assert client.limiter.in_flight == 0
+
+
+def lines(result) -> list:
+    return [
+        (line.content, [(point.x, point.y) for point in line.polygon]) for page in result.pages for line in page.lines
+    ]
+
+
+def test_dump_and_load_analyze_result(recorded):
+    _, results = recorded
+    for result in results.values():
+        loaded = load_analyze_result(dump_analyze_result(result))
+        assert lines(loaded) == lines(result)
+        assert [(page.width, page.height, page.unit) for page in loaded.pages] == [
+            (page.width, page.height, page.unit) for page in result.pages
+        ]
+
+
+def test_cache(recorded, tmp_path):
+    _, results = recorded
+    path, result = next(iter(results.items()))
+    key = OcrCache.key(path.read_bytes())
+    assert key != OcrCache.key(path.read_bytes(), "prebuilt-layout")
+    blob_store = MemoryBlobStore()
+    cache = OcrCache(tmp_path / "first", blob_store=blob_store)
+    assert asyncio.run(cache.get(key)) is None
+    asyncio.run(cache.put(key, result))
+    assert lines(asyncio.run(cache.get(key))) == lines(result)
+    assert list(blob_store.list_names()) == [f"_ocr_cache/{key}"]
+
+    # another container finds the result in the blob store and keeps it on its local disk
+    other = OcrCache(tmp_path / "second", blob_store=blob_store)
+    assert lines(asyncio.run(other.get(key))) == lines(result)
+    blob_store.delete(f"_ocr_cache/{key}")
+    assert asyncio.run(other.get(key)) is not None
+    assert (cache.hits, cache.misses, other.hits) == (1, 1, 2)
+
+
+def test_cache_evicts_the_least_recently_used_results(recorded, tmp_path):
+    _, results = recorded
+    result = next(iter(results.values()))
+    size = len(dump_analyze_result(result))
+    cache = OcrCache(tmp_path, max_bytes=int(size * 2.5))
+    for key in ("a", "b", "c"):
+        asyncio.run(cache.put(key, result))
+    assert asyncio.run(cache.get("a")) is None
+    assert asyncio.run(cache.get("c")) is not None
@@ -0,0 +1,150 @@
+from datetime import date
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from scrapy.exceptions import DropItem
+from scrapy.http import Request, Response
+from scrapy.pipelines.media import MediaPipeline
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from benchmarks.fixtures import PDFS
+from src.items import LegalEntityItem
+from src.metrics import Metrics
+from src.pipelines import LegalEntityFilePipeline, LegalEntityPipeline
+from src.storage import MemoryBlobStore, delete_blobs
+
+PUBLICATIONS = [
+    "471938850/2024/07/11/0104762.json",
+    "471938850/2024/05/08/0071723.json",
+    "463318421/2023/01/02/0001234.json",
+]
+INTERNAL_BLOBS = [
+    "_ocr_cache/ab/abcdef.json",
+    "_checkpoints/legal-entity-date-spider/2024-01-01_2024-12-31.json",
+    "_shards/legal-entity-vat-spider/pending/471938850",
+    "_dataset/date=2024-07-11/part-00000.jsonl",
+    "_dataset/_manifest.json",
+    "_index/publications.bin",
+    "_index/summary.json",
+]
+
+
+def settings(**values) -> Settings:
+    project_settings = Settings()
+    project_settings.setmodule("src.settings")
+    project_settings.setdict(
+        {
+            "OCR_CACHE_BLOB_PREFIX": "_ocr_cache/",
+            "CHECKPOINT_BLOB": "_checkpoints/{spider}/{start_date}_{end_date}.json",
+            "RUN_SUMMARY_BLOB": "_index/summary.json",
+            **values,
+        }
+    )
+    return project_settings
+
+
+def spider(**values) -> SimpleNamespace:
+    store = MemoryBlobStore()
+    for name in PUBLICATIONS + INTERNAL_BLOBS:
+        store.write(name, b"{}")
+    return SimpleNamespace(settings=settings(**values), blob_store=store, publication_index=None)
+
+
+def test_internal_prefixes():
+    assert LegalEntityPipeline.internal_prefixes(settings()) == (
+        "_ocr_cache/",
+        "_checkpoints/",
+        "_shards/",
+        "_dataset/",
+        "_index/publications.bin",
+        "_index/summary.json",
+    )
+    # BLOBs that are disabled are not excluded
+    prefixes = LegalEntityPipeline.internal_prefixes(
+        settings(OCR_CACHE_BLOB_PREFIX=None, CHECKPOINT_BLOB=None, RUN_SUMMARY_BLOB=None)
+    )
+    assert prefixes == ("_shards/", "_dataset/", "_index/publications.bin")
+
+
+@pytest.mark.parametrize(
+    "values, deleted",
+    [
+        ({}, PUBLICATIONS),
+        ({"CLEANUP_PREFIXES": ["471938850/"]}, PUBLICATIONS[:2]),
+        ({"CLEANUP_DATE_PREFIX": "2024/05"}, PUBLICATIONS[1:2]),
+        ({"CLEANUP_PREFIXES": ["_"]}, []),
+    ],
+    ids=["everything", "prefix", "date", "internal prefix"],
+)
+def test_cleanup_only_deletes_publications(values, deleted):
+    legal_entity_spider = spider(**values)
+    names = list(LegalEntityPipeline.cleanup_names(legal_entity_spider))
+    # the publication index is deleted with the publications, it would still contain them
+    assert names == ["_index/publications.bin", *sorted(deleted)]
+
+    delete_blobs(legal_entity_spider.blob_store, names, batch_size=2)
+    remaining = set(legal_entity_spider.blob_store.list_names())
+    assert remaining == (set(PUBLICATIONS) - set(deleted)) | (set(INTERNAL_BLOBS) - {"_index/publications.bin"})
+
+
+PDF_URL = "https://www.ejustice.just.fgov.be/tsv_pdf/2024/07/11/24104762.pdf"
+
+
+def file_pipeline(tmp_path, persist_pdfs: bool) -> tuple[LegalEntityFilePipeline, MediaPipeline.SpiderInfo]:
+    crawler = get_crawler(settings_dict={"FILES_STORE": str(tmp_path / "pdfs"), "PERSIST_PDFS": persist_pdfs})
+    pipeline = LegalEntityFilePipeline.from_crawler(crawler)
+    info = MediaPipeline.SpiderInfo(SimpleNamespace(settings=crawler.settings, metrics=Metrics()))
+    return pipeline, info
+
+
+def publication_item() -> LegalEntityItem:
+    return LegalEntityItem(
+        vat="471938850",
+        publication_id="24104762",
+        publication_number="0104762",
+        publication_date=date(2024, 7, 11),
+        publication_meta={},
+        file_urls=[PDF_URL],
+    )
+
+
+def download(pipeline: LegalEntityFilePipeline, info, item: LegalEntityItem) -> dict:
+    """the result of the media pipeline for the item that downloaded the PDF"""
+    request = Request(PDF_URL)
+    response = Response(PDF_URL, body=PDFS[0].read_bytes(), request=request)
+    checksum = pipeline.file_downloaded(response, request, info, item=item)
+    return {"url": PDF_URL, "path": pipeline.file_path(request), "checksum": checksum, "status": "downloaded"}
+
+
+def test_downloaded_pdfs_are_kept_in_memory(tmp_path):
+    pipeline, info = file_pipeline(tmp_path, persist_pdfs=False)
+    item = publication_item()
+    result = download(pipeline, info, item)
+    assert pipeline.item_completed([(True, result)], item, info) is item
+    assert item["file_body"] == PDFS[0].read_bytes() and "file_path" not in item
+    assert not list((tmp_path / "pdfs").rglob("*.pdf"))
+    assert info.spider.metrics.to_dict()["counters"]["pdf_bytes"] == len(item["file_body"])
+
+    # another publication with the same url gets the cached result of the download, without the PDF
+    with pytest.raises(DropItem, match="already downloaded"):
+        pipeline.item_completed([(True, result)], publication_item(), info)
+
+
+def test_downloaded_pdfs_are_persisted(tmp_path):
+    pipeline, info = file_pipeline(tmp_path, persist_pdfs=True)
+    item = publication_item()
+    result = download(pipeline, info, item)
+    assert pipeline.item_completed([(True, result)], item, info) is item
+    assert item["file_path"] == str(tmp_path / "pdfs" / "2024/07/11/24104762.pdf")
+    assert Path(item["file_path"]).read_bytes() == item["file_body"]
+
+    # the PDF is read from disk for another publication with the same url
+    duplicate = pipeline.item_completed([(True, result)], publication_item(), info)
+    assert duplicate["file_path"] == item["file_path"] and "file_body" not in duplicate
+
+    # PDFs on disk from a previous run are not downloaded again, also when they are not persisted anymore
+    pipeline, info = file_pipeline(tmp_path, persist_pdfs=False)
+    previous_run = pipeline.item_completed([(True, {**result, "status": "uptodate"})], publication_item(), info)
+    assert previous_run["file_path"] == item["file_path"]
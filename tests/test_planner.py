@@ -0,0 +1,48 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from src.planner import DateWindow, DateWindowPlanner
+
+
+def test_initial_windows():
+    windows = DateWindowPlanner(initial_days=14).initial_windows(date(2024, 1, 1), date(2024, 1, 31))
+    assert windows == [
+        DateWindow(date(2024, 1, 1), date(2024, 1, 14)),
+        DateWindow(date(2024, 1, 15), date(2024, 1, 28)),
+        DateWindow(date(2024, 1, 29), date(2024, 1, 31)),
+    ]
+
+
+def test_split():
+    planner = DateWindowPlanner(max_results=1000)
+    window = DateWindow(date(2024, 1, 1), date(2024, 1, 14))  # monday up to and including sunday
+    assert planner.split(window, 1000) == [window]
+    parts = planner.split(window, 2500)
+    assert len(parts) == 3
+    assert parts[0].start == window.start and parts[-1].end == window.end
+    assert all(left.end + timedelta(days=1) == right.start for left, right in zip(parts, parts[1:]))
+    single_day = DateWindow(date(2024, 1, 1), date(2024, 1, 1))
+    assert planner.split(single_day, 5000) == [single_day]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_every_day_is_covered_by_one_window(seed):
+    rng = random.Random(seed)
+    start, end = date(2020, 1, 1), date(2021, 6, 30)
+    per_day = {
+        start + timedelta(days=i): rng.randint(0, 30)
+        if (start + timedelta(days=i)).weekday() >= 5
+        else rng.randint(0, 600)
+        for i in range((end - start).days + 1)
+    }
+    planner = DateWindowPlanner(max_results=2000)
+    result = planner.simulate(start, end, lambda window: sum(per_day[day] for day in window.dates()))
+
+    days = [day for window in result.windows for day in window.dates()]
+    assert days == sorted(per_day)
+    for window in result.windows:
+        assert window.days == 1 or sum(per_day[day] for day in window.dates()) <= planner.max_results
+    # fewer requests than one search per day
+    assert result.num_requests < sum(max(1, -(-count // 100)) for count in per_day.values())
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import pstats
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.profiling import ProfilingExtension, Sections
+
+
+def busy(seconds: float) -> int:
+    """a trivial function that keeps the profiled thread busy"""
+    end, count = time.perf_counter() + seconds, 0
+    while time.perf_counter() < end:
+        count += 1
+    return count
+
+
+def busy_pages(num_pages: int):
+    for page in range(num_pages):
+        busy(0.001)
+        yield page
+
+
+def profile(tmp_path, profiler: str) -> ProfilingExtension:
+    """profiles calls of busy and busy_pages, tagged as sections"""
+    module = sys.modules[__name__]
+    original = module.busy
+    extension = ProfilingExtension(
+        profiler,
+        tmp_path,
+        sample_interval=0.001,
+        sections={"busy": f"{__name__}:busy", "pages": f"{__name__}:busy_pages"},
+    )
+    extension.spider_opened(SimpleNamespace(name="legal-entity-date-spider"))
+    assert module.busy is not original  # patched with the timed wrapper
+    busy(0.2)
+    assert list(busy_pages(3)) == [0, 1, 2]
+    extension.spider_closed(SimpleNamespace(name="legal-entity-date-spider"))
+    assert module.busy is original
+    return extension
+
+
+def assert_sections(extension: ProfilingExtension) -> None:
+    sections = json.loads((extension.output / "sections.json").read_text())
+    assert sections["busy"]["calls"] == 4 and sections["busy"]["seconds"] >= 0.2
+    assert sections["pages"]["calls"] == 1 and sections["pages"]["seconds"] >= 0.003
+
+
+def test_cprofile(tmp_path):
+    extension = profile(tmp_path, "cprofile")
+    assert extension.output.parent == tmp_path and extension.output.name.startswith("legal-entity-date-spider-")
+    assert sorted(path.name for path in extension.output.iterdir()) == [
+        "profile.pstats",
+        "profile.txt",
+        "sections.json",
+    ]
+    stats = pstats.Stats(str(extension.output / "profile.pstats"))
+    assert any(name == "busy" for _, _, name in stats.stats)
+    summary = (extension.output / "profile.txt").read_text()
+    assert "Ordered by: cumulative time" in summary and "(busy)" in summary
+    assert_sections(extension)
+
+
+def test_sampler(tmp_path):
+    extension = profile(tmp_path, "sampler")
+    assert sorted(path.name for path in extension.output.iterdir()) == [
+        "profile.collapsed",
+        "profile.txt",
+        "sections.json",
+    ]
+    stacks = (extension.output / "profile.collapsed").read_text().splitlines()
+    # the samples of the profiled thread pass through the tagged function
+    assert any(stack.startswith("[busy];MainThread;") and "busy (test_profiling.py:" in stack for stack in stacks)
+
+    summary = (extension.output / "profile.txt").read_text().splitlines()
+    assert summary[0].startswith(f"{extension.sampler.num_samples} samples of ")
+    frames = {line[19:]: line.split()[:2] for line in summary[3:]}  # total %, self %, frame
+    total, own = frames["[busy]"]
+    assert float(total.rstrip("%")) > 0 and float(own.rstrip("%")) == 0  # a tag is never the innermost frame
+    totals = [float(line.split()[0].rstrip("%")) for line in summary[3:]]
+    assert totals == sorted(totals, reverse=True)
+    assert_sections(extension)
+
+
+def test_sections_of_coroutines():
+    async def sleep():
+        await asyncio.sleep(0.01)
+
+    sections = Sections()
+    asyncio.run(sections.wrap("sleep", sleep)())
+    assert sections.calls["sleep"] == 1 and sections.seconds["sleep"] >= 0.01
+
+
+def test_unknown_profiler(tmp_path):
+    with pytest.raises(ValueError):
+        ProfilingExtension("perf", tmp_path)
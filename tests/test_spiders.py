@@ -0,0 +1,178 @@
+from datetime import date
+from itertools import takewhile
+
+import pytest
+import scrapy
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.project import get_project_settings
+
+from benchmarks.fixtures import LISTING_PAGE, listing_page
+from benchmarks.run import OfflineDateSpider
+from src.index import PublicationIndex
+from src.items import LegalEntityItem, PublicationRecord
+from src.listing import parse_listing
+from src.spiders.legal_entities import LegalEntityVatSpider
+from src.stats import RunStatistics
+from src.storage import MemoryBlobStore
+
+BASE_URL = "https://www.ejustice.just.fgov.be"
+VAT = "471938850"
+PUBLICATION_DATE = date(2024, 7, 11)
+
+
+class OfflineVatSpider(LegalEntityVatSpider):
+    """VAT spider of which the Azure resources are replaced by local stand-ins (like benchmarks.run.OfflineDateSpider)"""
+
+    def __init__(self, settings: dict):
+        scrapy.Spider.__init__(self)
+        self.settings = get_project_settings().copy()
+        self.settings.setdict(settings, priority="cmdline")
+        self.vat_file = None
+        self.azure_container_name = "test"
+        self.blob_store = MemoryBlobStore()
+        self.publication_index = PublicationIndex()
+        self.run_statistics = RunStatistics(self.publication_index)
+
+
+def vat_response(spider: OfflineVatSpider, body: bytes, page: int = 1, **meta) -> HtmlResponse:
+    meta = {"vat": VAT, "start_date": None, "end_date": None, **meta}
+    if page > 1:
+        meta["page"] = page
+    url = spider.format_url(meta)
+    return HtmlResponse(url=url, body=body, encoding="utf-8", request=Request(url, meta=meta))
+
+
+def date_response(spider: OfflineDateSpider, body: bytes, page: int = 1, **meta) -> HtmlResponse:
+    meta = {"start_date": spider.start_date, "end_date": spider.end_date, "page": page, **meta}
+    url = spider.format_url(meta)
+    return HtmlResponse(url=url, body=body, encoding="utf-8", request=Request(url, meta=meta))
+
+
+def split(results) -> tuple[list[LegalEntityItem], list[Request]]:
+    results = list(results)
+    items = [result for result in results if isinstance(result, LegalEntityItem)]
+    requests = [result for result in results if isinstance(result, Request)]
+    assert len(items) + len(requests) == len(results)
+    return items, requests
+
+
+def expected_records(body: bytes, threshold: date = date(2000, 1, 1)) -> list[PublicationRecord]:
+    """the records of the listing page with a PDF until the first publication before the threshold (the page is sorted
+    from new to old)
+    """
+    records = parse_listing(HtmlResponse(url=BASE_URL, body=body, encoding="utf-8").selector.root, BASE_URL)
+    records = takewhile(lambda record: record.publication_date >= threshold, records)
+    return [record for record in records if record.pdf_relative_url]
+
+
+def test_parse_streams_the_publications_of_page_html():
+    spider = OfflineVatSpider({"STREAM_PUBLICATIONS": True, "PUB_DATE_THRESHOLD": date(2010, 1, 1)})
+    body = LISTING_PAGE.read_bytes()
+    # one publication was scraped in a previous run
+    spider.publication_index.add(VAT, "0071723", date(2024, 5, 8))
+
+    items, requests = split(spider.parse(vat_response(spider, body)))
+    # page.html lists publications from before the threshold, the next page is not needed
+    assert requests == []
+    expected = [record for record in expected_records(body, date(2010, 1, 1)) if record.publication_number != "0071723"]
+    assert len(expected) < len(expected_records(body))
+    assert [item["publication_number"] for item in items] == [record.publication_number for record in expected]
+    assert len(items) > 0
+
+    item, record = items[0], expected[0]
+    assert item["vat"] == VAT and item["publication_id"] == record.pubid == "24104762"
+    assert item["publication_date"] == PUBLICATION_DATE
+    assert item["file_urls"] == ["https://www.ejustice.just.fgov.be/tsv_pdf/2024/07/11/24104762.pdf"]
+    assert item["publication_meta"]["publication_date"] == str(PUBLICATION_DATE)
+    assert item["publication_meta"]["company_name"] == record.company_name
+
+
+def test_parse_requests_the_next_page_before_the_publications():
+    spider = OfflineVatSpider({"STREAM_PUBLICATIONS": True, "PUB_DATE_THRESHOLD": date(2000, 1, 1)})
+    results = list(spider.parse(vat_response(spider, LISTING_PAGE.read_bytes())))
+    # 100 publications after the threshold: the next page is requested while the publications are processed
+    assert isinstance(results[0], Request)
+    items, requests = split(results)
+    assert len(items) == len(expected_records(LISTING_PAGE.read_bytes()))
+    assert [request.meta["page"] for request in requests] == [2]
+    assert requests[0].url == spider.format_url({"vat": VAT, "page": 2}) and requests[0].callback == spider.parse
+
+    # the last page has less than 100 publications
+    last_page = listing_page(2, num_elements=9)
+    items, requests = split(spider.parse(vat_response(spider, last_page, page=2)))
+    assert len(items) == len(expected_records(last_page)) > 0 and requests == []
+
+
+def test_parse_collects_the_publications_of_all_pages():
+    spider = OfflineVatSpider({"STREAM_PUBLICATIONS": False, "PUB_DATE_THRESHOLD": date(2000, 1, 1)})
+    items, requests = split(spider.parse(vat_response(spider, listing_page(1))))
+    assert items == [] and len(requests) == 1
+    assert len(requests[0].meta["publications"]) == 100
+
+    last_page = listing_page(2, num_elements=9)
+    items, requests = split(spider.parse(vat_response(spider, last_page, **requests[0].meta)))
+    expected = expected_records(listing_page(1)) + expected_records(last_page)
+    assert requests == [] and [item["publication_number"] for item in items] == [
+        record.publication_number for record in expected
+    ]
+
+
+def test_parse_page_without_publications():
+    spider = OfflineVatSpider({"STREAM_PUBLICATIONS": True})
+    body = b"<html><body>Geen tekst komt overeen met uw zoekopdracht</body></html>"
+    assert list(spider.parse(vat_response(spider, body))) == []
+
+
+def results_page(page: int, num_results: int) -> bytes:
+    """a full listing page of which the first page shows `num_results` results"""
+    return listing_page(page, publication_date=PUBLICATION_DATE).replace(
+        b"Lijst (109)", f"Lijst ({num_results})".encode()
+    )
+
+
+def test_listing_fanout_requests_all_pages_of_a_date_search():
+    spider = OfflineDateSpider({"STREAM_PUBLICATIONS": True, "LISTING_FANOUT": True}, PUBLICATION_DATE)
+    items, requests = split(spider.parse(date_response(spider, results_page(1, 450))))
+    assert len(items) == len(expected_records(results_page(1, 450)))
+    assert [(request.meta["page"], request.meta["num_pages"]) for request in requests] == [(p, 5) for p in range(2, 6)]
+
+    # the fanned out pages do not request further pages
+    items, requests = split(spider.parse(date_response(spider, results_page(3, 450), **requests[1].meta)))
+    assert len(items) == len(expected_records(results_page(3, 450))) and requests == []
+
+    # the number of results grew in the meantime: the last page is full, the pages after it are probed
+    items, requests = split(spider.parse(date_response(spider, results_page(5, 450), page=5, num_pages=5)))
+    assert [(request.meta["page"], request.meta.get("num_pages")) for request in requests] == [(6, 5)]
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"STREAM_PUBLICATIONS": True, "LISTING_FANOUT": False},
+        # without streaming the publications of the pages are collected one page after the other
+        {"STREAM_PUBLICATIONS": False, "LISTING_FANOUT": True},
+    ],
+    ids=["no fanout", "no streaming"],
+)
+def test_date_search_without_fanout_requests_the_next_page(settings):
+    spider = OfflineDateSpider(settings, PUBLICATION_DATE)
+    _, requests = split(spider.parse(date_response(spider, results_page(1, 450))))
+    assert [request.meta["page"] for request in requests] == [2]
+    assert "num_pages" not in requests[0].meta
+
+
+def test_vat_search_does_not_fan_out():
+    # VAT searches stop at the publication date threshold, the pages after it are never requested
+    spider = OfflineVatSpider({"STREAM_PUBLICATIONS": True, "LISTING_FANOUT": True})
+    _, requests = split(spider.parse(vat_response(spider, results_page(1, 450))))
+    assert [request.meta["page"] for request in requests] == [2]
+
+
+@pytest.mark.parametrize("incremental, start_date", [(False, None), (True, date(2024, 5, 8))])
+def test_vat_incremental_is_opt_in(incremental, start_date):
+    settings = {"VAT_INCREMENTAL": incremental} if incremental else {}
+    spider = OfflineVatSpider(settings)
+    spider.publication_index.add(VAT, "0071723", date(2024, 5, 8))
+    # by default the older publications are listed again, they were maybe dropped or failed in an earlier run
+    request = spider.legal_entity_request({"vat": VAT, "last_publication_date": date(2024, 7, 11)})
+    assert request.meta["start_date"] == start_date
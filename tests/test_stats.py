@@ -0,0 +1,49 @@
+import json
+from datetime import date
+
+from src.index import PublicationIndex
+from src.stats import RunStatistics
+from src.storage import MemoryBlobStore
+
+
+def test_without_index_every_upload_is_new():
+    statistics = RunStatistics()
+    statistics.record("0471938850", "0000001")
+    statistics.record("0471938850", "0000002")
+    statistics.record("0203201340", "0000003")
+    summary = statistics.summary()
+    assert (summary["num_companies"], summary["num_publications"]) == (2, 3)
+    assert summary["last_run"] | {"finished_at": None} == {
+        "finished_at": None,
+        "new_companies": 2,
+        "new_publications": 3,
+        "uploads": 3,
+    }
+
+
+def test_publications_in_the_index_are_not_new():
+    index = PublicationIndex()
+    index.add("0471938850", "0000001", date(2024, 1, 1))
+    statistics = RunStatistics(index)
+    for vat, number in (("0471938850", "0000001"), ("0471938850", "0000002"), ("0203201340", "0000003")):
+        statistics.record(vat, number)
+        index.add(vat, number)
+    assert (len(statistics.new_vats), statistics.num_new_publications, statistics.num_uploads) == (1, 2, 3)
+    # without a previous summary the index knows the totals
+    summary = statistics.summary()
+    assert (summary["num_companies"], summary["num_publications"]) == (2, 3)
+
+
+def test_save_adds_the_run_to_the_previous_summary():
+    store = MemoryBlobStore()
+    first = RunStatistics()
+    first.record("0471938850", "0000001")
+    first.save(store, "_index/summary.json")
+
+    second = RunStatistics()
+    second.record("0203201340", "0000002")
+    second.record("0203201340", "0000003")
+    summary = second.save(store, "_index/summary.json")
+    assert (summary["num_companies"], summary["num_publications"]) == (2, 3)
+    assert json.loads(store.read("_index/summary.json")) == summary
+    assert summary["last_run"]["new_publications"] == 2
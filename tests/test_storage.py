@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from src.storage import BlobStore, LocalBlobStore, MemoryBlobStore, delete_blobs
+
+
+class BatchBlobStore(MemoryBlobStore):
+    """MemoryBlobStore with batch deletion, of which the batches can fail and one blob can not be deleted"""
+
+    def __init__(self, batches_fail: bool = False, undeletable: str = ""):
+        super().__init__()
+        self.batches_fail = batches_fail
+        self.undeletable = undeletable
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def delete(self, name):
+        if name == self.undeletable:
+            raise PermissionError(name)
+        with self._lock:
+            super().delete(name)
+
+    def delete_many(self, names):
+        if self.batches_fail:
+            raise NotImplementedError("batches are not supported")
+        self.batch_sizes.append(len(names))
+        failed = 0
+        for name in names:
+            try:
+                self.delete(name)
+            except PermissionError:
+                failed += 1
+        return failed
+
+
+def fill(store: BlobStore, num_blobs: int = 1000) -> list[str]:
+    names = [f"{i:010d}/2024/07/11/{i:07d}.json" for i in range(num_blobs)]
+    for name in names:
+        store.write(name, b"{}")
+    return names
+
+
+@pytest.mark.parametrize("batch_size", [1, 256])
+def test_delete_blobs(batch_size):
+    store = BatchBlobStore(undeletable="0000000007/2024/07/11/0000007.json")
+    names = fill(store)
+    assert delete_blobs(store, iter(names), batch_size=batch_size) == (999, 1)
+    assert list(store.list_names()) == ["0000000007/2024/07/11/0000007.json"]
+    assert sorted(store.batch_sizes) == ([] if batch_size == 1 else [232, 256, 256, 256])
+
+
+def test_delete_blobs_one_by_one_when_batches_fail():
+    store = BatchBlobStore(batches_fail=True)
+    names = fill(store)
+    assert delete_blobs(store, names, batch_size=100) == (1000, 0)
+    assert not store.blobs
+
+
+def test_local_blob_store(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    store.write("0471938850/2024/07/11/0104762.json", b"{}")
+    store.write("_index.bin", b"index")
+    assert list(store.list_names()) == ["0471938850/2024/07/11/0104762.json", "_index.bin"]
+    assert list(store.list_names("_")) == ["_index.bin"]
+    assert store.read("_index.bin") == b"index" and store.read("missing") is None
+    assert delete_blobs(store, store.list_names("0471938850/")) == (1, 0)
+    assert list(store.list_names()) == ["_index.bin"]
+
+
+def test_blob_stores_implement_the_interface():
+    class IncompleteBlobStore(BlobStore):
+        def read(self, name):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteBlobStore()
@@ -0,0 +1,82 @@
+import asyncio
+
+from src.storage import AsyncBlobStore, LocalBlobStore, MemoryBlobStore, ThreadedBlobStore
+from src.uploader import BlobUploader
+
+
+class FlakyBlobStore(AsyncBlobStore):
+    """writes to a MemoryBlobStore, fails the first `num_failures` writes of every blob and tracks the concurrency"""
+
+    def __init__(self, num_failures: int = 0):
+        self.store = MemoryBlobStore()
+        self.num_failures = num_failures
+        self.attempts: dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.closed = False
+
+    async def write(self, name, data, tags=None, content_encoding=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            if self.attempts[name] <= self.num_failures:
+                raise ConnectionError(name)
+            self.store.write(name, data, tags, content_encoding)
+        finally:
+            self.in_flight -= 1
+
+    async def close(self):
+        self.closed = True
+
+
+def test_uploads_with_bounded_concurrency():
+    store = FlakyBlobStore()
+    uploaded = []
+
+    async def upload():
+        uploader = BlobUploader(store, max_concurrency=4)
+        for i in range(50):
+            await uploader.submit(f"{i}.json", b"{}", {"vat": str(i)}, on_success=lambda i=i: uploaded.append(i))
+        await uploader.close()
+        return uploader
+
+    uploader = asyncio.run(upload())
+    assert uploader.num_uploaded == 50 and uploader.num_failed == 0 and uploader.num_pending == 0
+    assert sorted(uploaded) == list(range(50))
+    assert len(store.store.blobs) == 50 and store.store.tags["7.json"] == {"vat": "7"}
+    assert store.max_in_flight == 4
+    assert store.closed
+
+
+def test_retries_failed_uploads():
+    store = FlakyBlobStore(num_failures=2)
+
+    async def upload(max_retries):
+        uploader = BlobUploader(store, max_retries=max_retries, backoff=0.001)
+        await uploader.submit(f"{max_retries}.json", b"{}")
+        await uploader.flush()
+        return uploader
+
+    uploader = asyncio.run(upload(max_retries=2))
+    assert (uploader.num_uploaded, uploader.num_failed) == (1, 0)
+    assert store.attempts["2.json"] == 3
+
+    uploader = asyncio.run(upload(max_retries=1))
+    assert (uploader.num_uploaded, uploader.num_failed) == (0, 1)
+    assert "1.json" not in store.store.blobs
+
+
+def test_threaded_blob_store(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    async def upload():
+        uploader = BlobUploader(ThreadedBlobStore(store), max_concurrency=2)
+        for i in range(5):
+            await uploader.submit(f"0471938850/2024/07/11/{i:07d}.json", b'{"i": %d}' % i)
+        await uploader.close()
+
+    asyncio.run(upload())
+    assert list(store.list_names("0471938850/")) == [f"0471938850/2024/07/11/{i:07d}.json" for i in range(5)]
+    assert store.read("0471938850/2024/07/11/0000003.json") == b'{"i": 3}'
@@ -0,0 +1,75 @@
+from datetime import date
+
+import pytest
+
+from src.spiders.legal_entities import LegalEntityVatSpider
+from src.vat_input import normalize_vat, read_legal_entities
+
+
+def test_normalize_vat():
+    assert normalize_vat("BE 0471.938.850") == "0471938850"
+    assert normalize_vat("471-938-850") == "0471938850"
+    assert normalize_vat(471938850) == "0471938850"
+    assert normalize_vat("04719388501") is None
+    assert normalize_vat("BE04719388X0") is None
+    assert normalize_vat(None) is None
+
+
+def test_read_text(tmp_path):
+    path = tmp_path / "vats.txt"
+    path.write_text("# companies\nBE 0471.938.850\n\ninvalid\n0203201340\n", encoding="utf-8")
+    legal_entities = read_legal_entities(path)
+    assert not isinstance(legal_entities, list)  # read lazily
+    assert [legal_entity["vat"] for legal_entity in legal_entities] == ["0471938850", "0203201340"]
+
+
+def test_read_csv(tmp_path):
+    path = tmp_path / "vats.csv"
+    path.write_text(
+        "vat,start_date,last_publication_date\n471938850,2020-01-01,\n0203201340,,2024-07-11\n123,20-01-01,\n",
+        encoding="utf-8",
+    )
+    assert list(read_legal_entities(path)) == [
+        {"vat": "0471938850", "start_date": date(2020, 1, 1), "end_date": None, "last_publication_date": None},
+        {"vat": "0203201340", "start_date": None, "end_date": None, "last_publication_date": date(2024, 7, 11)},
+    ]
+
+
+def test_read_csv_without_vat_column(tmp_path):
+    path = tmp_path / "vats.csv"
+    path.write_text("enterprise_number\n0471938850\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(read_legal_entities(path))
+
+
+def test_unsupported_file(tmp_path):
+    with pytest.raises(ValueError):
+        read_legal_entities(tmp_path / "vats.xlsx")
+
+
+@pytest.mark.parametrize(
+    "legal_entity, shard",
+    [
+        ({"vat": "0471938850"}, "471938850"),
+        ({"vat": "0471938850", "start_date": date(2020, 1, 1)}, "471938850/2020-01-01//"),
+        (
+            {"vat": "0203201340", "end_date": date(2024, 1, 1), "last_publication_date": date(2023, 5, 1)},
+            "203201340//2024-01-01/2023-05-01",
+        ),
+    ],
+)
+def test_shard_key(legal_entity, shard):
+    assert LegalEntityVatSpider.shard_key(legal_entity) == shard
+    parsed = LegalEntityVatSpider.parse_shard_key(shard)
+    assert parsed["vat"] == legal_entity["vat"]
+    assert {key: value for key, value in parsed.items() if value} == legal_entity
+
+
+def test_refresh_priority():
+    today = date.today()
+    priorities = [
+        LegalEntityVatSpider.refresh_priority(last_scraped)
+        for last_scraped in (today, date(today.year - 1, 1, 1), date(1900, 1, 1), None)
+    ]
+    assert priorities == sorted(priorities, reverse=True)
+    assert priorities[-2] > priorities[-1]